@@ -0,0 +1,356 @@
+"""Convergence diagnostics for MCMC samples.
+
+Implements the rank-normalized split-R-hat, bulk-ESS and tail-ESS of [1],
+vectorized over parameter dimensions, and OnlineDiagnostics, which updates
+bounded summaries chunk by chunk (using the classical split-R-hat, since
+rank normalization needs all samples). Samples are np.ndarray of shape
+(num_samples, ...) for a single chain, or (num_samples, num_chains, ...)
+with chain_axis=1 for multiple chains.
+
+#### References
+
+[1]:    Aki Vehtari, Andrew Gelman, Daniel Simpson, Bob Carpenter and
+        Paul-Christian Burkner. Rank-normalization, folding, and localization:
+        An improved R-hat for assessing convergence of MCMC.
+        _Bayesian Analysis_, 16(2):667-718, 2021.
+"""
+import functools
+
+import numpy as np
+import scipy.stats as stats
+
+_TAIL_QUANTILES = (0.05, 0.95)
+
+# default bounds for OnlineDiagnostics: number of monitored coordinates per
+# parameter, and number of retained (thinned) draws per chain.
+_ONLINE_MAX_PARAMS = 64
+_ONLINE_MAX_DRAWS = 4000
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Helper functions """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+def _to_chains(samples, chain_axis=None):
+    """Reshapes samples into (num_samples, num_chains, num_params)."""
+    samples = np.asarray(samples, dtype=np.float64)
+    if chain_axis is None:
+        samples = np.expand_dims(samples, 1)
+    elif chain_axis != 1:
+        samples = np.moveaxis(samples, chain_axis, 1)
+
+    num_samples, num_chains = samples.shape[:2]
+    return samples.reshape(num_samples, num_chains, -1)
+
+
+def _split_chains(samples):
+    """Splits each chain into two halves, dropping middle sample if odd."""
+    half = samples.shape[0] // 2
+    return np.concatenate([samples[:half], samples[-half:]], axis=1)
+
+
+def _rank_normalize(samples):
+    """Replaces samples by normal scores of their pooled ranks."""
+    num_samples, num_chains, num_params = samples.shape
+    ranks = stats.rankdata(samples.reshape(-1, num_params), axis=0)
+    z = stats.norm.ppf((ranks - 3. / 8.) / (ranks.shape[0] + 1. / 4.))
+    return z.reshape(num_samples, num_chains, num_params)
+
+
+def _rhat(samples):
+    """Computes R-hat for (num_samples, num_chains, num_params) samples."""
+    num_samples = samples.shape[0]
+    chain_mean = np.mean(samples, axis=0)
+    chain_var = np.var(samples, axis=0, ddof=1)
+
+    between_var = num_samples * np.var(chain_mean, axis=0, ddof=1)
+    within_var = np.mean(chain_var, axis=0)
+    pooled_var = (num_samples - 1.) / num_samples * within_var + \
+                 between_var / num_samples
+
+    return np.sqrt(pooled_var / within_var)
+
+
+def _ess(samples):
+    """Computes ESS for (num_samples, num_chains, num_params) samples.
+
+    Uses FFT autocovariance and Geyer's initial monotone sequence
+    estimator, see Section 3.2 of [1].
+    """
+    num_samples, num_chains, _ = samples.shape
+
+    # autocovariance of each chain
+    centered = samples - np.mean(samples, axis=0)
+    fft_size = 2 ** int(np.ceil(np.log2(2 * num_samples)))
+    spectrum = np.fft.rfft(centered, n=fft_size, axis=0)
+    autocov = np.fft.irfft(spectrum * np.conj(spectrum),
+                           n=fft_size, axis=0)[:num_samples] / num_samples
+
+    # combined autocorrelation across chains
+    chain_var = autocov[0] * num_samples / (num_samples - 1.)
+    within_var = np.mean(chain_var, axis=0)
+    pooled_var = (num_samples - 1.) / num_samples * within_var
+    if num_chains > 1:
+        pooled_var += np.var(np.mean(samples, axis=0), axis=0, ddof=1)
+    rho = 1. - (within_var - np.mean(autocov, axis=1)) / pooled_var
+    rho[0] = 1.
+
+    # Geyer's initial monotone positive sequence
+    num_pairs = num_samples // 2
+    rho_pairs = rho[:2 * num_pairs:2] + rho[1:2 * num_pairs:2]
+    is_positive = np.cumprod(rho_pairs > 0., axis=0).astype(bool)
+    rho_pairs = np.minimum.accumulate(np.where(is_positive, rho_pairs, 0.),
+                                      axis=0)
+    tau = np.maximum(-1. + 2. * np.sum(rho_pairs, axis=0), 1. / np.log10(
+        num_samples * num_chains))
+
+    return num_samples * num_chains / tau
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Convergence diagnostics """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+def rhat(samples, chain_axis=None):
+    """Computes rank-normalized split-R-hat for each parameter.
+
+    Takes the maximum of the bulk (rank-normalized) and tail
+    (rank-normalized folded) split-R-hat.
+
+    Args:
+        samples: (np.ndarray) MCMC samples of dimension (num_samples, ...).
+        chain_axis: (int or None) Axis of the chains, None for single chain.
+
+    Returns:
+        (np.ndarray) R-hat of dimension (num_params, ), flattened over
+            non-sample, non-chain dimensions.
+    """
+    samples = _split_chains(_to_chains(samples, chain_axis))
+    folded = np.abs(samples - np.median(samples, axis=(0, 1)))
+
+    return np.maximum(_rhat(_rank_normalize(samples)),
+                      _rhat(_rank_normalize(folded)))
+
+
+def ess_bulk(samples, chain_axis=None):
+    """Computes bulk ESS (i.e. of rank-normalized split chains).
+
+    Args:
+        samples: (np.ndarray) MCMC samples of dimension (num_samples, ...).
+        chain_axis: (int or None) Axis of the chains, None for single chain.
+
+    Returns:
+        (np.ndarray) Bulk ESS of dimension (num_params, ).
+    """
+    samples = _split_chains(_to_chains(samples, chain_axis))
+    return _ess(_rank_normalize(samples))
+
+
+def ess_tail(samples, chain_axis=None):
+    """Computes tail ESS, the minimum ESS of the 5% and 95% quantiles.
+
+    Args:
+        samples: (np.ndarray) MCMC samples of dimension (num_samples, ...).
+        chain_axis: (int or None) Axis of the chains, None for single chain.
+
+    Returns:
+        (np.ndarray) Tail ESS of dimension (num_params, ).
+    """
+    samples = _split_chains(_to_chains(samples, chain_axis))
+    quantiles = np.quantile(samples, _TAIL_QUANTILES, axis=(0, 1))
+
+    return np.minimum(*[_ess((samples <= quantile).astype(np.float64))
+                        for quantile in quantiles])
+
+
+def summarize(samples, chain_axis=None):
+    """Computes worst-case R-hat, bulk ESS and tail ESS over all parameters.
+
+    Args:
+        samples: (np.ndarray) MCMC samples of dimension (num_samples, ...).
+        chain_axis: (int or None) Axis of the chains, None for single chain.
+
+    Returns:
+        (dict of float) Maximum "rhat", minimum "ess_bulk" and minimum
+            "ess_tail" over parameters. Constant parameters are ignored.
+    """
+    samples = np.asarray(samples)
+    flat_samples = _to_chains(samples, chain_axis)
+    is_varying = np.ptp(flat_samples.reshape(-1, flat_samples.shape[-1]),
+                        axis=0) > 0.
+    if not np.any(is_varying):
+        return dict(rhat=np.nan, ess_bulk=np.nan, ess_tail=np.nan)
+
+    # drop constant parameters, which have undefined diagnostics.
+    flat_samples = flat_samples[..., is_varying]
+    return dict(rhat=np.max(rhat(flat_samples, chain_axis=1)),
+                ess_bulk=np.min(ess_bulk(flat_samples, chain_axis=1)),
+                ess_tail=np.min(ess_tail(flat_samples, chain_axis=1)))
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Online diagnostics """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+def _merge_moments(moments_a, moments_b):
+    """Merges (count, mean, M2) moments of two sample blocks (Chan et al.)."""
+    count_a, mean_a, m2_a = moments_a
+    count_b, mean_b, m2_b = moments_b
+
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / count
+    return count, mean, m2
+
+
+def _rhat_from_moments(moments_list):
+    """Computes R-hat from per-chain (count, mean, M2) of each split half."""
+    count = np.mean([moments[0] for moments in moments_list])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chain_mean = np.concatenate([moments[1] for moments in moments_list])
+        chain_var = np.concatenate([moments[2] / (moments[0] - 1.)
+                                    for moments in moments_list])
+
+        between_var = count * np.var(chain_mean, axis=0, ddof=1)
+        within_var = np.mean(chain_var, axis=0)
+        pooled_var = (count - 1.) / count * within_var + between_var / count
+
+        return np.sqrt(pooled_var / within_var)
+
+
+class OnlineDiagnostics(object):
+    """Incremental convergence diagnostics for chunks of MCMC samples.
+
+    For each parameter, at most max_params evenly spaced coordinates are
+    monitored. Per chunk, only these coordinates of the new samples are read:
+
+        - Per-chain Welford moments of each chunk are kept, and merged into
+          the two halves of each chain (split at the chunk boundary closest
+          to the middle) for split-R-hat. Since ranks of all samples are not
+          available, this is the classical split-R-hat of the raw samples
+          rather than the rank-normalized rhat, and can differ from it
+          (e.g. for heavy tails or drifting chains).
+        - At most max_draws draws per chain are kept in a thinned buffer,
+          whose stride doubles whenever it overflows, for bulk and tail ESS.
+          ESS of the thinned buffer is a conservative estimate of the ESS
+          of the full chain.
+
+    The cost of an update therefore does not grow with the number of
+    samples seen, and the object (being plain numpy) can be pickled into a
+    checkpoint.
+    """
+
+    def __init__(self, chain_axis=None,
+                 max_params=_ONLINE_MAX_PARAMS,
+                 max_draws=_ONLINE_MAX_DRAWS):
+        """Initializes empty diagnostics.
+
+        Args:
+            chain_axis: (int or None) Axis of the chains, None for single chain.
+            max_params: (int) Maximum number of monitored coordinates per
+                parameter.
+            max_draws: (int) Maximum number of retained draws per chain,
+                should exceed the target ESS divided by number of chains.
+        """
+        self.chain_axis = chain_axis
+        self.max_params = max_params
+        self.max_draws = max_draws
+        self._state = dict()
+
+    def update(self, name, samples):
+        """Adds a chunk of samples for parameter name.
+
+        Args:
+            name: (str) Name of the parameter.
+            samples: (np.ndarray) New samples of dimension (num_samples, ...).
+        """
+        samples = np.asarray(samples)
+        if self.chain_axis is None:
+            samples = samples[:, np.newaxis]
+        elif self.chain_axis != 1:
+            samples = np.moveaxis(samples, self.chain_axis, 1)
+
+        num_samples, num_chains = samples.shape[:2]
+        samples = samples.reshape(num_samples, num_chains, -1)
+        if num_samples == 0:
+            return
+
+        if name not in self._state:
+            num_params = samples.shape[-1]
+            self._state[name] = dict(
+                param_index=np.unique(np.linspace(
+                    0, num_params - 1,
+                    min(num_params, self.max_params)).astype(np.int64)),
+                chunk_moments=[], buffer=None, stride=1, num_seen=0)
+        state = self._state[name]
+
+        samples = samples[..., state["param_index"]].astype(np.float64)
+
+        # per-chain moments of the chunk
+        chunk_mean = np.mean(samples, axis=0)
+        state["chunk_moments"].append(
+            (num_samples, chunk_mean,
+             np.sum(np.square(samples - chunk_mean), axis=0)))
+
+        # thinned draws at global sample index divisible by stride
+        sample_index = state["num_seen"] + np.arange(num_samples)
+        thinned = samples[sample_index % state["stride"] == 0]
+        state["buffer"] = (thinned if state["buffer"] is None else
+                           np.concatenate([state["buffer"], thinned], axis=0))
+        state["num_seen"] += num_samples
+
+        while state["buffer"].shape[0] > self.max_draws:
+            state["buffer"] = state["buffer"][::2]
+            state["stride"] *= 2
+
+    def summarize(self, name):
+        """Computes worst-case R-hat, bulk ESS and tail ESS for name.
+
+        Args:
+            name: (str) Name of the parameter.
+
+        Returns:
+            (dict of float) Maximum classical split-R-hat "rhat", minimum
+                "ess_bulk" and minimum "ess_tail" over monitored coordinates.
+                Constant coordinates are ignored, all values are NaN if no
+                coordinate varies or fewer than 4 draws are buffered.
+        """
+        state = self._state[name]
+        buffer = state["buffer"]
+
+        is_varying = np.ptp(buffer.reshape(-1, buffer.shape[-1]), axis=0) > 0.
+        if not np.any(is_varying) or buffer.shape[0] < 4:
+            return dict(rhat=np.nan, ess_bulk=np.nan, ess_tail=np.nan)
+
+        # classical split-R-hat from chunk moments, or from the buffer
+        # for a single chunk, such that the estimator does not depend on
+        # the number of chunks.
+        chunk_moments = state["chunk_moments"]
+        if len(chunk_moments) < 2:
+            rhat_val = _rhat(_split_chains(buffer[..., is_varying]))
+        else:
+            counts = np.cumsum([moments[0] for moments in chunk_moments])
+            num_first = int(np.clip(
+                np.argmin(np.abs(counts - counts[-1] / 2.)) + 1,
+                1, len(chunk_moments) - 1))
+
+            halves = [functools.reduce(_merge_moments, chunk_list)
+                      for chunk_list in (chunk_moments[:num_first],
+                                         chunk_moments[num_first:])]
+            halves = [(count, mean[..., is_varying], m2[..., is_varying])
+                      for count, mean, m2 in halves]
+            rhat_val = _rhat_from_moments(halves)
+
+        buffer = buffer[..., is_varying]
+        return dict(rhat=np.nanmax(rhat_val),
+                    ess_bulk=np.min(ess_bulk(buffer, chain_axis=1)),
+                    ess_tail=np.min(ess_tail(buffer, chain_axis=1)))
+
+    @property
+    def names(self):
+        """Names of monitored parameters."""
+        return list(self._state.keys())
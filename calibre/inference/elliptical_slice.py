@@ -0,0 +1,624 @@
+"""Tuning-free slice sampling transition kernels for Gaussian Process models.
+
+The GP latent functions in our models all have Gaussian priors,
+
+    f ~ N(mu, L L^T),       p(f | y, theta) ~ p(y | f, theta) N(f | mu, L L^T),
+
+for which Elliptical Slice Sampling (ESS) [1] proposes along the ellipse
+    f' = mu + (f - mu) * cos(t) + nu * sin(t),   nu ~ N(0, L L^T)
+and shrinks the angle bracket until the proposal falls into the likelihood
+slice. It therefore always accepts, and has no step size to tune.
+
+Scalar hyperparameters (e.g. sigma, temp, ls) are updated by univariate
+slice sampling with stepping-out and shrinkage [2], and the two are combined
+through `GibbsKernel`, which alternates between blocks of the state.
+
+All kernels are vectorized across chains, i.e. the state may carry leading
+batch (chain) dimensions, in which case target_log_prob_fn should return a
+log density for each chain.
+
+#### References
+
+[1]:    Iain Murray, Ryan Adams and David MacKay. Elliptical Slice Sampling.
+        _13th International Conference on Artificial Intelligence and Statistics_,
+        2010. http://proceedings.mlr.press/v9/murray10a/murray10a.pdf
+[2]:    Radford Neal. Slice Sampling. _The Annals of Statistics_, 31(3), 2003.
+"""
+import collections
+
+import numpy as np
+
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+tfd = tfp.distributions
+
+_ESS_MAX_ITERATIONS = 100
+_SLICE_MAX_STEPS = 10
+_SLICE_MAX_ITERATIONS = 100
+
+EllipticalSliceKernelResults = collections.namedtuple(
+    'EllipticalSliceKernelResults',
+    ['log_likelihood', 'num_proposals', 'is_accepted'])
+
+SliceKernelResults = collections.namedtuple(
+    'SliceKernelResults',
+    ['target_log_prob', 'num_evaluations', 'is_accepted'])
+
+GibbsKernelResults = collections.namedtuple(
+    'GibbsKernelResults',
+    ['inner_results', 'is_accepted'])
+
+
+def _batch_where(cond, x, y):
+    """Selects x or y with a batch condition broadcast to the event dims.
+
+    Args:
+        cond: (tf.Tensor of bool) Condition of shape batch_shape.
+        x: (tf.Tensor) Values of shape batch_shape + event_shape.
+        y: (tf.Tensor) Values of shape batch_shape + event_shape.
+
+    Returns:
+        (tf.Tensor) Selected values, shape batch_shape + event_shape.
+    """
+    event_ndims = x.shape.ndims - cond.shape.ndims
+    for _ in range(event_ndims):
+        cond = tf.expand_dims(cond, -1)
+    cond = tf.logical_and(cond, tf.ones_like(x, dtype=tf.bool))
+    return tf.where(cond, x, y)
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Elliptical slice sampler """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+class EllipticalSliceSampler(tfp.mcmc.TransitionKernel):
+    """Elliptical slice sampler for latent variables with Gaussian prior."""
+
+    def __init__(self, log_likelihood_fn, prior_scale_tril, prior_mean=None,
+                 max_iterations=_ESS_MAX_ITERATIONS, name=None):
+        """Initializes the kernel.
+
+        Args:
+            log_likelihood_fn: (function) Log likelihood of the latent
+                variable excluding its Gaussian prior, takes a tf.Tensor of
+                shape batch_shape + [N] and returns shape batch_shape.
+            prior_scale_tril: (tf.Tensor of float32) Cholesky factor of the
+                prior covariance, shape (N, N). Computing it once outside
+                of the chain (e.g. gp.prior_scale_tril) avoids
+                re-factorizing the kernel matrix at each step.
+            prior_mean: (tf.Tensor of float32 or None) Prior mean, shape (N, ).
+                If None then zero.
+            max_iterations: (int) Maximum number of bracket shrinkages, after
+                which the current state is kept.
+            name: (str) Name prefix for ops created by this kernel.
+        """
+        self._parameters = dict(log_likelihood_fn=log_likelihood_fn,
+                                prior_scale_tril=prior_scale_tril,
+                                prior_mean=prior_mean,
+                                max_iterations=max_iterations,
+                                name=name)
+
+    @property
+    def log_likelihood_fn(self):
+        return self._parameters['log_likelihood_fn']
+
+    @property
+    def prior_scale_tril(self):
+        return self._parameters['prior_scale_tril']
+
+    @property
+    def prior_mean(self):
+        return self._parameters['prior_mean']
+
+    @property
+    def max_iterations(self):
+        return self._parameters['max_iterations']
+
+    @property
+    def name(self):
+        return self._parameters['name']
+
+    @property
+    def parameters(self):
+        return self._parameters
+
+    @property
+    def is_calibrated(self):
+        return True
+
+    def bootstrap_results(self, init_state):
+        """Computes log likelihood at initial state."""
+        with tf.name_scope(self.name or 'elliptical_slice',
+                           values=[init_state]):
+            init_state = tf.convert_to_tensor(init_state, dtype=tf.float32)
+            log_likelihood = self.log_likelihood_fn(init_state)
+            return EllipticalSliceKernelResults(
+                log_likelihood=log_likelihood,
+                num_proposals=tf.zeros_like(log_likelihood, dtype=tf.int32),
+                is_accepted=tf.ones_like(log_likelihood, dtype=tf.bool))
+
+    def one_step(self, current_state, previous_kernel_results):
+        """Runs one iteration of elliptical slice sampling.
+
+        Args:
+            current_state: (tf.Tensor of float32) Current latent variable,
+                shape batch_shape + [N].
+            previous_kernel_results: (EllipticalSliceKernelResults) Results
+                from the previous step, or from `bootstrap_results`.
+
+        Returns:
+            next_state: (tf.Tensor of float32) Next latent variable.
+            kernel_results: (EllipticalSliceKernelResults) Kernel results.
+        """
+        with tf.name_scope(self.name or 'elliptical_slice',
+                           values=[current_state]):
+            current_state = tf.convert_to_tensor(current_state, dtype=tf.float32)
+            log_likelihood = previous_kernel_results.log_likelihood
+            batch_shape = tf.shape(log_likelihood)
+
+            # center current state, and draw auxiliary prior sample.
+            prior_mean = (0. if self.prior_mean is None else
+                          tf.convert_to_tensor(self.prior_mean, dtype=tf.float32))
+            state_centered = current_state - prior_mean
+
+            eps = tf.random_normal(tf.shape(current_state), dtype=tf.float32)
+            nu = tf.tensordot(eps, self.prior_scale_tril,
+                              [[current_state.shape.ndims - 1], [1]])
+
+            # define likelihood slice and initial bracket.
+            log_slice = log_likelihood + tf.log(
+                tf.random_uniform(batch_shape, dtype=tf.float32))
+
+            theta = tf.random_uniform(batch_shape, maxval=2. * np.pi,
+                                      dtype=tf.float32)
+            theta_min = theta - 2. * np.pi
+            theta_max = theta
+
+            def _propose(theta):
+                """Computes proposal on the ellipse at angle theta."""
+                proposal = (state_centered * tf.expand_dims(tf.cos(theta), -1) +
+                            nu * tf.expand_dims(tf.sin(theta), -1) + prior_mean)
+                return proposal, self.log_likelihood_fn(proposal)
+
+            next_state, next_log_likelihood = _propose(theta)
+            is_done = next_log_likelihood > log_slice
+
+            def _cond(iter_id, is_done, *_):
+                return tf.logical_and(iter_id < self.max_iterations,
+                                      tf.logical_not(tf.reduce_all(is_done)))
+
+            def _body(iter_id, is_done, theta, theta_min, theta_max,
+                      next_state, next_log_likelihood, num_proposals):
+                """Shrinks bracket towards zero and re-proposes."""
+                theta_min = tf.where(
+                    tf.logical_and(tf.logical_not(is_done), theta < 0.),
+                    theta, theta_min)
+                theta_max = tf.where(
+                    tf.logical_and(tf.logical_not(is_done), theta >= 0.),
+                    theta, theta_max)
+
+                theta = tf.where(
+                    is_done, theta,
+                    tf.random_uniform(batch_shape, dtype=tf.float32) *
+                    (theta_max - theta_min) + theta_min)
+
+                proposal, proposal_log_likelihood = _propose(theta)
+                is_accepted = tf.logical_and(
+                    tf.logical_not(is_done), proposal_log_likelihood > log_slice)
+
+                next_state = _batch_where(is_accepted, proposal, next_state)
+                next_log_likelihood = tf.where(
+                    is_accepted, proposal_log_likelihood, next_log_likelihood)
+                num_proposals = num_proposals + tf.cast(
+                    tf.logical_not(is_done), tf.int32)
+
+                return (iter_id + 1, tf.logical_or(is_done, is_accepted),
+                        theta, theta_min, theta_max,
+                        next_state, next_log_likelihood, num_proposals)
+
+            (_, is_done, _, _, _,
+             next_state, next_log_likelihood, num_proposals) = tf.while_loop(
+                _cond, _body,
+                loop_vars=(tf.constant(0), is_done,
+                           theta, theta_min, theta_max,
+                           next_state, next_log_likelihood,
+                           tf.ones_like(is_done, dtype=tf.int32)))
+
+            # keep current state for chains exceeding max_iterations.
+            next_state = _batch_where(is_done, next_state, current_state)
+            next_log_likelihood = tf.where(is_done, next_log_likelihood,
+                                           log_likelihood)
+
+            return next_state, EllipticalSliceKernelResults(
+                log_likelihood=next_log_likelihood,
+                num_proposals=num_proposals,
+                is_accepted=is_done)
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Univariate slice sampler """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+class SliceSampler(tfp.mcmc.TransitionKernel):
+    """Univariate slice sampler with stepping-out and shrinkage."""
+
+    def __init__(self, target_log_prob_fn, step_size=1.,
+                 max_steps=_SLICE_MAX_STEPS,
+                 max_iterations=_SLICE_MAX_ITERATIONS, name=None):
+        """Initializes the kernel.
+
+        Args:
+            target_log_prob_fn: (function) Log density of a scalar parameter,
+                takes a tf.Tensor of shape batch_shape and returns shape
+                batch_shape.
+            step_size: (float) Initial width of the slice bracket.
+            max_steps: (int) Maximum number of stepping-out steps.
+            max_iterations: (int) Maximum number of bracket shrinkages, after
+                which the current state is kept.
+            name: (str) Name prefix for ops created by this kernel.
+        """
+        self._parameters = dict(target_log_prob_fn=target_log_prob_fn,
+                                step_size=step_size,
+                                max_steps=max_steps,
+                                max_iterations=max_iterations,
+                                name=name)
+
+    @property
+    def target_log_prob_fn(self):
+        return self._parameters['target_log_prob_fn']
+
+    @property
+    def step_size(self):
+        return self._parameters['step_size']
+
+    @property
+    def max_steps(self):
+        return self._parameters['max_steps']
+
+    @property
+    def max_iterations(self):
+        return self._parameters['max_iterations']
+
+    @property
+    def name(self):
+        return self._parameters['name']
+
+    @property
+    def parameters(self):
+        return self._parameters
+
+    @property
+    def is_calibrated(self):
+        return True
+
+    def bootstrap_results(self, init_state):
+        """Computes target log density at initial state."""
+        with tf.name_scope(self.name or 'slice', values=[init_state]):
+            init_state = tf.convert_to_tensor(init_state, dtype=tf.float32)
+            target_log_prob = self.target_log_prob_fn(init_state)
+            return SliceKernelResults(
+                target_log_prob=target_log_prob,
+                num_evaluations=tf.zeros_like(target_log_prob, dtype=tf.int32),
+                is_accepted=tf.ones_like(target_log_prob, dtype=tf.bool))
+
+    def one_step(self, current_state, previous_kernel_results):
+        """Runs one iteration of univariate slice sampling.
+
+        Args:
+            current_state: (tf.Tensor of float32) Current parameter value,
+                shape batch_shape.
+            previous_kernel_results: (SliceKernelResults) Results from the
+                previous step, or from `bootstrap_results`.
+
+        Returns:
+            next_state: (tf.Tensor of float32) Next parameter value.
+            kernel_results: (SliceKernelResults) Kernel results.
+        """
+        with tf.name_scope(self.name or 'slice', values=[current_state]):
+            current_state = tf.convert_to_tensor(current_state, dtype=tf.float32)
+            target_log_prob = previous_kernel_results.target_log_prob
+            batch_shape = tf.shape(current_state)
+
+            log_slice = target_log_prob + tf.log(
+                tf.random_uniform(batch_shape, dtype=tf.float32))
+
+            # randomly position the initial bracket, and split stepping-out
+            # budget between the two ends (see Fig. 3 of [2]).
+            lower = current_state - self.step_size * tf.random_uniform(
+                batch_shape, dtype=tf.float32)
+            upper = lower + self.step_size
+
+            steps_lower = tf.floor(self.max_steps * tf.random_uniform(
+                batch_shape, dtype=tf.float32))
+            steps_upper = (self.max_steps - 1.) - steps_lower
+
+            def _step_out(bound, steps, direction):
+                """Extends one end of the bracket until it exits the slice."""
+
+                def _cond(bound, steps, is_active):
+                    return tf.reduce_any(is_active)
+
+                def _body(bound, steps, is_active):
+                    bound = tf.where(is_active, bound + direction * self.step_size, bound)
+                    steps = tf.where(is_active, steps - 1., steps)
+                    is_active = tf.logical_and(
+                        steps > 0., self.target_log_prob_fn(bound) > log_slice)
+                    return bound, steps, is_active
+
+                is_active = tf.logical_and(
+                    steps > 0., self.target_log_prob_fn(bound) > log_slice)
+                bound, _, _ = tf.while_loop(
+                    _cond, _body, loop_vars=(bound, steps, is_active))
+                return bound
+
+            lower = _step_out(lower, steps_lower, -1.)
+            upper = _step_out(upper, steps_upper, 1.)
+
+            # shrink bracket until proposal falls into the slice.
+            def _cond(iter_id, is_done, *_):
+                return tf.logical_and(iter_id < self.max_iterations,
+                                      tf.logical_not(tf.reduce_all(is_done)))
+
+            def _body(iter_id, is_done, lower, upper,
+                      next_state, next_target_log_prob, num_evaluations):
+                proposal = lower + (upper - lower) * tf.random_uniform(
+                    batch_shape, dtype=tf.float32)
+                proposal_log_prob = self.target_log_prob_fn(proposal)
+
+                is_accepted = tf.logical_and(
+                    tf.logical_not(is_done), proposal_log_prob > log_slice)
+                is_rejected = tf.logical_and(
+                    tf.logical_not(is_done), tf.logical_not(is_accepted))
+
+                lower = tf.where(
+                    tf.logical_and(is_rejected, proposal < current_state),
+                    proposal, lower)
+                upper = tf.where(
+                    tf.logical_and(is_rejected, proposal >= current_state),
+                    proposal, upper)
+
+                next_state = tf.where(is_accepted, proposal, next_state)
+                next_target_log_prob = tf.where(
+                    is_accepted, proposal_log_prob, next_target_log_prob)
+                num_evaluations = num_evaluations + tf.cast(
+                    tf.logical_not(is_done), tf.int32)
+
+                return (iter_id + 1, tf.logical_or(is_done, is_accepted),
+                        lower, upper,
+                        next_state, next_target_log_prob, num_evaluations)
+
+            (_, is_done, _, _,
+             next_state, next_target_log_prob, num_evaluations) = tf.while_loop(
+                _cond, _body,
+                loop_vars=(tf.constant(0),
+                           tf.zeros_like(current_state, dtype=tf.bool),
+                           lower, upper,
+                           current_state, target_log_prob,
+                           tf.zeros_like(current_state, dtype=tf.int32)))
+
+            return next_state, SliceKernelResults(
+                target_log_prob=next_target_log_prob,
+                num_evaluations=num_evaluations,
+                is_accepted=is_done)
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Gibbs kernel """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+class GibbsKernel(tfp.mcmc.TransitionKernel):
+    """Alternates transition kernels over blocks of the state.
+
+    For each block, the target density is the full target_log_prob_fn with
+    the other blocks fixed at their current value, and the block kernel is
+    (re-)built and bootstrapped at every step. Consequently, adaptive inner
+    kernels (e.g. HMC with step_size_update_fn) are not supported, while
+    EllipticalSliceSampler, SliceSampler or HMC with fixed step size are.
+    """
+
+    def __init__(self, target_log_prob_fn, make_kernel_fns, state_blocks,
+                 name=None):
+        """Initializes the kernel.
+
+        Args:
+            target_log_prob_fn: (function) Joint log density, takes all
+                state parts as positional arguments.
+            make_kernel_fns: (list of function) For each block, a function
+                with args (block_target_log_prob_fn, current_state) that
+                returns a tfp.mcmc.TransitionKernel for the block. See
+                make_elliptical_slice_kernel_fn and make_slice_kernel_fn.
+            state_blocks: (list of list of int) For each block, indices of
+                the state parts it updates. A block with a single state part
+                receives a tf.Tensor, otherwise a list of tf.Tensor.
+            name: (str) Name prefix for ops created by this kernel.
+
+        Raises:
+            (ValueError) If make_kernel_fns and state_blocks differ in length.
+        """
+        if len(make_kernel_fns) != len(state_blocks):
+            raise ValueError('Number of kernels ({}) must match number of '
+                             'state blocks ({}).'.format(len(make_kernel_fns),
+                                                         len(state_blocks)))
+
+        self._parameters = dict(target_log_prob_fn=target_log_prob_fn,
+                                make_kernel_fns=make_kernel_fns,
+                                state_blocks=state_blocks,
+                                name=name)
+
+    @property
+    def target_log_prob_fn(self):
+        return self._parameters['target_log_prob_fn']
+
+    @property
+    def make_kernel_fns(self):
+        return self._parameters['make_kernel_fns']
+
+    @property
+    def state_blocks(self):
+        return self._parameters['state_blocks']
+
+    @property
+    def name(self):
+        return self._parameters['name']
+
+    @property
+    def parameters(self):
+        return self._parameters
+
+    @property
+    def is_calibrated(self):
+        return True
+
+    def _make_block_kernel(self, block_id, current_state):
+        """Builds the kernel and its (unpacked) state for one block."""
+        block_ids = self.state_blocks[block_id]
+        fixed_state = list(current_state)
+
+        def block_target_log_prob_fn(*block_state):
+            """Joint log density as a function of the block state."""
+            state = list(fixed_state)
+            for state_id, block_value in zip(block_ids, block_state):
+                state[state_id] = block_value
+            return self.target_log_prob_fn(*state)
+
+        kernel = self.make_kernel_fns[block_id](block_target_log_prob_fn,
+                                                fixed_state)
+        block_state = [fixed_state[state_id] for state_id in block_ids]
+        if len(block_ids) == 1:
+            block_state = block_state[0]
+
+        return kernel, block_state
+
+    def bootstrap_results(self, init_state):
+        """Bootstraps kernel results for each block."""
+        with tf.name_scope(self.name or 'gibbs', values=[init_state]):
+            init_state = [tf.convert_to_tensor(state_part, dtype=tf.float32)
+                          for state_part in init_state]
+
+            inner_results = []
+            is_accepted = tf.constant(True)
+            for block_id in range(len(self.state_blocks)):
+                kernel, block_state = self._make_block_kernel(block_id, init_state)
+                results = kernel.bootstrap_results(block_state)
+
+                inner_results.append(results)
+                is_accepted = tf.logical_and(
+                    is_accepted, getattr(results, 'is_accepted', True))
+
+            return GibbsKernelResults(inner_results=inner_results,
+                                      is_accepted=is_accepted)
+
+    def one_step(self, current_state, previous_kernel_results):
+        """Runs one sweep over all blocks.
+
+        Args:
+            current_state: (list of tf.Tensor) Current state parts.
+            previous_kernel_results: (GibbsKernelResults) Results from the
+                previous step, or from `bootstrap_results`.
+
+        Returns:
+            next_state: (list of tf.Tensor) Next state parts.
+            kernel_results: (GibbsKernelResults) Kernel results.
+        """
+        with tf.name_scope(self.name or 'gibbs', values=[current_state]):
+            next_state = [tf.convert_to_tensor(state_part, dtype=tf.float32)
+                          for state_part in current_state]
+
+            inner_results = []
+            is_accepted = tf.constant(True)
+            for block_id, block_ids in enumerate(self.state_blocks):
+                kernel, block_state = self._make_block_kernel(block_id, next_state)
+                block_state, results = kernel.one_step(
+                    block_state, kernel.bootstrap_results(block_state))
+
+                if len(block_ids) == 1:
+                    block_state = [block_state]
+                for state_id, block_value in zip(block_ids, block_state):
+                    next_state[state_id] = block_value
+
+                inner_results.append(results)
+                is_accepted = tf.logical_and(
+                    is_accepted, getattr(results, 'is_accepted', True))
+
+            return next_state, GibbsKernelResults(inner_results=inner_results,
+                                                  is_accepted=is_accepted)
+
+
+def make_elliptical_slice_kernel_fn(prior_scale_tril, prior_mean=None,
+                                    max_iterations=_ESS_MAX_ITERATIONS,
+                                    make_log_likelihood_fn=None):
+    """Makes GibbsKernel block kernel function for a Gaussian latent variable.
+
+    If make_log_likelihood_fn is None, the log likelihood for ESS is obtained
+    by subtracting the Gaussian prior log density from the block target, so
+    the same joint target_log_prob_fn can be used for HMC and for ESS. Since
+    this evaluates the full joint (including any kernel factorization in the
+    GP priors) for every proposal, models should rather provide the data
+    likelihood through make_log_likelihood_fn, which is called once per
+    sweep such that any factor it needs is computed outside of the
+    shrinkage loop.
+
+    Args:
+        prior_scale_tril: (tf.Tensor or function) Cholesky factor of the
+            prior covariance, shape (N, N). If a function, it takes the full
+            list of current state parts (e.g. to compute the factor from
+            the current lengthscale) and returns the Cholesky factor.
+        prior_mean: (tf.Tensor of float32 or None) Prior mean, shape (N, ).
+            If None then zero.
+        max_iterations: (int) Maximum number of bracket shrinkages.
+        make_log_likelihood_fn: (function or None) A function taking the full
+            list of current state parts and returning the log likelihood as
+            a function of the block state. If None then derive from
+            target_log_prob_fn.
+
+    Returns:
+        (function) A function with args (target_log_prob_fn, current_state)
+            returning an EllipticalSliceSampler.
+    """
+
+    def make_kernel_fn(target_log_prob_fn, current_state):
+        scale_tril = (prior_scale_tril(current_state)
+                      if callable(prior_scale_tril) else prior_scale_tril)
+
+        if make_log_likelihood_fn is not None:
+            log_likelihood_fn = make_log_likelihood_fn(current_state)
+        else:
+            prior_dist = tfd.MultivariateNormalTriL(loc=prior_mean,
+                                                    scale_tril=scale_tril)
+
+            def log_likelihood_fn(state):
+                return target_log_prob_fn(state) - prior_dist.log_prob(state)
+
+        return EllipticalSliceSampler(log_likelihood_fn=log_likelihood_fn,
+                                      prior_scale_tril=scale_tril,
+                                      prior_mean=prior_mean,
+                                      max_iterations=max_iterations)
+
+    return make_kernel_fn
+
+
+def make_slice_kernel_fn(step_size=1., max_steps=_SLICE_MAX_STEPS,
+                         max_iterations=_SLICE_MAX_ITERATIONS):
+    """Makes GibbsKernel block kernel function for a scalar parameter.
+
+    Args:
+        step_size: (float) Initial width of the slice bracket.
+        max_steps: (int) Maximum number of stepping-out steps.
+        max_iterations: (int) Maximum number of bracket shrinkages.
+
+    Returns:
+        (function) A function with args (target_log_prob_fn, current_state)
+            returning a SliceSampler.
+    """
+
+    def make_kernel_fn(target_log_prob_fn, current_state):
+        return SliceSampler(target_log_prob_fn=target_log_prob_fn,
+                            step_size=step_size,
+                            max_steps=max_steps,
+                            max_iterations=max_iterations)
+
+    return make_kernel_fn
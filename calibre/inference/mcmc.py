@@ -2,6 +2,7 @@
 
 import os
 import time
+import collections
 
 from importlib import reload
 
@@ -13,18 +14,50 @@ import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 from tensorflow_probability import edward2 as ed
+from tensorflow.python.util import nest
 
 # sys.path.extend([os.getcwd()])
 
+from calibre.model import gaussian_process as gp
 from calibre.model import tailfree_process as tail_free
 from calibre.model import adaptive_ensemble
 
+from calibre.inference import diagnostics
+from calibre.inference import elliptical_slice
+from calibre.inference import nuts
+
+_SAMPLER_TYPES = ("hmc", "ess", "nuts")
+
+# NUTS adapts step size and mass matrix, hence needs a much shorter warmup.
+_DEFAULT_NUM_BURNIN_STEPS = {"hmc": 5000, "ess": 5000, "nuts": 1000}
+
+# graph collections holding the chain handles for chunked sampling.
+_CHUNK_STATE_INIT = "chunk_state_init"
+_CHUNK_STATE_FINAL = "chunk_state_final"
+_CHUNK_RESULTS_INIT = "chunk_kernel_results_init"
+_CHUNK_RESULTS_FINAL = "chunk_kernel_results_final"
+_CHUNK_SCHEDULE = "chunk_schedule"
+
+_CHECKPOINT_FILE_NAME = "checkpoint.pkl"
+
+# graph collection holding the data placeholders, ordered (X, y, *base_pred).
+_DATA_PLACEHOLDERS = "data_placeholders"
+
+# minimum number of post burn-in samples before checking the stop rule.
+_MIN_SAMPLES_FOR_STOPPING = 100
+
 
 def make_inference_graph_tailfree(X_train, y_train, base_pred, family_tree,
                                   default_log_ls_weight=None,
                                   default_log_ls_resid=None,
                                   num_mcmc_samples=1000, 
-                                  num_burnin_steps=5000):
+                                  num_burnin_steps=None,
+                                  sampler="hmc",
+                                  num_chains=None,
+                                  chunk_size=None,
+                                  whiten=False,
+                                  use_placeholders=False,
+                                  log_ls_grid=None):
     """Defines computation graph for MCMC sampling with tailfree model.
 
     Args:
@@ -42,26 +75,116 @@ def make_inference_graph_tailfree(X_train, y_train, base_pred, family_tree,
         default_log_ls_resid: (float32) default value for length-scale parameter for
             residual GP.
         num_mcmc_samples: (int) Integer number of Markov chain draws.
-        num_burnin_steps: (int) Number of chain steps to take before starting to
-            collect results.
+        num_burnin_steps: (int or None) Number of chain steps to take before
+            starting to collect results. If None then use the sampler-specific
+            default in _DEFAULT_NUM_BURNIN_STEPS.
+        sampler: (str) Transition kernel, one of ("hmc", "ess", "nuts").
+            "hmc" updates all parameters jointly with HMC. "ess" alternates
+            elliptical slice sampling for the GP latent functions (residual
+            process and node weights) with univariate slice sampling for the
+            scalar parameters (ls, sigma, temp), which requires no step-size
+            tuning. "nuts" updates all parameters jointly with the No-U-Turn
+            sampler, adapting step size and a diagonal mass matrix during
+            burn-in.
+        num_chains: (int or None) Number of chains C to run in one batched
+            graph. If None then run a single chain without chain axis.
+        chunk_size: (int or None) If given, the graph only runs chunk_size
+            chain steps per session call, starting from a feedable chain
+            state and kernel results, so the chain can be run in chunks
+            with run_sampling_chunked. Burn-in samples are then discarded
+            by run_sampling_chunked rather than in the graph.
+        whiten: (bool) Whether to sample the GP latents (residual process and
+            node weights) in the non-centered parameterization f = L(ls) z
+            with z ~ N(0, I), see gp.prior_whitened. The returned samples are
+            transformed back to f.
+        use_placeholders: (bool) Whether to feed X_train, y_train and
+            base_pred through placeholders (of the same shapes as the given
+            arrays) instead of embedding them as constants, so that the graph
+            can be reused for new data of the same signature, see
+            TailFreeSampler.
+        log_ls_grid: (np.ndarray or None) Grid of G log length-scale values.
+            If given (and length-scales are not fixed), the length-scale prior
+            is discretized on the grid and marginalized out of the target
+            density using precomputed Cholesky factors (see
+            adaptive_ensemble.make_log_joint_fn_tailfree_ls_grid), so no
+            factorization happens inside the sampling loop. Length-scale
+            samples are then drawn from their conditional posterior on the
+            grid given each sample of the GPs.
 
     Returns:
         mcmc_graph (Graph) A computation graph for MCMC that contains
             init ops, parameter samples, and sampling states.
         init_op (tf.Operation) Initialization op
         parameter_samples (dict of tf.Tensors) Dictionary of parameters and their
-            MCMC samples of shape (param_dim, num_mcmc_samples)
+            MCMC samples of shape (num_mcmc_samples, param_dim), or
+            (num_mcmc_samples, num_chains, param_dim) if num_chains is given.
         is_accepted (tf.Tensor) A tensor indicating whether each mcmc samples is accepted.
+
+    Raises:
+        (ValueError) If sampler is not one of _SAMPLER_TYPES.
+        (ValueError) If sampler is "ess" with multiple chains and
+            length-scale parameters are not fixed.
+        (ValueError) If sampler is "nuts" with multiple chains.
+        (ValueError) If log_ls_grid is given with fixed length-scales, with
+            whiten or with sampler "ess".
+        (ValueError) If whiten, log_ls_grid or sampler "ess" is used under
+            the "iterative" linear algebra backend, since they require
+            Cholesky factors of the kernel matrices (see gp.prior_scale_tril).
     """
+    if sampler not in _SAMPLER_TYPES:
+        raise ValueError('sampler must be one of {}, observed "{}".'.format(
+            _SAMPLER_TYPES, sampler))
+
+    if num_burnin_steps is None:
+        num_burnin_steps = _DEFAULT_NUM_BURNIN_STEPS[sampler]
 
     INFER_LS_PARAM = False
     N = X_train.shape[0]
+    y_train = y_train.squeeze()
     
     if not default_log_ls_weight or not default_log_ls_resid:
         INFER_LS_PARAM = True
 
+    USE_LS_GRID = log_ls_grid is not None
+    if USE_LS_GRID:
+        if not INFER_LS_PARAM:
+            raise ValueError('log_ls_grid requires length-scale parameters '
+                             'to be inferred, observed fixed defaults.')
+        if whiten or sampler == "ess":
+            raise ValueError('log_ls_grid does not support whiten or '
+                             'sampler "ess", since the GP prior is a '
+                             'mixture over the grid.')
+
+        # length-scales are marginalized over the grid, not sampled.
+        INFER_LS_PARAM = False
+
+    # under the iterative backend, fixed length-scales fall back to the
+    # generic log joint since the kernel matrices are not factorized.
+    USE_SCALE_TRIL = gp.uses_scale_tril(gp.prior)
+    if not USE_SCALE_TRIL and (whiten or USE_LS_GRID or sampler == "ess"):
+        raise ValueError('whiten, log_ls_grid and sampler "ess" require '
+                         'Cholesky factors of the kernel matrices, which '
+                         'are not available under the "iterative" linear '
+                         'algebra backend.')
+
+    if sampler == "ess" and INFER_LS_PARAM and num_chains:
+        raise ValueError('Multi-chain ESS requires fixed length-scale '
+                         'parameters, since the prior Cholesky factor is '
+                         'shared across chains.')
+
+    if sampler == "nuts" and num_chains:
+        raise ValueError('NUTS does not support multiple chains, since '
+                         'trajectory lengths differ across chains.')
+
+    chain_shape = [num_chains] if num_chains else []
+    prior_func = gp.prior_whitened if whiten else gp.prior
+
     mcmc_graph = tf.Graph()
     with mcmc_graph.as_default():
+        if use_placeholders:
+            X_train, y_train, base_pred = _make_data_placeholders(
+                X_train, y_train, base_pred)
+
         # build likelihood explicitly
         log_joint = ed.make_log_joint_fn(adaptive_ensemble.model_tailfree)
 
@@ -88,72 +211,183 @@ def make_inference_graph_tailfree(X_train, y_train, base_pred, family_tree,
                 return log_joint(X=X_train,
                                  base_pred=base_pred,
                                  family_tree=family_tree,
-                                 y=y_train.squeeze(),
+                                 y=y_train,
                                  ls_weight=ls_weight,
                                  ls_resid=ls_resid,
                                  sigma=sigma,
                                  ensemble_resid=ensemble_resid,
+                                 prior_func=prior_func,
                                  **node_specific_kwargs)
-        else:
+        elif USE_LS_GRID:
+            # grid length-scale, factorize kernel matrices for all grid
+            # values once and marginalize over the grid.
+            log_joint_ls_grid, ls_logits = (
+                adaptive_ensemble.make_log_joint_fn_tailfree_ls_grid(
+                    X_train, base_pred, family_tree, y_train,
+                    log_ls_grid=log_ls_grid))
+
+            def target_log_prob_fn(sigma, ensemble_resid,
+                                   *node_specific_positional_args):
+                """Unnormalized target density as a function of states."""
+                num_temp = len(cond_weight_temp_names)
+                temp_dict = dict(zip(
+                    tail_free.get_parent_node_names(family_tree),
+                    node_specific_positional_args[:num_temp]))
+                base_weight_dict = dict(zip(
+                    tail_free.get_nonroot_node_names(family_tree),
+                    node_specific_positional_args[num_temp:]))
+
+                return log_joint_ls_grid(sigma=sigma,
+                                         ensemble_resid=ensemble_resid,
+                                         temp_dict=temp_dict,
+                                         base_weight_dict=base_weight_dict)
+        elif not USE_SCALE_TRIL:
+            # fixed length-scale under the iterative backend, the GP log
+            # densities are evaluated without factorizing the kernel.
             def target_log_prob_fn(sigma, ensemble_resid,
                                    *node_specific_positional_args):
                 """Unnormalized target density as a function of states."""
                 # build kwargs for base model weight using positional args
                 node_specific_kwargs = dict(zip(node_specific_varnames,
                                                 node_specific_positional_args))
-    
+
                 return log_joint(X=X_train,
                                  base_pred=base_pred,
                                  family_tree=family_tree,
-                                 y=y_train.squeeze(),
+                                 y=y_train,
                                  log_ls_weight=default_log_ls_weight,
                                  log_ls_resid=default_log_ls_resid,
                                  sigma=sigma,
                                  ensemble_resid=ensemble_resid,
+                                 prior_func=prior_func,
                                  **node_specific_kwargs)
+        else:
+            # fixed length-scale, factorize kernel matrices once and
+            # share them across log joint evaluations and chains.
+            weight_scale_tril = gp.prior_scale_tril(
+                X_train, ls=np.exp(default_log_ls_weight).astype(np.float32),
+                kernel_func=gp.rbf)
+            resid_scale_tril = gp.prior_scale_tril(
+                X_train, ls=np.exp(default_log_ls_resid).astype(np.float32),
+                kernel_func=gp.rbf)
+
+            # specialized log joint, no model re-tracing per evaluation.
+            log_joint_fixed_ls = (
+                adaptive_ensemble.make_log_joint_fn_tailfree_fixed_ls(
+                    X_train, base_pred, family_tree, y_train,
+                    log_ls_weight=default_log_ls_weight,
+                    log_ls_resid=default_log_ls_resid,
+                    weight_scale_tril=weight_scale_tril,
+                    resid_scale_tril=resid_scale_tril,
+                    whiten=whiten))
+
+            def target_log_prob_fn(sigma, ensemble_resid,
+                                   *node_specific_positional_args):
+                """Unnormalized target density as a function of states."""
+                num_temp = len(cond_weight_temp_names)
+                temp_dict = dict(zip(
+                    tail_free.get_parent_node_names(family_tree),
+                    node_specific_positional_args[:num_temp]))
+                base_weight_dict = dict(zip(
+                    tail_free.get_nonroot_node_names(family_tree),
+                    node_specific_positional_args[num_temp:]))
+
+                return log_joint_fixed_ls(sigma=sigma,
+                                          ensemble_resid=ensemble_resid,
+                                          temp_dict=temp_dict,
+                                          base_weight_dict=base_weight_dict)
+
+        if num_chains:
+            target_log_prob_fn = make_batched_log_prob_fn(target_log_prob_fn,
+                                                          num_chains)
 
         # set up state container
         initial_state = [
-                            tf.constant(0.1, name='init_sigma'),
-                            tf.random_normal([N], stddev=0.01,
+                            tf.fill(chain_shape, 0.1, name='init_sigma'),
+                            tf.random_normal(chain_shape + [N], stddev=0.01,
                                              name='init_ensemble_resid'),
                         ] + [
-                            tf.random_normal([], stddev=0.01,
+                            tf.random_normal(chain_shape, stddev=0.01,
                                              name='init_{}'.format(var_name)) for
                             var_name in cond_weight_temp_names
                         ] + [
-                            tf.random_normal([N], stddev=0.01,
+                            tf.random_normal(chain_shape + [N], stddev=0.01,
                                              name='init_{}'.format(var_name)) for
                             var_name in node_weight_names
                         ]
         
         if INFER_LS_PARAM:
-            initial_state = [tf.constant(-1., name='init_ls_weight'),
-                             tf.constant(-1., name='init_ls_resid'),
+            initial_state = [tf.fill(chain_shape, -1., name='init_ls_weight'),
+                             tf.fill(chain_shape, -1., name='init_ls_resid'),
                              ] + initial_state
 
-        # set up HMC transition kernel
-        step_size = tf.get_variable(
-            name='step_size',
-            initializer=1.,
-            use_resource=True,  # For TFE compatibility.
-            trainable=False)
+        if sampler == "ess":
+            kernel = make_gibbs_kernel_tailfree(
+                target_log_prob_fn, X_train, y_train,
+                base_pred=base_pred,
+                family_tree=family_tree,
+                default_log_ls_weight=(None if INFER_LS_PARAM
+                                       else default_log_ls_weight),
+                default_log_ls_resid=(None if INFER_LS_PARAM
+                                      else default_log_ls_resid),
+                whiten=whiten,
+                num_chains=num_chains)
+        elif sampler == "nuts":
+            kernel = nuts.NoUTurnSampler(
+                target_log_prob_fn=target_log_prob_fn,
+                num_adaptation_steps=num_burnin_steps)
+        else:
+            # set up HMC transition kernel
+            step_size = tf.get_variable(
+                name='step_size',
+                initializer=1.,
+                use_resource=True,  # For TFE compatibility.
+                trainable=False)
+
+            kernel = tfp.mcmc.HamiltonianMonteCarlo(
+                target_log_prob_fn=target_log_prob_fn,
+                num_leapfrog_steps=3,
+                step_size=step_size,
+                step_size_update_fn=tfp.mcmc.make_simple_step_size_update_policy(num_burnin_steps))
 
-        hmc = tfp.mcmc.HamiltonianMonteCarlo(
-            target_log_prob_fn=target_log_prob_fn,
-            num_leapfrog_steps=3,
-            step_size=step_size,
-            step_size_update_fn=tfp.mcmc.make_simple_step_size_update_policy(num_burnin_steps))
+        if chunk_size:
+            # make chain state and kernel results feedable, so each
+            # chunk continues from the end of the previous one.
+            initial_state = [
+                tf.placeholder_with_default(state_part,
+                                            shape=state_part.shape)
+                for state_part in initial_state]
+            previous_kernel_results = nest.map_structure(
+                lambda result: tf.placeholder_with_default(
+                    result, shape=result.shape),
+                kernel.bootstrap_results(initial_state))
+        else:
+            previous_kernel_results = None
 
         # set up main sampler
         state, kernel_results = tfp.mcmc.sample_chain(
-            num_results=num_mcmc_samples,
-            num_burnin_steps=num_burnin_steps,
+            num_results=chunk_size or num_mcmc_samples,
+            num_burnin_steps=0 if chunk_size else num_burnin_steps,
             current_state=initial_state,
-            kernel=hmc,
+            previous_kernel_results=previous_kernel_results,
+            kernel=kernel,
             parallel_iterations=1
         )
 
+        if chunk_size:
+            for state_init, state_trace in zip(initial_state, state):
+                tf.add_to_collection(_CHUNK_STATE_INIT, state_init)
+                tf.add_to_collection(_CHUNK_STATE_FINAL, state_trace[-1])
+            for result_init, result_trace in zip(
+                    nest.flatten(previous_kernel_results),
+                    nest.flatten(kernel_results)):
+                tf.add_to_collection(_CHUNK_RESULTS_INIT, result_init)
+                tf.add_to_collection(_CHUNK_RESULTS_FINAL, result_trace[-1])
+            tf.add_to_collection(
+                _CHUNK_SCHEDULE,
+                tf.constant([num_burnin_steps, num_mcmc_samples, chunk_size],
+                            name="chunk_schedule"))
+
         # setup output tensors
         parameter_samples = dict()
         param_init_idx = 0
@@ -173,6 +407,27 @@ def make_inference_graph_tailfree(X_train, y_train, base_pred, family_tree,
         parameter_samples["weight_sample"] = (
             state[param_init_idx + 2 + len(cond_weight_temp_names):]
         )
+
+        if whiten:
+            # transform whitened samples back to GP values, f = L(ls) z.
+            parameter_samples["ensemble_resid_sample"], = unwhiten_samples(
+                [parameter_samples["ensemble_resid_sample"]], X_train,
+                log_ls_sample=(parameter_samples["ls_resid_sample"]
+                               if INFER_LS_PARAM else None),
+                scale_tril=None if INFER_LS_PARAM else resid_scale_tril)
+            parameter_samples["weight_sample"] = unwhiten_samples(
+                parameter_samples["weight_sample"], X_train,
+                log_ls_sample=(parameter_samples["ls_weight_sample"]
+                               if INFER_LS_PARAM else None),
+                scale_tril=None if INFER_LS_PARAM else weight_scale_tril)
+
+        if USE_LS_GRID:
+            (parameter_samples["ls_weight_sample"],
+             parameter_samples["ls_resid_sample"]) = sample_ls_grid_posterior(
+                ls_logits, log_ls_grid,
+                resid_sample=parameter_samples["ensemble_resid_sample"],
+                weight_samples=parameter_samples["weight_sample"],
+                node_names=tail_free.get_nonroot_node_names(family_tree))
         
         # set up init op
         with tf.name_scope("init_op") as scope:
@@ -188,6 +443,284 @@ def make_inference_graph_tailfree(X_train, y_train, base_pred, family_tree,
     return mcmc_graph, init_op, parameter_samples, is_accepted
 
 
+def _make_data_placeholders(X_train, y_train, base_pred):
+    """Makes placeholders for model data, with same shapes as given arrays.
+
+    Args:
+        X_train: (np.ndarray) Input features of dimension (N, D)
+        y_train: (np.ndarray) Training labels of dimension (N, )
+        base_pred: (dict of np.ndarray) A dictionary of out-of-sample prediction
+            from base models, each with dimension (N, ).
+
+    Returns:
+        X_train, y_train: (tf.Tensor of float32) Placeholders for features
+            and labels.
+        base_pred: (dict of tf.Tensor) Dictionary of placeholders for base
+            model predictions, in the same key order as base_pred.
+    """
+    X_ph = tf.placeholder(tf.float32, shape=X_train.shape, name="X_train")
+    y_ph = tf.placeholder(tf.float32, shape=y_train.shape, name="y_train")
+    base_pred_ph = collections.OrderedDict(
+        (model_name, tf.placeholder(tf.float32, shape=pred.shape,
+                                    name="base_pred_{}".format(model_name)))
+        for model_name, pred in base_pred.items())
+
+    for placeholder in [X_ph, y_ph] + list(base_pred_ph.values()):
+        tf.add_to_collection(_DATA_PLACEHOLDERS, placeholder)
+
+    return X_ph, y_ph, base_pred_ph
+
+
+def make_batched_log_prob_fn(target_log_prob_fn, num_chains):
+    """Makes log density for a batch of independent chains.
+
+    Args:
+        target_log_prob_fn: (function) Log density of a single chain's state.
+        num_chains: (int) Number of chains, i.e. size of the leading
+            dimension of each state part.
+
+    Returns:
+        (function) Log density taking state parts with leading chain
+            dimension, and returning log densities of shape (num_chains, ),
+            so that each chain is accepted / rejected separately.
+    """
+
+    def batched_target_log_prob_fn(*state):
+        """Evaluates single-chain log density over chains in parallel."""
+        return tf.map_fn(lambda chain_state: target_log_prob_fn(*chain_state),
+                         elems=list(state), dtype=tf.float32,
+                         parallel_iterations=num_chains)
+
+    return batched_target_log_prob_fn
+
+
+def unwhiten_samples(z_samples, X_train, log_ls_sample=None, scale_tril=None):
+    """Transforms samples of whitened GP latents z back to f = L(ls) z.
+
+    Args:
+        z_samples: (list of tf.Tensor) Samples of whitened GP latents, each
+            of dimension (num_mcmc_samples, [num_chains,] N).
+        X_train: (np.ndarray) Input features of dimension (N, D)
+        log_ls_sample: (tf.Tensor or None) Samples of log length-scale, of
+            dimension (num_mcmc_samples, [num_chains]). If None then use the
+            fixed scale_tril.
+        scale_tril: (tf.Tensor or None) Cholesky factor of the kernel matrix
+            for fixed length-scale, shape (N, N).
+
+    Returns:
+        (list of tf.Tensor) Samples of GP values, same dimensions as z_samples.
+    """
+    if log_ls_sample is None:
+        return [gp.unwhiten(z_sample, X_train, ls=None, scale_tril=scale_tril)
+                for z_sample in z_samples]
+
+    # factorize the kernel matrix once per sample and share across GPs.
+    N = int(X_train.shape[0])
+    log_ls_flat = tf.reshape(log_ls_sample, [-1])
+    z_flat = [tf.reshape(z_sample, [-1, N]) for z_sample in z_samples]
+
+    def _unwhiten_single(elems):
+        log_ls, z_list = elems[0], elems[1:]
+        sample_scale_tril = gp.prior_scale_tril(X_train, ls=tf.exp(log_ls),
+                                                kernel_func=gp.rbf)
+        return [gp.unwhiten(z, X_train, ls=None, scale_tril=sample_scale_tril)
+                for z in z_list]
+
+    f_flat = tf.map_fn(_unwhiten_single, [log_ls_flat] + z_flat,
+                       dtype=[tf.float32] * len(z_flat))
+
+    return [tf.reshape(f_sample, tf.shape(z_sample))
+            for f_sample, z_sample in zip(f_flat, z_samples)]
+
+
+def sample_ls_grid_posterior(ls_logits, log_ls_grid, resid_sample,
+                             weight_samples, node_names):
+    """Draws length-scale samples on the grid given the GP samples.
+
+    For each MCMC sample, draws the grid index of the weight and residual
+    length-scales from their conditional posterior given the GP values,
+    i.e. a Gibbs step for the marginalized length-scales.
+
+    Args:
+        ls_logits: (function) Posterior logits of grid index, see
+            adaptive_ensemble.make_log_joint_fn_tailfree_ls_grid.
+        log_ls_grid: (np.ndarray) Grid of log length-scale values, shape (G, ).
+        resid_sample: (tf.Tensor) Samples of residual GP, of dimension
+            (num_mcmc_samples, [num_chains,] N).
+        weight_samples: (list of tf.Tensor) Samples of node weight GPs, each
+            of the same dimension as resid_sample.
+        node_names: (list of str) Non-root node names of weight_samples.
+
+    Returns:
+        log_ls_weight_sample, log_ls_resid_sample: (tf.Tensor) Samples of
+            log length-scales, of dimension (num_mcmc_samples, [num_chains]).
+    """
+    log_ls_grid = tf.constant(log_ls_grid, dtype=tf.float32)
+    N = int(resid_sample.shape[-1])
+    sample_shape = tf.shape(resid_sample)[:-1]
+
+    resid_flat = tf.reshape(resid_sample, [-1, N])
+    weight_flat = [tf.reshape(weight_sample, [-1, N])
+                   for weight_sample in weight_samples]
+
+    def _ls_logits_single(elems):
+        weight_logits, resid_logits = ls_logits(
+            elems[0], dict(zip(node_names, elems[1:])))
+        return tf.stack([weight_logits, resid_logits])
+
+    logits = tf.map_fn(_ls_logits_single, [resid_flat] + weight_flat,
+                       dtype=tf.float32)
+    grid_ids = [tf.squeeze(tf.multinomial(logits[:, i], 1), -1)
+                for i in range(2)]
+
+    return [tf.reshape(tf.gather(log_ls_grid, ids), sample_shape)
+            for ids in grid_ids]
+
+
+def make_gibbs_kernel_tailfree(target_log_prob_fn, X_train, y_train,
+                               base_pred, family_tree,
+                               default_log_ls_weight=None,
+                               default_log_ls_resid=None,
+                               ridge_factor=1e-3,
+                               whiten=False,
+                               num_chains=None):
+    """Makes ESS-within-Gibbs transition kernel for the tail-free model.
+
+    The state is ordered as in make_inference_graph_tailfree, i.e.
+        [ls_weight, ls_resid,]  sigma, ensemble_resid, temp_*, base_weight_*
+    where the lengthscale parameters are present only if not fixed.
+
+    The GP latents are updated by elliptical slice sampling, with the prior
+    Cholesky factor computed once if the lengthscale is fixed (and once per
+    sweep otherwise), while the scalar parameters are updated by slice
+    sampling. The ESS likelihood is the data likelihood of y (see
+    adaptive_ensemble.make_log_likelihood_fn_tailfree), so no kernel matrix
+    is factorized inside the shrinkage loop.
+
+    Args:
+        target_log_prob_fn: (function) Joint log density of the state.
+        X_train: (np.ndarray) Input features of dimension (N, D)
+        y_train: (np.ndarray) Training labels of dimension (N, )
+        base_pred: (dict of np.ndarray) A dictionary of out-of-sample prediction
+            from base models, each with dimension (N, ).
+        family_tree: (dict of list) A dictionary of list of strings to
+            specify the family tree between models.
+        default_log_ls_weight: (float32 or None) Fixed log length-scale for
+            weight GP. If None then it is part of the state.
+        default_log_ls_resid: (float32 or None) Fixed log length-scale for
+            residual GP. If None then it is part of the state.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        whiten: (bool) Whether the GP latents are whitened (see
+            gp.prior_whitened), in which case their prior is N(0, I).
+        num_chains: (int or None) Number of chains, i.e. size of the leading
+            dimension of each state part. If None then single chain.
+
+    Returns:
+        (elliptical_slice.GibbsKernel) The transition kernel.
+    """
+    infer_ls = default_log_ls_weight is None or default_log_ls_resid is None
+    param_init_idx = 2 if infer_ls else 0
+
+    parent_names = tail_free.get_parent_node_names(family_tree)
+    nonroot_names = tail_free.get_nonroot_node_names(family_tree)
+    num_temp, num_weight = len(parent_names), len(nonroot_names)
+
+    # Cholesky factors of the kernel matrices, memoized by the log
+    # lengthscale tensor so that all GP blocks of one sweep share them.
+    scale_tril_cache = dict()
+
+    def _make_scale_tril(log_ls):
+        if log_ls not in scale_tril_cache:
+            scale_tril_cache[log_ls] = gp.prior_scale_tril(
+                X_train, ls=tf.exp(log_ls), kernel_func=gp.rbf,
+                ridge_factor=ridge_factor)
+        return scale_tril_cache[log_ls]
+
+    if infer_ls:
+        kernel_tril_weight = lambda state: _make_scale_tril(state[0])
+        kernel_tril_resid = lambda state: _make_scale_tril(state[1])
+    else:
+        # fixed lengthscale, factorize the kernel matrices once.
+        kernel_tril_weight = _make_scale_tril(default_log_ls_weight)
+        kernel_tril_resid = _make_scale_tril(default_log_ls_resid)
+
+    if whiten:
+        # whitened latents have identity prior covariance.
+        scale_tril_weight = scale_tril_resid = tf.eye(int(X_train.shape[0]))
+    else:
+        scale_tril_weight = kernel_tril_weight
+        scale_tril_resid = kernel_tril_resid
+
+    log_likelihood = adaptive_ensemble.make_log_likelihood_fn_tailfree(
+        X_train, base_pred, family_tree, y_train)
+
+    def _make_log_likelihood_fn(state_id):
+        """Makes ESS log likelihood factory for the GP latent at state_id."""
+
+        def make_log_likelihood_fn(current_state):
+            if whiten:
+                # unwhitening factors are computed once per sweep.
+                weight_tril, resid_tril = [
+                    scale_tril(current_state) if callable(scale_tril)
+                    else scale_tril
+                    for scale_tril in (kernel_tril_weight, kernel_tril_resid)]
+
+            def state_log_likelihood(*state):
+                """Log likelihood of y given the full (single chain) state."""
+                sigma, ensemble_resid = state[param_init_idx:param_init_idx + 2]
+                temps = state[param_init_idx + 2:param_init_idx + 2 + num_temp]
+                weights = state[param_init_idx + 2 + num_temp:]
+
+                if whiten:
+                    ensemble_resid = gp.unwhiten(ensemble_resid, X_train, ls=None,
+                                                 scale_tril=resid_tril)
+                    weights = [gp.unwhiten(weight, X_train, ls=None,
+                                           scale_tril=weight_tril)
+                               for weight in weights]
+
+                return log_likelihood(
+                    sigma=sigma, ensemble_resid=ensemble_resid,
+                    temp_dict=dict(zip(parent_names, temps)),
+                    base_weight_dict=dict(zip(nonroot_names, weights)))
+
+            if num_chains:
+                state_log_likelihood = make_batched_log_prob_fn(
+                    state_log_likelihood, num_chains)
+
+            def log_likelihood_fn(block_state):
+                state = list(current_state)
+                state[state_id] = block_state
+                return state_log_likelihood(*state)
+
+            return log_likelihood_fn
+
+        return make_log_likelihood_fn
+
+    # scalar parameters: [ls_weight, ls_resid,] sigma, temp_*
+    scalar_ids = (list(range(param_init_idx)) + [param_init_idx] +
+                  list(range(param_init_idx + 2, param_init_idx + 2 + num_temp)))
+    resid_id = param_init_idx + 1
+    weight_ids = list(range(param_init_idx + 2 + num_temp,
+                            param_init_idx + 2 + num_temp + num_weight))
+
+    state_blocks = ([[state_id] for state_id in scalar_ids] +
+                    [[resid_id]] +
+                    [[state_id] for state_id in weight_ids])
+    make_kernel_fns = (
+            [elliptical_slice.make_slice_kernel_fn() for _ in scalar_ids] +
+            [elliptical_slice.make_elliptical_slice_kernel_fn(
+                scale_tril_resid,
+                make_log_likelihood_fn=_make_log_likelihood_fn(resid_id))] +
+            [elliptical_slice.make_elliptical_slice_kernel_fn(
+                scale_tril_weight,
+                make_log_likelihood_fn=_make_log_likelihood_fn(state_id))
+             for state_id in weight_ids])
+
+    return elliptical_slice.GibbsKernel(target_log_prob_fn=target_log_prob_fn,
+                                        make_kernel_fns=make_kernel_fns,
+                                        state_blocks=state_blocks)
+
+
 def run_sampling(mcmc_graph, init_op, parameter_samples, is_accepted):
     """
 
@@ -198,6 +731,7 @@ def run_sampling(mcmc_graph, init_op, parameter_samples, is_accepted):
         parameter_samples: (dict of tf.Tensors) Dictionary of parameters and their
             MCMC samples of shape (param_dim, num_mcmc_samples)
         is_accepted: (tf.Tensor) A tensor indicating whether each mcmc samples is accepted.
+            For multi-chain graphs, acceptance rate is reported for each chain.
 
     Returns:
         parameter_samples_val: (dict of np.ndarray) Dictionary of
@@ -218,8 +752,345 @@ def run_sampling(mcmc_graph, init_op, parameter_samples, is_accepted):
             ])
 
         total_min = (time.time() - time_start) / 60.
-        print('Acceptance Rate: {}'.format(np.mean(is_accepted_)))
+        print('Acceptance Rate: {}'.format(np.mean(is_accepted_, axis=0)))
         print('Total time: {:.2f} min'.format(total_min))
         sess.close()
 
     return parameter_samples_val
+
+
+def run_sampling_chunked(mcmc_graph, init_op, parameter_samples, is_accepted,
+                         output_dir, target_ess=None, max_rhat=1.01):
+    """Runs chunked MCMC graph, streaming samples to disk with checkpointing.
+
+    The chain is run chunk_size steps per session call (see
+    make_inference_graph_tailfree). After each chunk, the post burn-in samples
+    are written into one .npy file per parameter under output_dir, and the
+    chain state, kernel results and graph variables (e.g. HMC step size) are
+    saved to a checkpoint. If output_dir already contains a checkpoint, the
+    run resumes from it.
+
+    Convergence diagnostics are updated incrementally from each new chunk
+    (see diagnostics.OnlineDiagnostics), i.e. split-R-hat from running
+    per-chain moments and bulk/tail ESS from a bounded thinned subsample of
+    a bounded set of coordinates per parameter, so the sample arrays on disk
+    are never re-read. The diagnostics state is saved with the checkpoint.
+    If target_ess is given, sampling stops early once all parameters reach
+    target_ess with R-hat below max_rhat.
+
+    Args:
+        mcmc_graph: (tf.Graph) A computation graph for MCMC built with
+            chunk_size specified.
+        init_op: (tf.Operation) Initialization op
+        parameter_samples: (dict of tf.Tensors) Dictionary of parameters and
+            their MCMC samples for one chunk.
+        is_accepted: (tf.Tensor) A tensor indicating whether each mcmc samples
+            is accepted.
+        output_dir: (str) Directory for sample arrays and checkpoint.
+        target_ess: (float or None) Minimum bulk and tail ESS for early
+            stopping. If None then run all num_mcmc_samples.
+        max_rhat: (float) Maximum split-R-hat for early stopping. This is
+            the classical (not rank-normalized) split-R-hat of
+            diagnostics.OnlineDiagnostics, which can differ from
+            diagnostics.rhat, e.g. it is larger for drifting chains.
+
+    Returns:
+        parameter_samples_val: (dict of np.ndarray) Dictionary of
+            parameters and the memory-mapped MCMC samples, of shape
+            (num_samples, ...), where num_samples is num_mcmc_samples unless
+            stopped early. Parameters with a list of samples (e.g.
+            temp_sample, weight_sample) are stacked along the last axis, so
+            that the chain axis (if any) stays at axis 1.
+
+    Raises:
+        (ValueError) If mcmc_graph is not built with chunk_size specified.
+    """
+    schedule = mcmc_graph.get_collection(_CHUNK_SCHEDULE)
+    if not schedule:
+        raise ValueError('mcmc_graph does not support chunked sampling, '
+                         'specify chunk_size in make_inference_graph_tailfree.')
+
+    state_init = mcmc_graph.get_collection(_CHUNK_STATE_INIT)
+    state_final = mcmc_graph.get_collection(_CHUNK_STATE_FINAL)
+    results_init = mcmc_graph.get_collection(_CHUNK_RESULTS_INIT)
+    results_final = mcmc_graph.get_collection(_CHUNK_RESULTS_FINAL)
+    with mcmc_graph.as_default():
+        graph_variables = tf.global_variables()
+
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_addr = os.path.join(output_dir, _CHECKPOINT_FILE_NAME)
+    sample_names = list(parameter_samples.keys()) + ["is_accepted"]
+
+    time_start = time.time()
+    with tf.Session(graph=mcmc_graph) as sess:
+        init_op.run()
+        num_burnin_steps, num_mcmc_samples, chunk_size = sess.run(schedule[0])
+        num_total_steps = num_burnin_steps + num_mcmc_samples
+
+        # restore chain from checkpoint
+        feed_dict = dict()
+        num_steps_done = 0
+        sampling_time = 0.
+        is_converged = False
+        monitor = None
+        if os.path.isfile(checkpoint_addr):
+            with open(checkpoint_addr, 'rb') as file:
+                checkpoint = pk.load(file)
+
+            num_steps_done = checkpoint["num_steps_done"]
+            sampling_time = checkpoint["sampling_time"]
+            is_converged = checkpoint["is_converged"]
+            monitor = checkpoint.get("diagnostics", None)
+            if monitor is None:
+                print('Checkpoint has no diagnostics state, diagnostics '
+                      'only cover samples drawn after resuming.')
+            feed_dict = dict(zip(state_init + results_init,
+                                 checkpoint["state"] +
+                                 checkpoint["kernel_results"]))
+            for variable, value in zip(graph_variables,
+                                       checkpoint["variables"]):
+                variable.load(value, sess)
+            print('Resuming from step {}/{}'.format(num_steps_done,
+                                                    num_total_steps))
+
+        sample_arrays = dict()
+        while num_steps_done < num_total_steps and not is_converged:
+            time_chunk_start = time.time()
+            [
+                parameter_samples_val,
+                is_accepted_,
+                state_val,
+                results_val,
+            ] = sess.run(
+                [
+                    parameter_samples,
+                    is_accepted,
+                    state_final,
+                    results_final,
+                ], feed_dict=feed_dict)
+
+            # write post burn-in part of the chunk to disk
+            chunk_start = max(num_burnin_steps - num_steps_done, 0)
+            chunk_stop = min(num_total_steps - num_steps_done, chunk_size)
+            sample_start = num_steps_done + chunk_start - num_burnin_steps
+
+            if monitor is None:
+                monitor = diagnostics.OnlineDiagnostics(
+                    chain_axis=1 if np.ndim(is_accepted_) > 1 else None)
+
+            if chunk_start < chunk_stop:
+                chunk_val = dict(parameter_samples_val,
+                                 is_accepted=is_accepted_)
+                for name in sample_names:
+                    sample_val = chunk_val[name]
+                    if isinstance(sample_val, list):
+                        sample_val = np.stack(sample_val, axis=-1)
+                    sample_val = sample_val[chunk_start:chunk_stop]
+
+                    if name not in sample_arrays:
+                        sample_arrays[name] = _open_sample_array(
+                            output_dir, name, sample_val,
+                            num_mcmc_samples)
+                    sample_arrays[name][
+                        sample_start:sample_start + len(sample_val)] = sample_val
+                    sample_arrays[name].flush()
+
+                    if name != "is_accepted":
+                        monitor.update(name, sample_val)
+
+            # check stop rule on samples so far
+            num_steps_done += chunk_size
+            sampling_time += time.time() - time_chunk_start
+            num_samples = _num_samples_kept(num_steps_done, num_burnin_steps,
+                                            num_mcmc_samples)
+            if target_ess and num_samples >= _MIN_SAMPLES_FOR_STOPPING:
+                diagnostics_val = _report_diagnostics(monitor, sampling_time)
+                # NaN diagnostics (e.g. constant or too short chains)
+                # compare as False, hence count as not converged.
+                is_converged = bool(diagnostics_val) and all(
+                    diag["rhat"] <= max_rhat and
+                    min(diag["ess_bulk"], diag["ess_tail"]) >= target_ess
+                    for diag in diagnostics_val.values())
+
+            # save checkpoint, atomically to survive crash during write
+            feed_dict = dict(zip(state_init + results_init,
+                                 state_val + results_val))
+            checkpoint = dict(num_steps_done=num_steps_done,
+                              sampling_time=sampling_time,
+                              is_converged=is_converged,
+                              diagnostics=monitor,
+                              state=state_val,
+                              kernel_results=results_val,
+                              variables=sess.run(graph_variables))
+            with open(checkpoint_addr + ".tmp", 'wb') as file:
+                pk.dump(checkpoint, file, protocol=pk.HIGHEST_PROTOCOL)
+            os.replace(checkpoint_addr + ".tmp", checkpoint_addr)
+
+            print('Step {}/{}, {:.2f} min'.format(
+                min(num_steps_done, num_total_steps), num_total_steps,
+                (time.time() - time_start) / 60.))
+
+        sess.close()
+
+    num_samples = _num_samples_kept(num_steps_done, num_burnin_steps,
+                                    num_mcmc_samples)
+    parameter_samples_val = {
+        name: np.load(os.path.join(output_dir, "{}.npy".format(name)),
+                      mmap_mode='r')[:num_samples] for name in sample_names}
+    is_accepted_ = parameter_samples_val.pop("is_accepted")
+
+    total_min = (time.time() - time_start) / 60.
+    if is_converged:
+        print('Converged after {} samples'.format(num_samples))
+    if monitor is not None and monitor.names:
+        _report_diagnostics(monitor, sampling_time)
+    print('Acceptance Rate: {}'.format(np.mean(is_accepted_, axis=0)))
+    print('Total time: {:.2f} min'.format(total_min))
+
+    return parameter_samples_val
+
+
+def _open_sample_array(output_dir, name, sample_val, num_mcmc_samples):
+    """Opens (or creates) memory-mapped .npy array for parameter samples."""
+    array_addr = os.path.join(output_dir, "{}.npy".format(name))
+    if os.path.isfile(array_addr):
+        return np.load(array_addr, mmap_mode='r+')
+
+    return np.lib.format.open_memmap(
+        array_addr, mode='w+', dtype=sample_val.dtype,
+        shape=(num_mcmc_samples,) + sample_val.shape[1:])
+
+
+def _num_samples_kept(num_steps_done, num_burnin_steps, num_mcmc_samples):
+    """Computes number of post burn-in samples after num_steps_done steps."""
+    return int(min(max(num_steps_done - num_burnin_steps, 0),
+                   num_mcmc_samples))
+
+
+def _report_diagnostics(monitor, sampling_time):
+    """Computes and prints convergence diagnostics for each parameter.
+
+    Args:
+        monitor: (diagnostics.OnlineDiagnostics) Online diagnostics updated
+            with the samples so far.
+        sampling_time: (float) Wall time (in seconds) spent on sampling.
+
+    Returns:
+        (dict of dict) Dictionary of parameters and their diagnostics, see
+            diagnostics.OnlineDiagnostics.summarize.
+    """
+    diagnostics_val = dict()
+    for name in monitor.names:
+        diag = monitor.summarize(name)
+        diagnostics_val[name] = diag
+        print('{}: R-hat {:.3f}, bulk ESS {:.0f}, tail ESS {:.0f}, '
+              'ESS/sec {:.2f}'.format(
+            name, diag["rhat"], diag["ess_bulk"], diag["ess_tail"],
+            min(diag["ess_bulk"], diag["ess_tail"]) / sampling_time))
+
+    return diagnostics_val
+
+
+class TailFreeSampler(object):
+    """Compile-once MCMC sampler for the tail-free model.
+
+    Builds the MCMC graph once for the data signature (i.e. shapes of
+    X_train, y_train and names of base models), with data fed through
+    placeholders, and keeps a session open. Repeated fits on new data of the
+    same signature (e.g. CV folds) then only pay for graph execution.
+
+    Example:
+        sampler = TailFreeSampler(X_train, y_train, base_pred, family_tree,
+                                  default_log_ls_weight=-1.,
+                                  default_log_ls_resid=-1.)
+        for X_fold, y_fold, base_pred_fold in folds:
+            parameter_samples_val = sampler.run(X_fold, y_fold, base_pred_fold)
+        sampler.close()
+    """
+
+    def __init__(self, X_train, y_train, base_pred, family_tree,
+                 use_xla=False, **graph_kwargs):
+        """Builds the MCMC graph and opens a session.
+
+        Args:
+            X_train: (np.ndarray) Template input features of dimension (N, D)
+            y_train: (np.ndarray) Template training labels of dimension (N, )
+            base_pred: (dict of np.ndarray) Template dictionary of base model
+                predictions, each with dimension (N, ).
+            family_tree: (dict of list or None) Family tree between models,
+                see make_inference_graph_tailfree.
+            use_xla: (bool) Whether to compile the graph with XLA JIT
+                (auto-clustering of the sampler ops, including the target
+                log density and its gradient).
+            **graph_kwargs: Additional parameters to pass to
+                make_inference_graph_tailfree, e.g. sampler or num_chains.
+        """
+        self.X_shape = X_train.shape
+        self.y_shape = y_train.squeeze().shape
+        self.model_names = list(base_pred.keys())
+
+        (self.mcmc_graph, self.init_op,
+         self.parameter_samples, self.is_accepted) = (
+            make_inference_graph_tailfree(X_train, y_train, base_pred,
+                                          family_tree,
+                                          use_placeholders=True,
+                                          **graph_kwargs))
+        self.data_placeholders = self.mcmc_graph.get_collection(
+            _DATA_PLACEHOLDERS)
+
+        config = tf.ConfigProto()
+        if use_xla:
+            config.graph_options.optimizer_options.global_jit_level = (
+                tf.OptimizerOptions.ON_1)
+        self.sess = tf.Session(graph=self.mcmc_graph, config=config)
+
+    def run(self, X_train, y_train, base_pred):
+        """Runs MCMC on new data, re-initializing sampler state.
+
+        Args:
+            X_train: (np.ndarray) Input features of dimension (N, D)
+            y_train: (np.ndarray) Training labels of dimension (N, )
+            base_pred: (dict of np.ndarray) Dictionary of base model
+                predictions, with the same model names as the template.
+
+        Returns:
+            parameter_samples_val: (dict of np.ndarray) Dictionary of
+                parameters and the MCMC samples evaluated by tf session.
+
+        Raises:
+            (ValueError) If data does not match the graph signature.
+        """
+        y_train = y_train.squeeze()
+        if (X_train.shape != self.X_shape or
+                y_train.shape != self.y_shape or
+                set(base_pred.keys()) != set(self.model_names)):
+            raise ValueError(
+                "Data signature (X {}, y {}, models {}) does not match "
+                "sampler signature (X {}, y {}, models {}).".format(
+                    X_train.shape, y_train.shape, sorted(base_pred.keys()),
+                    self.X_shape, self.y_shape, sorted(self.model_names)))
+
+        feed_dict = dict(zip(self.data_placeholders,
+                             [X_train, y_train] +
+                             [base_pred[name] for name in self.model_names]))
+
+        time_start = time.time()
+        self.sess.run(self.init_op)
+        [
+            parameter_samples_val,
+            is_accepted_,
+        ] = self.sess.run(
+            [
+                self.parameter_samples,
+                self.is_accepted,
+            ], feed_dict=feed_dict)
+
+        total_min = (time.time() - time_start) / 60.
+        print('Acceptance Rate: {}'.format(np.mean(is_accepted_, axis=0)))
+        print('Total time: {:.2f} min'.format(total_min))
+
+        return parameter_samples_val
+
+    def close(self):
+        """Closes the session."""
+        self.sess.close()
@@ -0,0 +1,529 @@
+"""No-U-Turn sampler with step size and diagonal mass matrix adaptation.
+
+Implements the No-U-Turn Sampler (NUTS) [1] as a tfp.mcmc.TransitionKernel.
+Each iteration doubles the leapfrog trajectory in a random direction until
+either end makes a U-turn, and draws the next state from the trajectory
+in proportion to exp(-H) (i.e. multinomial NUTS, see [2]).
+
+During the first `num_adaptation_steps` iterations (i.e. the burn-in of
+tfp.mcmc.sample_chain), the kernel also adapts
+
+    * the step size, using the dual averaging scheme of [1] towards
+      `target_accept_prob`, and
+    * a diagonal inverse mass matrix, estimated as the (regularized) sample
+      variance of the states over a series of doubling windows, following
+      the warmup schedule of Stan [3].
+
+Adaptation state is carried in the kernel results, so no tf.Variable is
+needed, and the step size and mass matrix are frozen after warmup.
+
+The state parts are flattened into a single vector internally, and only a
+single chain (i.e. unbatched state) is supported.
+
+#### References
+
+[1]:    Matthew Hoffman and Andrew Gelman. The No-U-Turn Sampler: Adaptively
+        Setting Path Lengths in Hamiltonian Monte Carlo.
+        _Journal of Machine Learning Research_, 15(1):1593-1623, 2014.
+[2]:    Michael Betancourt. A Conceptual Introduction to Hamiltonian Monte Carlo.
+        _arXiv preprint arXiv:1701.02434_, 2017.
+[3]:    Stan Development Team. Stan Reference Manual, HMC Algorithm Parameters.
+        https://mc-stan.org/docs/reference-manual/hmc-algorithm-parameters.html
+"""
+import collections
+
+import numpy as np
+
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+_NUTS_MAX_TREE_DEPTH = 10
+_NUTS_MAX_ENERGY_ERROR = 1000.
+_NUTS_TARGET_ACCEPT_PROB = 0.8
+
+# dual averaging parameters, see Section 3.2.1 of [1].
+_DUAL_AVERAGING_GAMMA = 0.05
+_DUAL_AVERAGING_T0 = 10.
+_DUAL_AVERAGING_KAPPA = 0.75
+
+# warmup window schedule and mass matrix regularization, see [3].
+_WARMUP_INIT_BUFFER = 75
+_WARMUP_TERM_BUFFER = 50
+_WARMUP_BASE_WINDOW = 25
+
+NUTSAdaptationState = collections.namedtuple(
+    'NUTSAdaptationState',
+    ['step', 'window_step', 'mu', 'error_sum', 'log_averaged_step_size',
+     'variance_mean', 'variance_m2', 'variance_count'])
+
+NUTSKernelResults = collections.namedtuple(
+    'NUTSKernelResults',
+    ['target_log_prob', 'grads_target_log_prob',
+     'is_accepted', 'accept_prob', 'is_divergent',
+     'tree_depth', 'num_leapfrog_steps',
+     'step_size', 'inv_mass', 'adaptation'])
+
+
+def warmup_window_ends(num_adaptation_steps,
+                       init_buffer=_WARMUP_INIT_BUFFER,
+                       term_buffer=_WARMUP_TERM_BUFFER,
+                       base_window=_WARMUP_BASE_WINDOW):
+    """Computes end of each mass matrix adaptation window.
+
+    Windows start after `init_buffer` steps with size `base_window`, and
+    double in size until `term_buffer` steps before the end of warmup. The
+    last window is extended to fill the remaining steps.
+
+    Args:
+        num_adaptation_steps: (int) Number of warmup steps.
+        init_buffer: (int) Number of initial steps for step size only.
+        term_buffer: (int) Number of final steps for step size only.
+        base_window: (int) Size of the first window.
+
+    Returns:
+        (np.ndarray of int32) Steps (1-based) at which each window ends.
+            Empty if num_adaptation_steps is too short for any window.
+    """
+    window_start = init_buffer
+    window_stop = num_adaptation_steps - term_buffer
+
+    window_ends = []
+    window_size = base_window
+    while window_start + window_size <= window_stop:
+        # extend the last window if the next one does not fit.
+        if window_start + 3 * window_size > window_stop:
+            window_size = window_stop - window_start
+        window_start += window_size
+        window_ends.append(window_start)
+        window_size *= 2
+
+    return np.asarray(window_ends, dtype=np.int32)
+
+
+class NoUTurnSampler(tfp.mcmc.TransitionKernel):
+    """Multinomial No-U-Turn sampler with warmup adaptation."""
+
+    def __init__(self, target_log_prob_fn, step_size=0.1,
+                 num_adaptation_steps=0,
+                 target_accept_prob=_NUTS_TARGET_ACCEPT_PROB,
+                 max_tree_depth=_NUTS_MAX_TREE_DEPTH,
+                 max_energy_error=_NUTS_MAX_ENERGY_ERROR,
+                 name=None):
+        """Initializes the kernel.
+
+        Args:
+            target_log_prob_fn: (function) Joint log density, takes all state
+                parts as positional arguments and returns a scalar.
+            step_size: (float) Initial leapfrog step size.
+            num_adaptation_steps: (int) Number of warmup steps during which
+                the step size and mass matrix are adapted, typically the
+                num_burnin_steps of tfp.mcmc.sample_chain.
+            target_accept_prob: (float) Target mean acceptance statistic for
+                step size adaptation.
+            max_tree_depth: (int) Maximum number of trajectory doublings,
+                i.e. at most 2 ** max_tree_depth - 1 leapfrog steps.
+            max_energy_error: (float) Energy error beyond which a trajectory
+                is considered divergent.
+            name: (str) Name prefix for ops created by this kernel.
+        """
+        self._parameters = dict(target_log_prob_fn=target_log_prob_fn,
+                                step_size=step_size,
+                                num_adaptation_steps=num_adaptation_steps,
+                                target_accept_prob=target_accept_prob,
+                                max_tree_depth=max_tree_depth,
+                                max_energy_error=max_energy_error,
+                                name=name)
+        self._window_ends = warmup_window_ends(num_adaptation_steps)
+
+    @property
+    def target_log_prob_fn(self):
+        return self._parameters['target_log_prob_fn']
+
+    @property
+    def step_size(self):
+        return self._parameters['step_size']
+
+    @property
+    def num_adaptation_steps(self):
+        return self._parameters['num_adaptation_steps']
+
+    @property
+    def target_accept_prob(self):
+        return self._parameters['target_accept_prob']
+
+    @property
+    def max_tree_depth(self):
+        return self._parameters['max_tree_depth']
+
+    @property
+    def max_energy_error(self):
+        return self._parameters['max_energy_error']
+
+    @property
+    def name(self):
+        return self._parameters['name']
+
+    @property
+    def parameters(self):
+        return self._parameters
+
+    @property
+    def is_calibrated(self):
+        return True
+
+    """ State flattening and gradients. """
+
+    def _flatten(self, state_parts):
+        return tf.concat([tf.reshape(state_part, [-1])
+                          for state_part in state_parts], axis=0)
+
+    def _unflatten(self, state_flat, state_shapes):
+        state_sizes = [int(np.prod(shape)) for shape in state_shapes]
+        return [tf.reshape(state_part, shape) for state_part, shape in
+                zip(tf.split(state_flat, state_sizes), state_shapes)]
+
+    def _log_prob_and_grad(self, state_flat, state_shapes):
+        log_prob = self.target_log_prob_fn(
+            *self._unflatten(state_flat, state_shapes))
+        grad = tf.gradients(log_prob, state_flat)[0]
+        return log_prob, grad
+
+    """ Kernel interface. """
+
+    def bootstrap_results(self, init_state):
+        """Computes target log density, gradient and initial adaptation state."""
+        with tf.name_scope(self.name or 'nuts', values=[init_state]):
+            state_parts = _to_list(init_state)
+            state_shapes = [state_part.shape.as_list()
+                            for state_part in state_parts]
+            state_flat = self._flatten(state_parts)
+            num_dims = state_flat.shape.as_list()[0]
+
+            log_prob, grad = self._log_prob_and_grad(state_flat, state_shapes)
+            step_size = tf.convert_to_tensor(self.step_size, dtype=tf.float32)
+
+            adaptation = NUTSAdaptationState(
+                step=tf.constant(0, dtype=tf.int32),
+                window_step=tf.constant(0., dtype=tf.float32),
+                mu=tf.log(10. * step_size),
+                error_sum=tf.constant(0., dtype=tf.float32),
+                log_averaged_step_size=tf.constant(0., dtype=tf.float32),
+                variance_mean=tf.zeros([num_dims], dtype=tf.float32),
+                variance_m2=tf.zeros([num_dims], dtype=tf.float32),
+                variance_count=tf.constant(0., dtype=tf.float32))
+
+            return NUTSKernelResults(
+                target_log_prob=log_prob,
+                grads_target_log_prob=grad,
+                is_accepted=tf.constant(True),
+                accept_prob=tf.constant(1., dtype=tf.float32),
+                is_divergent=tf.constant(False),
+                tree_depth=tf.constant(0, dtype=tf.int32),
+                num_leapfrog_steps=tf.constant(0, dtype=tf.int32),
+                step_size=step_size,
+                inv_mass=tf.ones([num_dims], dtype=tf.float32),
+                adaptation=adaptation)
+
+    def one_step(self, current_state, previous_kernel_results):
+        """Runs one NUTS iteration, followed by a warmup adaptation step.
+
+        Args:
+            current_state: (tf.Tensor or list of tf.Tensor) Current state.
+            previous_kernel_results: (NUTSKernelResults) Results from the
+                previous step, or from `bootstrap_results`.
+
+        Returns:
+            next_state: (tf.Tensor or list of tf.Tensor) Next state.
+            kernel_results: (NUTSKernelResults) Kernel results.
+        """
+        with tf.name_scope(self.name or 'nuts', values=[current_state]):
+            state_parts = _to_list(current_state)
+            state_shapes = [state_part.shape.as_list()
+                            for state_part in state_parts]
+            state_flat = self._flatten(state_parts)
+
+            (next_state_flat, next_log_prob, next_grad,
+             is_accepted, accept_prob, is_divergent,
+             tree_depth, num_leapfrog_steps) = self._build_tree(
+                state_flat, state_shapes,
+                log_prob=previous_kernel_results.target_log_prob,
+                grad=previous_kernel_results.grads_target_log_prob,
+                step_size=previous_kernel_results.step_size,
+                inv_mass=previous_kernel_results.inv_mass)
+
+            step_size, inv_mass, adaptation = self._adapt(
+                next_state_flat, accept_prob,
+                step_size=previous_kernel_results.step_size,
+                inv_mass=previous_kernel_results.inv_mass,
+                adaptation=previous_kernel_results.adaptation)
+
+            next_state = self._unflatten(next_state_flat, state_shapes)
+            if not isinstance(current_state, (list, tuple)):
+                next_state = next_state[0]
+
+            return next_state, NUTSKernelResults(
+                target_log_prob=next_log_prob,
+                grads_target_log_prob=next_grad,
+                is_accepted=is_accepted,
+                accept_prob=accept_prob,
+                is_divergent=is_divergent,
+                tree_depth=tree_depth,
+                num_leapfrog_steps=num_leapfrog_steps,
+                step_size=step_size,
+                inv_mass=inv_mass,
+                adaptation=adaptation)
+
+    """ Trajectory building. """
+
+    def _build_tree(self, state, state_shapes, log_prob, grad,
+                    step_size, inv_mass):
+        """Builds NUTS trajectory by repeated doubling and draws next state.
+
+        Returns:
+            next_state, next_log_prob, next_grad: (tf.Tensor) Selected state,
+                its target log density and gradient.
+            is_accepted: (tf.Tensor of bool) Whether the state has moved.
+            accept_prob: (tf.Tensor) Mean acceptance statistic over all
+                leapfrog steps, used for step size adaptation.
+            is_divergent: (tf.Tensor of bool) Whether a divergence occurred.
+            tree_depth: (tf.Tensor of int32) Number of doublings.
+            num_leapfrog_steps: (tf.Tensor of int32) Number of leapfrog steps.
+        """
+        momentum = tf.random_normal(tf.shape(state)) / tf.sqrt(inv_mass)
+        energy_init = -log_prob + 0.5 * tf.reduce_sum(
+            inv_mass * tf.square(momentum))
+
+        def _energy(log_prob, momentum):
+            return -log_prob + 0.5 * tf.reduce_sum(
+                inv_mass * tf.square(momentum), axis=-1)
+
+        def _no_u_turn(state_first, state_last, mom_first, mom_last, direction):
+            """Checks (z_last - z_first) . M^{-1} p > 0 at both ends."""
+            state_diff = direction * (state_last - state_first)
+            return tf.logical_and(
+                tf.reduce_sum(state_diff * inv_mass * mom_first, axis=-1) > 0.,
+                tf.reduce_sum(state_diff * inv_mass * mom_last, axis=-1) > 0.)
+
+        def _leapfrog_subtree(start_state, start_mom, start_grad,
+                              direction, num_steps):
+            """Runs num_steps leapfrog steps, recording each visited state."""
+            eps = direction * step_size
+
+            def _cond(step_id, *_):
+                return step_id < num_steps
+
+            def _body(step_id, z, p, g, z_arr, p_arr, g_arr, lp_arr):
+                p = p + 0.5 * eps * g
+                z = z + eps * inv_mass * p
+                lp, g = self._log_prob_and_grad(z, state_shapes)
+                p = p + 0.5 * eps * g
+                return (step_id + 1, z, p, g,
+                        z_arr.write(step_id, z), p_arr.write(step_id, p),
+                        g_arr.write(step_id, g), lp_arr.write(step_id, lp))
+
+            _, _, _, _, z_arr, p_arr, g_arr, lp_arr = tf.while_loop(
+                _cond, _body,
+                loop_vars=(tf.constant(0), start_state, start_mom, start_grad,
+                           tf.TensorArray(tf.float32, size=num_steps),
+                           tf.TensorArray(tf.float32, size=num_steps),
+                           tf.TensorArray(tf.float32, size=num_steps),
+                           tf.TensorArray(tf.float32, size=num_steps)))
+
+            return z_arr.stack(), p_arr.stack(), g_arr.stack(), lp_arr.stack()
+
+        def _subtree_no_u_turn(states, moms, direction, num_steps):
+            """Checks no-U-turn on all balanced binary sub-trees."""
+
+            def _cond(block_size, no_u_turn):
+                return tf.logical_and(block_size <= num_steps, no_u_turn)
+
+            def _body(block_size, no_u_turn):
+                first_ids = tf.range(0, num_steps, block_size)
+                last_ids = first_ids + block_size - 1
+                block_no_u_turn = _no_u_turn(
+                    tf.gather(states, first_ids), tf.gather(states, last_ids),
+                    tf.gather(moms, first_ids), tf.gather(moms, last_ids),
+                    direction)
+                return block_size * 2, tf.reduce_all(block_no_u_turn)
+
+            _, no_u_turn = tf.while_loop(
+                _cond, _body, loop_vars=(tf.constant(2), tf.constant(True)))
+            return no_u_turn
+
+        def _cond(depth, is_continue, *_):
+            return is_continue
+
+        def _body(depth, is_continue,
+                  z_left, p_left, g_left, z_right, p_right, g_right,
+                  z_next, lp_next, g_next, log_sum_weight,
+                  is_accepted, is_divergent, accept_sum, num_steps_total):
+            direction = tf.where(tf.random_uniform([]) < 0.5, -1., 1.)
+            num_steps = tf.bitwise.left_shift(1, depth)
+            is_forward = direction > 0.
+
+            # extend trajectory from the end in the chosen direction.
+            states, moms, grads, log_probs = _leapfrog_subtree(
+                tf.where(is_forward, z_right, z_left),
+                tf.where(is_forward, p_right, p_left),
+                tf.where(is_forward, g_right, g_left),
+                direction, num_steps)
+
+            energy = _energy(log_probs, moms)
+            energy_error = tf.where(tf.is_finite(energy),
+                                    energy - energy_init,
+                                    tf.fill(tf.shape(energy), np.inf))
+            log_weights = -energy_error
+
+            accept_sum += tf.reduce_sum(tf.minimum(1., tf.exp(log_weights)))
+            num_steps_total += num_steps
+
+            subtree_divergent = tf.reduce_any(
+                energy_error > self.max_energy_error)
+            subtree_valid = tf.logical_and(
+                tf.logical_not(subtree_divergent),
+                _subtree_no_u_turn(states, moms, direction, num_steps))
+
+            # multinomial draw within new subtree, then biased merge.
+            log_sum_weight_new = tf.reduce_logsumexp(log_weights)
+            draw_id = tf.minimum(
+                tf.squeeze(tf.multinomial(log_weights[tf.newaxis], 1,
+                                          output_dtype=tf.int32)),
+                num_steps - 1)
+            is_draw_accepted = tf.logical_and(
+                subtree_valid,
+                tf.log(tf.random_uniform([])) <
+                log_sum_weight_new - log_sum_weight)
+
+            z_next = tf.where(is_draw_accepted, states[draw_id], z_next)
+            lp_next = tf.where(is_draw_accepted, log_probs[draw_id], lp_next)
+            g_next = tf.where(is_draw_accepted, grads[draw_id], g_next)
+            is_accepted = tf.logical_or(is_accepted, is_draw_accepted)
+
+            log_sum_weight = tf.where(
+                subtree_valid,
+                tf.reduce_logsumexp(tf.stack([log_sum_weight,
+                                              log_sum_weight_new])),
+                log_sum_weight)
+
+            # update trajectory ends.
+            update_right = tf.logical_and(subtree_valid, is_forward)
+            update_left = tf.logical_and(subtree_valid,
+                                         tf.logical_not(is_forward))
+            z_right = tf.where(update_right, states[-1], z_right)
+            p_right = tf.where(update_right, moms[-1], p_right)
+            g_right = tf.where(update_right, grads[-1], g_right)
+            z_left = tf.where(update_left, states[-1], z_left)
+            p_left = tf.where(update_left, moms[-1], p_left)
+            g_left = tf.where(update_left, grads[-1], g_left)
+
+            is_continue = tf.logical_and(
+                subtree_valid,
+                tf.logical_and(
+                    _no_u_turn(z_left, z_right, p_left, p_right, 1.),
+                    depth + 1 < self.max_tree_depth))
+
+            return (depth + 1, is_continue,
+                    z_left, p_left, g_left, z_right, p_right, g_right,
+                    z_next, lp_next, g_next, log_sum_weight,
+                    is_accepted, tf.logical_or(is_divergent, subtree_divergent),
+                    accept_sum, num_steps_total)
+
+        (tree_depth, _, _, _, _, _, _, _,
+         next_state, next_log_prob, next_grad, _,
+         is_accepted, is_divergent,
+         accept_sum, num_leapfrog_steps) = tf.while_loop(
+            _cond, _body,
+            loop_vars=(tf.constant(0), tf.constant(True),
+                       state, momentum, grad, state, momentum, grad,
+                       state, log_prob, grad, tf.constant(0.),
+                       tf.constant(False), tf.constant(False),
+                       tf.constant(0.), tf.constant(0)))
+
+        accept_prob = accept_sum / tf.cast(num_leapfrog_steps, tf.float32)
+        return (next_state, next_log_prob, next_grad,
+                is_accepted, accept_prob, is_divergent,
+                tree_depth, num_leapfrog_steps)
+
+    """ Warmup adaptation. """
+
+    def _adapt(self, state, accept_prob, step_size, inv_mass, adaptation):
+        """Updates step size and mass matrix during warmup.
+
+        Returns:
+            step_size: (tf.Tensor) Step size for next iteration.
+            inv_mass: (tf.Tensor) Diagonal inverse mass matrix for next
+                iteration.
+            adaptation: (NUTSAdaptationState) Updated adaptation state.
+        """
+        if not self.num_adaptation_steps:
+            return step_size, inv_mass, adaptation
+
+        step = adaptation.step + 1
+        is_adapting = step <= self.num_adaptation_steps
+
+        # dual averaging of log step size.
+        window_step = adaptation.window_step + 1.
+        eta = 1. / (window_step + _DUAL_AVERAGING_T0)
+        error_sum = ((1. - eta) * adaptation.error_sum +
+                     eta * (self.target_accept_prob - accept_prob))
+        log_step_size = (adaptation.mu - tf.sqrt(window_step) /
+                         _DUAL_AVERAGING_GAMMA * error_sum)
+        weight = tf.pow(window_step, -_DUAL_AVERAGING_KAPPA)
+        log_averaged_step_size = (weight * log_step_size +
+                                  (1. - weight) * adaptation.log_averaged_step_size)
+
+        # Welford estimate of state variance within the current window.
+        is_in_window = tf.logical_and(
+            step > _WARMUP_INIT_BUFFER,
+            step <= self.num_adaptation_steps - _WARMUP_TERM_BUFFER)
+        count = adaptation.variance_count + 1.
+        delta = state - adaptation.variance_mean
+        mean = adaptation.variance_mean + delta / count
+        m2 = adaptation.variance_m2 + delta * (state - mean)
+
+        count = tf.where(is_in_window, count, adaptation.variance_count)
+        mean = tf.where(is_in_window, mean, adaptation.variance_mean)
+        m2 = tf.where(is_in_window, m2, adaptation.variance_m2)
+
+        # at window end, update mass matrix and restart dual averaging.
+        is_window_end = tf.reduce_any(
+            tf.equal(step, tf.constant(self._window_ends, dtype=tf.int32)))
+        window_variance = m2 / tf.maximum(count - 1., 1.)
+        window_inv_mass = ((count / (count + 5.)) * window_variance +
+                           1e-3 * (5. / (count + 5.)))
+
+        inv_mass = tf.where(is_window_end, window_inv_mass, inv_mass)
+        mu = tf.where(is_window_end, np.log(10.) + log_step_size, adaptation.mu)
+        window_step = tf.where(is_window_end, 0., window_step)
+        error_sum = tf.where(is_window_end, 0., error_sum)
+        log_averaged_step_size = tf.where(is_window_end, 0.,
+                                          log_averaged_step_size)
+        count = tf.where(is_window_end, 0., count)
+        mean = tf.where(is_window_end, tf.zeros_like(mean), mean)
+        m2 = tf.where(is_window_end, tf.zeros_like(m2), m2)
+
+        # use averaged step size at the end of warmup.
+        next_step_size = tf.where(
+            tf.equal(step, self.num_adaptation_steps),
+            tf.exp(log_averaged_step_size), tf.exp(log_step_size))
+        next_step_size = tf.where(is_window_end,
+                                  tf.exp(log_step_size), next_step_size)
+
+        adaptation = NUTSAdaptationState(
+            step=step, window_step=window_step, mu=mu,
+            error_sum=error_sum,
+            log_averaged_step_size=log_averaged_step_size,
+            variance_mean=mean, variance_m2=m2, variance_count=count)
+
+        # freeze step size after warmup, mass matrix only changes at window ends.
+        step_size = tf.where(is_adapting, next_step_size, step_size)
+
+        return step_size, inv_mass, adaptation
+
+
+def _to_list(state):
+    """Converts state (or list of state parts) to list of tf.Tensor."""
+    if isinstance(state, (list, tuple)):
+        return [tf.convert_to_tensor(state_part, dtype=tf.float32)
+                for state_part in state]
+    return [tf.convert_to_tensor(state, dtype=tf.float32)]
@@ -73,6 +73,13 @@ def sparse_conditional_weight(X, base_pred, temp,
     # specify un-normalized GP weights
     base_names = list(base_pred.keys())
 
+    # factorize the kernel once, shared by all base weight GPs.
+    if (gp.uses_scale_tril(gp.prior) and
+            kwargs.get("scale_tril", None) is None):
+        kwargs["scale_tril"] = gp.prior_scale_tril(X, ls=kwargs["ls"],
+                                                   kernel_func=kernel_func,
+                                                   ridge_factor=ridge_factor)
+
     # Note: skip the first model
     W_raw = tf.stack([
         gp.prior(X, kernel_func=kernel_func,
@@ -162,7 +169,8 @@ def model_flat(X, base_pred, family_tree=None,
 
 
 def model_tailfree(X, base_pred, family_tree=None,
-                   log_ls_weight=None, log_ls_resid=None, **kwargs):
+                   log_ls_weight=None, log_ls_resid=None,
+                   prior_func=gp.prior, resid_scale_tril=None, **kwargs):
     r"""Defines the sparse adaptive ensemble model.
 
         y           ~   N(f, sigma^2)
@@ -185,6 +193,14 @@ def model_tailfree(X, base_pred, family_tree=None,
             If None then will estimate with normal prior.
         log_ls_resid: (float32) length-scale parameter for residual GP.
             If None then will estimate with normal prior.
+        prior_func: (function) Gaussian process prior for both the weight and
+            the residual GPs, e.g. gp.prior, gp.prior_whitened or
+            gp.prior_rff. Use
+            functools.partial to fix backend options such as n_features.
+        resid_scale_tril: (tf.Tensor of float32 or None) Pre-computed Cholesky
+            factor of the residual GP kernel matrix (see gp.prior_scale_tril)
+            for fixed log_ls_resid. Only used if prior_func is gp.prior or
+            gp.prior_whitened.
         **kwargs: Additional parameters to pass to tail_free.prior.
 
     Returns:
@@ -211,19 +227,27 @@ def model_tailfree(X, base_pred, family_tree=None,
     ensemble_weights, model_names = tail_free.prior(X, base_pred,
                                                     family_tree=family_tree,
                                                     ls=tf.exp(log_ls_weight),
+                                                    prior_func=prior_func,
                                                     name="ensemble_weight",
                                                     **kwargs)
 
     # specify ensemble prediction
-    base_models = np.asarray([base_pred[name] for name in model_names]).T
+    base_models = tf.stack([tf.cast(base_pred[name], dtype=tf.float32)
+                            for name in model_names], axis=-1)
     FW = tf.multiply(base_models, ensemble_weights)
     ensemble_mean = tf.reduce_sum(FW, axis=1, name="ensemble_mean")
 
     # specify residual process
-    ensemble_resid = gp.prior(X,
-                              ls=tf.exp(log_ls_resid),
-                              kernel_func=gp.rbf,
-                              name="ensemble_resid")
+    resid_kwargs = dict()
+    if (prior_func in (gp.prior, gp.prior_whitened) and
+            resid_scale_tril is not None):
+        resid_kwargs["scale_tril"] = resid_scale_tril
+
+    ensemble_resid = prior_func(X,
+                                ls=tf.exp(log_ls_resid),
+                                kernel_func=gp.rbf,
+                                name="ensemble_resid",
+                                **resid_kwargs)
 
     # specify observation
     y = ed.MultivariateNormalDiag(loc=ensemble_mean + ensemble_resid,
@@ -232,6 +256,281 @@ def model_tailfree(X, base_pred, family_tree=None,
     return y
 
 
+def make_log_joint_fn_tailfree_fixed_ls(X, base_pred, family_tree, y,
+                                        log_ls_weight, log_ls_resid,
+                                        weight_scale_tril=None,
+                                        resid_scale_tril=None,
+                                        whiten=False, ridge_factor=1e-3):
+    """Makes log joint density of model_tailfree for fixed length-scales.
+
+    Specialized alternative to ed.make_log_joint_fn(model_tailfree) when both
+    length-scales are fixed. The kernel Cholesky factors and log determinants
+    are computed once, and all node weight GPs are evaluated in a single
+    triangular solve, so each evaluation only costs the triangular solves and
+    the tail-free weight computation (and no model re-tracing).
+
+    Args:
+        X: (np.ndarray) Input features of dimension (N, D)
+        base_pred: (dict of np.ndarray) A dictionary of out-of-sample prediction
+            from base models, each with dimension (N, ).
+        family_tree: (dict of list or None) A dictionary of list of strings to
+            specify the family tree between models, if None then assume there's
+            no structure (i.e. flat).
+        y: (np.ndarray) Observed labels of dimension (N, ).
+        log_ls_weight: (float32) length-scale parameter for weight GP.
+        log_ls_resid: (float32) length-scale parameter for residual GP.
+        weight_scale_tril: (tf.Tensor of float32 or None) Pre-computed
+            Cholesky factor of the weight GP kernel matrix, see
+            gp.prior_scale_tril. If None then compute from log_ls_weight.
+        resid_scale_tril: (tf.Tensor of float32 or None) Pre-computed
+            Cholesky factor of the residual GP kernel matrix.
+            If None then compute from log_ls_resid.
+        whiten: (bool) Whether GP latents are whitened as in
+            gp.prior_whitened, i.e. model_tailfree with
+            prior_func=gp.prior_whitened.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+
+    Returns:
+        (function) Log joint density with args (sigma, ensemble_resid,
+            temp_dict, base_weight_dict), where temp_dict and
+            base_weight_dict are dictionaries of tf.Tensor keyed by
+            parent node names and non-root node names.
+
+    Raises:
+        ValueError: If a scale_tril is not given under the "iterative" linear
+            algebra backend, see gp.prior_scale_tril.
+    """
+    if not family_tree:
+        family_tree = {tail_free.ROOT_NODE_DEFAULT_NAME: list(base_pred.keys())}
+
+    if weight_scale_tril is None:
+        weight_scale_tril = gp.prior_scale_tril(
+            X, ls=np.exp(log_ls_weight).astype(np.float32),
+            kernel_func=gp.rbf, ridge_factor=ridge_factor)
+    if resid_scale_tril is None:
+        resid_scale_tril = gp.prior_scale_tril(
+            X, ls=np.exp(log_ls_resid).astype(np.float32),
+            kernel_func=gp.rbf, ridge_factor=ridge_factor)
+
+    N = int(X.shape[0])
+    weight_log_det = tf.reduce_sum(tf.log(tf.matrix_diag_part(weight_scale_tril)))
+    resid_log_det = tf.reduce_sum(tf.log(tf.matrix_diag_part(resid_scale_tril)))
+    y = tf.cast(y, dtype=tf.float32)
+
+    def _gp_log_prob_and_value(latents, scale_tril, log_det):
+        """Computes GP log density and values f for latents of shape (N, M)."""
+        num_gp = int(latents.shape[-1])
+        const = -0.5 * N * num_gp * np.log(2. * np.pi)
+
+        if whiten:
+            f = tf.matmul(scale_tril, latents)
+            return const - 0.5 * tf.reduce_sum(tf.square(latents)), f
+
+        latents_white = tf.matrix_triangular_solve(scale_tril, latents,
+                                                   lower=True)
+        return (const - num_gp * log_det -
+                0.5 * tf.reduce_sum(tf.square(latents_white)), latents)
+
+    def log_joint(sigma, ensemble_resid, temp_dict, base_weight_dict):
+        """Unnormalized log joint density of model_tailfree."""
+        node_names = list(base_weight_dict.keys())
+
+        # GP priors, all node weights share one triangular solve
+        weight_log_prob, weight_val = _gp_log_prob_and_value(
+            tf.stack([base_weight_dict[name] for name in node_names], axis=-1),
+            weight_scale_tril, weight_log_det)
+        resid_log_prob, resid_val = _gp_log_prob_and_value(
+            tf.expand_dims(ensemble_resid, -1),
+            resid_scale_tril, resid_log_det)
+
+        return (weight_log_prob + resid_log_prob +
+                _log_prob_tailfree_given_gp(
+                    X, base_pred, family_tree, y, sigma,
+                    ensemble_resid=tf.squeeze(resid_val, -1),
+                    temp_dict=temp_dict,
+                    base_weight_dict=dict(zip(
+                        node_names, tf.unstack(weight_val, axis=-1)))))
+
+    return log_joint
+
+
+def make_log_joint_fn_tailfree_ls_grid(X, base_pred, family_tree, y,
+                                       log_ls_grid, ridge_factor=1e-3):
+    """Makes log joint density of model_tailfree with ls prior on a grid.
+
+    Replaces the normal priors of log_ls_weight and log_ls_resid by their
+    discretization on log_ls_grid, and marginalizes both length-scales
+    over the grid, i.e. the GP priors become
+
+        p(f_1, ..., f_K) = sum_g p(ls_g) prod_k N(f_k | 0, K(ls_g)).
+
+    The Cholesky factors for all G grid values are precomputed once by
+    gp.prior_scale_tril_bank, so each evaluation only costs G triangular
+    solves per GP instead of an O(N^3) factorization.
+
+    Args:
+        X: (np.ndarray) Input features of dimension (N, D)
+        base_pred: (dict of np.ndarray) A dictionary of out-of-sample prediction
+            from base models, each with dimension (N, ).
+        family_tree: (dict of list or None) A dictionary of list of strings to
+            specify the family tree between models, if None then assume there's
+            no structure (i.e. flat).
+        y: (np.ndarray) Observed labels of dimension (N, ).
+        log_ls_grid: (np.ndarray of float32) Grid of log length-scale values,
+            shape (G, ), shared by the weight and residual GPs.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+
+    Returns:
+        log_joint: (function) Log joint density with args (sigma,
+            ensemble_resid, temp_dict, base_weight_dict), see
+            make_log_joint_fn_tailfree_fixed_ls.
+        ls_logits: (function) Posterior logits of the grid index given the
+            GP values, with args (ensemble_resid, base_weight_dict) and
+            returning (weight_logits, resid_logits), each of shape (G, ).
+
+    Raises:
+        ValueError: Under the "iterative" linear algebra backend, see
+            gp.prior_scale_tril_bank.
+    """
+    if not family_tree:
+        family_tree = {tail_free.ROOT_NODE_DEFAULT_NAME: list(base_pred.keys())}
+
+    log_ls_grid = np.asarray(log_ls_grid, dtype=np.float32)
+    scale_tril_bank = gp.prior_scale_tril_bank(
+        X, ls_grid=np.exp(log_ls_grid), kernel_func=gp.rbf,
+        ridge_factor=ridge_factor)
+    log_det_bank = tf.reduce_sum(
+        tf.log(tf.matrix_diag_part(scale_tril_bank)), axis=-1)
+
+    # discretized prior for log length-scale
+    log_ls_prior_probs = tf.nn.log_softmax(
+        tfd.Normal(loc=_LS_PRIOR_MEAN,
+                   scale=_LS_PRIOR_SDEV).log_prob(log_ls_grid))
+
+    N = int(X.shape[0])
+    num_grid = len(log_ls_grid)
+    y = tf.cast(y, dtype=tf.float32)
+
+    def _gp_grid_logits(latents):
+        """Computes log p(ls_g) + log N(f | 0, K_g) for f of shape (N, M)."""
+        num_gp = int(latents.shape[-1])
+        latents_white = tf.matrix_triangular_solve(
+            scale_tril_bank, tf.tile(latents[tf.newaxis], [num_grid, 1, 1]),
+            lower=True)
+        return (log_ls_prior_probs - 0.5 * N * num_gp * np.log(2. * np.pi) -
+                num_gp * log_det_bank -
+                0.5 * tf.reduce_sum(tf.square(latents_white), axis=[1, 2]))
+
+    def ls_logits(ensemble_resid, base_weight_dict):
+        """Posterior logits of weight and residual grid index."""
+        weight_val = tf.stack(list(base_weight_dict.values()), axis=-1)
+        return (_gp_grid_logits(weight_val),
+                _gp_grid_logits(tf.expand_dims(ensemble_resid, -1)))
+
+    def log_joint(sigma, ensemble_resid, temp_dict, base_weight_dict):
+        """Unnormalized log joint density with ls marginalized over grid."""
+        weight_logits, resid_logits = ls_logits(ensemble_resid,
+                                                base_weight_dict)
+
+        return (tf.reduce_logsumexp(weight_logits) +
+                tf.reduce_logsumexp(resid_logits) +
+                _log_prob_tailfree_given_gp(
+                    X, base_pred, family_tree, y, sigma,
+                    ensemble_resid=ensemble_resid,
+                    temp_dict=temp_dict,
+                    base_weight_dict=base_weight_dict))
+
+    return log_joint, ls_logits
+
+
+def make_log_likelihood_fn_tailfree(X, base_pred, family_tree, y):
+    """Makes log likelihood of y in model_tailfree given the GP values.
+
+    Unlike the log joint, no GP prior is evaluated, hence no kernel matrix
+    is factorized. This is the likelihood required by elliptical slice
+    sampling of the GP latents.
+
+    Args:
+        X: (np.ndarray) Input features of dimension (N, D)
+        base_pred: (dict of np.ndarray) A dictionary of out-of-sample prediction
+            from base models, each with dimension (N, ).
+        family_tree: (dict of list or None) A dictionary of list of strings to
+            specify the family tree between models, if None then assume there's
+            no structure (i.e. flat).
+        y: (np.ndarray) Observed labels of dimension (N, ).
+
+    Returns:
+        (function) Log likelihood log p(y | f, sigma) with args (sigma,
+            ensemble_resid, temp_dict, base_weight_dict), see
+            make_log_joint_fn_tailfree_fixed_ls.
+    """
+    if not family_tree:
+        family_tree = {tail_free.ROOT_NODE_DEFAULT_NAME: list(base_pred.keys())}
+
+    y = tf.cast(y, dtype=tf.float32)
+
+    def log_likelihood(sigma, ensemble_resid, temp_dict, base_weight_dict):
+        """Log likelihood of y given the GP values."""
+        ensemble_mean = _ensemble_mean_tailfree(X, base_pred, family_tree,
+                                                temp_dict, base_weight_dict)
+        return tf.reduce_sum(
+            tfd.Normal(loc=ensemble_mean + ensemble_resid,
+                       scale=tf.exp(sigma)).log_prob(y))
+
+    return log_likelihood
+
+
+def _ensemble_mean_tailfree(X, base_pred, family_tree,
+                            temp_dict, base_weight_dict):
+    """Computes ensemble mean given the weight GP values and temperatures."""
+    node_weight_dict = tail_free.compute_cond_weights(
+        X, family_tree,
+        raw_weights_dict=base_weight_dict,
+        parent_temp_dict=temp_dict)
+    ensemble_weights, model_names = tail_free.compute_leaf_weights(
+        node_weight_dict, family_tree, name="ensemble_weight")
+
+    base_models = tf.stack([tf.cast(base_pred[name], dtype=tf.float32)
+                            for name in model_names], axis=-1)
+    return tf.reduce_sum(base_models * ensemble_weights, axis=-1)
+
+
+def _log_prob_tailfree_given_gp(X, base_pred, family_tree, y, sigma,
+                                ensemble_resid, temp_dict, base_weight_dict):
+    """Computes log density of y, sigma and temp given the GP values.
+
+    Args:
+        X: (np.ndarray) Input features of dimension (N, D)
+        base_pred: (dict of np.ndarray) Base model predictions.
+        family_tree: (dict of list) Family tree between models.
+        y: (tf.Tensor of float32) Observed labels of dimension (N, ).
+        sigma: (tf.Tensor of float32) Log observation noise.
+        ensemble_resid: (tf.Tensor of float32) Residual GP values, (N, ).
+        temp_dict: (dict of tf.Tensor) Temperature for each parent node.
+        base_weight_dict: (dict of tf.Tensor) Weight GP values for each
+            non-root node, each of dimension (N, ).
+
+    Returns:
+        (tf.Tensor of float32) Scalar log density.
+    """
+    # tail-free ensemble weights
+    ensemble_mean = _ensemble_mean_tailfree(X, base_pred, family_tree,
+                                            temp_dict, base_weight_dict)
+
+    # observation and scalar priors
+    y_log_prob = tf.reduce_sum(
+        tfd.Normal(loc=ensemble_mean + ensemble_resid,
+                   scale=tf.exp(sigma)).log_prob(y))
+    sigma_log_prob = tfd.Normal(loc=_NOISE_PRIOR_MEAN,
+                                scale=_NOISE_PRIOR_SDEV).log_prob(sigma)
+    temp_log_prob = tf.add_n([
+        tfd.Normal(loc=tail_free._TEMP_PRIOR_MEAN,
+                   scale=tail_free._TEMP_PRIOR_SDEV).log_prob(temp)
+        for temp in temp_dict.values()])
+
+    return y_log_prob + sigma_log_prob + temp_log_prob
+
+
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 """ Sampling functions for intermediate random variables """
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -15,29 +15,249 @@
 [4]:    Carl Rasmussen and Christopher Williams. Gaussian Processes for Machine Learning.
         _The MIT Press. ISBN 0-262-18253-X_. 2006
 """
+import functools
+import collections
+
 import numpy as np
+import scipy.linalg as linalg
+import scipy.sparse as sparse
+import scipy.spatial as spatial
 
 import tensorflow as tf
 import tensorflow_probability as tfp
 from tensorflow_probability import edward2 as ed
 
+from tensorflow.python.framework import tensor_util
 from tensorflow.python.ops.distributions.util import fill_triangular
 
+import calibre.util.misc as misc_util
+import calibre.util.matrix as matrix_util
 import calibre.util.distribution as dist_util
 import calibre.util.inference as inference_util
 
 tfd = tfp.distributions
 
+# name of the tf.Graph attribute holding the cache of lengthscale-free pairwise
+# geometry, see pairwise_square_dist. The cache lives on the graph so that it
+# is released together with the graph.
+_GEOMETRY_CACHE_ATTR = "_calibre_geometry_cache"
+
+# cache of Cholesky factors of training kernel matrix, see sample_posterior_full.
+_PRIOR_CHOL_CACHE = collections.OrderedDict()
+_PRIOR_CHOL_CACHE_SIZE = 4
+
+# default number of random Fourier features, see prior_rff.
+_RFF_NUM_FEATURES_DEFAULT = 500
+_RFF_SEED_DEFAULT = 0
+
+# default number of kernel matrix rows evaluated at once, see kernel_matmul.
+_KERNEL_MATMUL_BLOCK_SIZE_DEFAULT = 1024
+
+# default total number of grid points for structured kernel interpolation,
+# and float64 jitter for the per-dimension grid Cholesky factors. The jitter
+# is kept separate from ridge_factor, which is the variance added to the
+# interpolated covariance in prior_ski.
+_SKI_NUM_GRID_DEFAULT = 1024
+_SKI_GRID_JITTER = 1e-4
+
+# default neighbor set size for Vecchia approximation, and cache of
+# orderings and neighbor sets, see vecchia_neighbors.
+_VECCHIA_NUM_NEIGHBOR_DEFAULT = 15
+_VECCHIA_NEIGHBOR_CACHE = collections.OrderedDict()
+_VECCHIA_NEIGHBOR_CACHE_SIZE = 4
+
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 """ Kernel function """
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 
 
+def _get_geometry_cache(graph):
+    """Returns the geometry cache stored on graph, creating it if needed.
+
+    The cache is a dict with entries "geometry", mapping cache keys to
+    geometry tensors, and "content_key", mapping feature objects to their
+    content keys (see _geometry_key).
+    """
+    cache = getattr(graph, _GEOMETRY_CACHE_ATTR, None)
+    if cache is None:
+        cache = dict(geometry=dict(), content_key=dict())
+        setattr(graph, _GEOMETRY_CACHE_ATTR, cache)
+    return cache
+
+
+def _geometry_key(X, cache):
+    """Returns a hashable key for features X, and its constant value if any.
+
+    Constant features (np.ndarray, or tf.Tensor that is a graph constant) are
+    keyed by content, so that repeated tf.convert_to_tensor calls on the same
+    data hit the same cache entry. The content key is computed once per
+    feature object and memoized in cache, hence np.ndarray features are
+    assumed not to be modified in place while the graph is alive. Other
+    tensors are keyed by identity and by the control flow context in which
+    they are used.
+    """
+    if X is None:
+        return None, None
+
+    if isinstance(X, tf.Tensor):
+        object_key = X
+    elif isinstance(X, np.ndarray):
+        object_key = id(X)
+    else:
+        object_key = None
+
+    if object_key is not None and object_key in cache["content_key"]:
+        _, X_key, X_val = cache["content_key"][object_key]
+        return X_key, X_val
+
+    if isinstance(X, tf.Tensor):
+        X_val = tensor_util.constant_value(X)
+    else:
+        X_val = np.asarray(X)
+
+    if X_val is not None:
+        X_val = X_val.astype(np.float32)
+        X_key = misc_util.make_hash_key(X_val)
+    else:
+        X_key = None
+
+    if object_key is not None:
+        # keeps a reference to X so that its id is not reused.
+        cache["content_key"][object_key] = (X, X_key, X_val)
+
+    if X_key is None:
+        ctxt = tf.get_default_graph()._get_control_flow_context()
+        return (X, ctxt), None
+
+    return X_key, X_val
+
+
+def _pairwise_geometry(geom_type, geom_func, X, X2=None):
+    """Looks up (or builds) a cached lengthscale-free geometry tensor.
+
+    For constant features the geometry is built outside of any control flow
+    context (e.g. the tf.while_loop of an MCMC chain), so it is evaluated
+    once per session run and shared by every kernel that uses it.
+
+    Args:
+        geom_type: (str) Name of the geometry quantity, part of the cache key.
+        geom_func: (function) Function with args (X, X2) computing the quantity.
+        X: (tf.Tensor or np.ndarray) First set of features of dim N x D.
+        X2: (tf.Tensor or np.ndarray or None) Second set of features of dim N2 x D.
+
+    Returns:
+        (tf.Tensor) Cached geometry tensor.
+    """
+    cache = _get_geometry_cache(tf.get_default_graph())
+    graph_cache = cache["geometry"]
+
+    X_key, X_val = _geometry_key(X, cache)
+    X2_key, X2_val = _geometry_key(X2, cache)
+
+    cache_key = (geom_type, X_key, X2_key)
+
+    if cache_key not in graph_cache:
+        is_constant = X_val is not None and (X2 is None or X2_val is not None)
+        if is_constant:
+            with tf.control_dependencies(None):
+                X_const = tf.constant(X_val, dtype=tf.float32)
+                X2_const = (None if X2 is None else
+                            tf.constant(X2_val, dtype=tf.float32))
+                graph_cache[cache_key] = geom_func(X_const, X2_const)
+        else:
+            graph_cache[cache_key] = geom_func(
+                tf.convert_to_tensor(X, dtype=tf.float32),
+                None if X2 is None else tf.convert_to_tensor(X2, dtype=tf.float32))
+
+    return graph_cache[cache_key]
+
+
+def _square_dist_unscaled(X, X2=None):
+    """Computes ||x-x'||^2 between two sets of features, see square_dist."""
+    Xs = tf.reduce_sum(tf.square(X), axis=1)
+
+    if X2 is None:
+        dist = -2 * tf.matmul(X, X, transpose_b=True)
+        dist += tf.reshape(Xs, (-1, 1)) + tf.reshape(Xs, (1, -1))
+        return tf.clip_by_value(dist, 0., np.inf)
+
+    X2s = tf.reduce_sum(tf.square(X2), axis=1)
+    dist = -2 * tf.matmul(X, X2, transpose_b=True)
+    dist += tf.reshape(Xs, (-1, 1)) + tf.reshape(X2s, (1, -1))
+    return tf.clip_by_value(dist, 0., np.inf)
+
+
+def _pair_diff_unscaled(X, X2=None):
+    """Computes x - x' between two sets of features, see pairwise_diff."""
+    if X2 is None:
+        X2 = X
+    return tf.expand_dims(X, 1) - tf.expand_dims(X2, 0)
+
+
+def pairwise_square_dist(X, X2=None):
+    """Computes (cached) square distance ||x-x'||^2 without length scale.
+
+    The result is cached per graph and keyed by the content of X and X2, such
+    that all kernels and length scales on the same input set share one N x N2
+    distance matrix.
+
+    Args:
+        X: (tf.Tensor or np.ndarray) First set of features of dim N x D.
+        X2: (tf.Tensor or np.ndarray or None) Second set of features of dim N2 x D.
+
+    Returns:
+        (tf.Tensor) A N x N2 tensor for ||x-x'||^2
+
+    Raises:
+        (ValueError) If feature dimension of X and X2 disagrees.
+    """
+    _check_feature_dim(X, X2)
+    return _pairwise_geometry("square_dist", _square_dist_unscaled, X, X2)
+
+
+def pairwise_diff(X, X2=None):
+    """Computes (cached) pairwise difference x - x' without length scale.
+
+    Args:
+        X: (tf.Tensor or np.ndarray) First set of features of dim N x D.
+        X2: (tf.Tensor or np.ndarray or None) Second set of features of dim N2 x D.
+
+    Returns:
+        (tf.Tensor) A N x N2 x D tensor for x - x'
+
+    Raises:
+        (ValueError) If feature dimension of X and X2 disagrees.
+    """
+    _check_feature_dim(X, X2)
+    return _pairwise_geometry("pair_diff", _pair_diff_unscaled, X, X2)
+
+
+def _check_feature_dim(X, X2=None):
+    """Raises ValueError if feature dimension of X and X2 disagrees."""
+    if X2 is None:
+        return
+
+    D = X.shape[1]
+    D2 = X2.shape[1]
+    if D != D2:
+        raise ValueError('Dimension of X and X2 does not match.')
+
+
+def _is_scalar(ls):
+    """Checks whether length scale is a scalar (i.e. not ARD)."""
+    if isinstance(ls, (tf.Tensor, tf.Variable)):
+        return ls.shape.ndims == 0
+    return np.ndim(ls) == 0
+
+
 def square_dist(X, X2=None, ls=1.):
     """Computes Square distance between two sets of features.
 
     Referenced from GPflow.kernels.Stationary.
 
+    For scalar length scale, the lengthscale-free distance ||x-x'||^2 is taken
+    from the geometry cache (see pairwise_square_dist) and rescaled.
+
     Args:
         X: (tf.Tensor) First set of features of dim N x D.
         X2: (tf.Tensor or None) Second set of features of dim N2 x D.
@@ -49,7 +269,10 @@ def square_dist(X, X2=None, ls=1.):
     Raises:
         (ValueError) If feature dimension of X and X2 disagrees.
     """
-    N, D = X.shape
+    if _is_scalar(ls):
+        return pairwise_square_dist(X, X2) / ls ** 2
+
+    _check_feature_dim(X, X2)
 
     X = X / ls
     Xs = tf.reduce_sum(tf.square(X), axis=1)
@@ -59,10 +282,6 @@ def square_dist(X, X2=None, ls=1.):
         dist += tf.reshape(Xs, (-1, 1)) + tf.reshape(Xs, (1, -1))
         return tf.clip_by_value(dist, 0., np.inf)
 
-    N2, D2 = X2.shape
-    if D != D2:
-        raise ValueError('Dimension of X and X2 does not match.')
-
     X2 = X2 / ls
     X2s = tf.reduce_sum(tf.square(X2), axis=1)
     dist = -2 * tf.matmul(X, X2, transpose_b=True)
@@ -93,13 +312,136 @@ def rbf(X, X2=None, ls=1., ridge_factor=0.):
     return tf.exp(-square_dist(X, X2, ls=ls) / 2) + ridge_mat
 
 
+def kernel_matmul(X, V, ls, kernel_func=rbf, ridge_factor=0.,
+                  block_size=_KERNEL_MATMUL_BLOCK_SIZE_DEFAULT):
+    """Multiplies kernel matrix (K(X, X) + ridge * I) with V, matrix-free.
+
+    Rows of K(X, X) are evaluated on the fly in blocks of block_size inside
+    a tf.map_fn, such that memory is O(block_size * N) rather than O(N^2),
+    at the cost of re-evaluating the kernel in every product.
+
+    Args:
+        X: (np.ndarray or tf.Tensor of float32) input features of dimension (N, D).
+        V: (tf.Tensor of float32) matrix of dimension (N, M).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) kernel function.
+        ridge_factor: (float32) ridge factor added to the diagonal.
+        block_size: (int) number of kernel matrix rows evaluated at once.
+
+    Returns:
+        (tf.Tensor of float32) Matrix product of dimension (N, M).
+    """
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    N, D = X.shape.as_list()
+
+    num_block = int(np.ceil(N / block_size))
+    X_block = tf.reshape(
+        tf.pad(X, [[0, num_block * block_size - N], [0, 0]]),
+        [num_block, block_size, D])
+
+    KV = tf.map_fn(lambda X_row: tf.matmul(kernel_func(X_row, X, ls=ls), V),
+                   X_block)
+    KV = tf.reshape(KV, [num_block * block_size, -1])[:N]
+
+    return KV + ridge_factor * V
+
+
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 """ Gaussian Process Prior """
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 
 
+def _check_dense_backend(func_name):
+    """Raises ValueError if the linear algebra backend is not "dense"."""
+    if matrix_util.get_linalg_backend() != matrix_util.LINALG_BACKEND_DENSE:
+        raise ValueError(
+            "{} requires the Cholesky factor of the kernel matrix, which is "
+            "not available under the '{}' linear algebra backend "
+            "(see matrix_util.set_linalg_backend).".format(
+                func_name, matrix_util.get_linalg_backend()))
+
+
+def uses_scale_tril(prior_func):
+    """Checks whether prior_func should be given a shared scale_tril.
+
+    This is the case for prior_whitened, and for prior under the "dense"
+    linear algebra backend. Under the "iterative" backend, prior evaluates
+    its log density without a Cholesky factor.
+
+    Args:
+        prior_func: (function) GP prior function, e.g. prior or prior_whitened.
+
+    Returns:
+        (bool) Whether to pass a pre-computed prior_scale_tril to prior_func.
+    """
+    if prior_func is prior_whitened:
+        return True
+    return (prior_func is prior and
+            matrix_util.get_linalg_backend() == matrix_util.LINALG_BACKEND_DENSE)
+
+
+def prior_scale_tril(X, ls, kernel_func=rbf, ridge_factor=1e-3):
+    """Computes Cholesky factor of the Gaussian Process prior covariance.
+
+    The factor only depends on (X, ls, kernel_func, ridge_factor), therefore
+    it can be computed once and shared between GPs with identical kernel
+    (e.g. sibling weight GPs in the tail-free process) through the
+    `scale_tril` argument of prior().
+
+    Args:
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) kernel function for the gaussian process.
+            Default to rbf.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+
+    Returns:
+        (tf.Tensor of float32) Lower-triangular Cholesky factor, shape (N, N).
+
+    Raises:
+        (ValueError) Under the "iterative" linear algebra backend, which does
+            not factorize the kernel matrix.
+    """
+    _check_dense_backend("prior_scale_tril")
+
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    K_mat = kernel_func(X, ls=ls, ridge_factor=ridge_factor)
+    return tf.cholesky(K_mat)
+
+
+def prior_scale_tril_bank(X, ls_grid, kernel_func=rbf, ridge_factor=1e-3):
+    """Computes Cholesky factors of the GP prior covariance over a ls grid.
+
+    All G kernel matrices are factorized in one batched tf.cholesky, which
+    distributes the batch over the intra-op thread pool (i.e. across cores).
+
+    Args:
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        ls_grid: (np.ndarray of float32) grid of length scale values, shape (G,).
+        kernel_func: (function) kernel function for the gaussian process.
+            Default to rbf.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+
+    Returns:
+        (tf.Tensor of float32) Lower-triangular Cholesky factors, shape (G, N, N).
+
+    Raises:
+        (ValueError) Under the "iterative" linear algebra backend.
+    """
+    _check_dense_backend("prior_scale_tril_bank")
+
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    ls_grid = tf.convert_to_tensor(ls_grid, dtype=tf.float32)
+
+    K_bank = tf.map_fn(
+        lambda ls: kernel_func(X, ls=ls, ridge_factor=ridge_factor), ls_grid)
+    return tf.cholesky(K_bank)
+
+
 def prior(X, ls, kernel_func=rbf,
-          ridge_factor=1e-3, name=None):
+          ridge_factor=1e-3, scale_tril=None, name=None):
     """Defines Gaussian Process prior with kernel_func.
 
     Args:
@@ -109,6 +451,12 @@ def prior(X, ls, kernel_func=rbf,
             Default to rbf.
         ls: (float32) length scale parameter.
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        scale_tril: (tf.Tensor of float32 or None) Pre-computed Cholesky factor
+            of the kernel matrix, see prior_scale_tril. If None then compute
+            from kernel_func, or under the "iterative" linear algebra backend
+            (see matrix_util.set_linalg_backend) evaluate the log density
+            through matrix-free kernel matrix products (see kernel_matmul),
+            without materializing the N x N kernel matrix.
         name: (str) name of the random variable
 
     Returns:
@@ -119,13 +467,170 @@ def prior(X, ls, kernel_func=rbf,
     X = tf.convert_to_tensor(X, dtype=tf.float32)
     N, _ = X.shape.as_list()
 
-    K_mat = kernel_func(X, ls=ls, ridge_factor=ridge_factor)
+    if (scale_tril is None and
+            matrix_util.get_linalg_backend() == matrix_util.LINALG_BACKEND_ITERATIVE):
+        return dist_util.MultivariateNormalIterative(
+            loc=tf.zeros(N, dtype=tf.float32),
+            cov_matmul_fn=functools.partial(kernel_matmul, X, ls=ls,
+                                            kernel_func=kernel_func,
+                                            ridge_factor=ridge_factor),
+            precond_diag=kernel_diag(X, ls=ls,
+                                     kernel_func=kernel_func) + ridge_factor,
+            name=name)
+
+    if scale_tril is None:
+        scale_tril = prior_scale_tril(X, ls=ls, kernel_func=kernel_func,
+                                      ridge_factor=ridge_factor)
 
     return ed.MultivariateNormalTriL(loc=tf.zeros(N, dtype=tf.float32),
-                                     scale_tril=tf.cholesky(K_mat),
+                                     scale_tril=scale_tril,
                                      name=name)
 
 
+def prior_whitened(X, ls, kernel_func=rbf,
+                   ridge_factor=1e-3, scale_tril=None, name=None):
+    """Defines Gaussian Process prior in non-centered (whitened) form.
+
+    The process is written as f = L z with z ~ N(0, I), where L is the
+    Cholesky factor of the kernel matrix. The random variable `name` is
+    the whitened z, so that inference samples z rather than f, which removes
+    the funnel-shaped dependence between f and ls. Use unwhiten to map
+    the samples of z back to f.
+
+    Args:
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) kernel function for the gaussian process.
+            Default to rbf.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        scale_tril: (tf.Tensor of float32 or None) Pre-computed Cholesky factor
+            of the kernel matrix, see prior_scale_tril.
+        name: (str) name of the whitened random variable
+
+    Returns:
+        (tf.Tensor) The Gaussian Process values f = L z, dimension (N,)
+    """
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    N, _ = X.shape.as_list()
+
+    z = ed.MultivariateNormalDiag(loc=tf.zeros(N, dtype=tf.float32),
+                                  name=name)
+
+    return unwhiten(z, X, ls=ls, kernel_func=kernel_func,
+                    ridge_factor=ridge_factor, scale_tril=scale_tril)
+
+
+def unwhiten(z, X, ls, kernel_func=rbf, ridge_factor=1e-3, scale_tril=None):
+    """Maps whitened GP latent z to Gaussian Process values f = L z.
+
+    Args:
+        z: (tf.Tensor of float32) whitened latent with dimension (..., N).
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) kernel function for the gaussian process.
+            Default to rbf.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        scale_tril: (tf.Tensor of float32 or None) Pre-computed Cholesky factor
+            of the kernel matrix. If None then compute from kernel_func.
+
+    Returns:
+        (tf.Tensor of float32) Gaussian Process values, dimension (..., N)
+
+    Raises:
+        (ValueError) If scale_tril is None under the "iterative" linear
+            algebra backend, see prior_scale_tril.
+    """
+    if scale_tril is None:
+        scale_tril = prior_scale_tril(X, ls=ls, kernel_func=kernel_func,
+                                      ridge_factor=ridge_factor)
+
+    return tf.tensordot(tf.convert_to_tensor(z), scale_tril,
+                        axes=[[-1], [-1]])
+
+
+def random_fourier_features(X, ls, n_features=_RFF_NUM_FEATURES_DEFAULT,
+                            seed=_RFF_SEED_DEFAULT):
+    """Computes random Fourier features for the RBF kernel.
+
+    Defines feature map phi(x) = sqrt(2/K) * cos(W^T x / ls + b),
+        where W ~ N(0, I) and b ~ Unif(0, 2pi), such that
+        phi(x)^T phi(x') approximates rbf(x, x', ls).
+
+    The frequencies W and phases b are drawn with a fixed seed, therefore
+    repeated calls (e.g. each evaluation of the log joint) share the same
+    feature basis.
+
+    Args:
+        X: (np.ndarray or tf.Tensor of float32) input features of dimension (N, D).
+        ls: (float32) length scale parameter, scalar or of dimension (D, ).
+        n_features: (int) number of Fourier features K.
+        seed: (int) random seed for the frequencies and phases.
+
+    Returns:
+        (tf.Tensor of float32) Feature matrix of dimension (N, K).
+    """
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    _, D = X.shape.as_list()
+
+    rng = np.random.RandomState(seed)
+    freq = rng.normal(size=(D, n_features)).astype(np.float32)
+    phase = rng.uniform(0., 2 * np.pi, size=n_features).astype(np.float32)
+
+    feature = tf.cos(tf.matmul(X / ls, freq) + phase)
+    return np.sqrt(2. / n_features).astype(np.float32) * feature
+
+
+def prior_rff(X, ls, kernel_func=rbf, ridge_factor=1e-3,
+              n_features=_RFF_NUM_FEATURES_DEFAULT,
+              seed=_RFF_SEED_DEFAULT, name=None):
+    """Defines Gaussian Process prior using random Fourier features.
+
+    Approximates the RBF Gaussian process prior with f(x) = phi(x)^T w,
+        w ~ N(0, I), such that
+
+        f ~ MVN(0, Phi Phi^T + ridge_factor * I).
+
+    The random variable is still defined on the N function values (i.e. it
+    is a drop-in replacement for prior), but its log density and sampling
+    cost O(N K^2) instead of O(N^3). Use sample_posterior_rff for
+    posterior prediction on the same features.
+
+    Args:
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) kernel function to approximate. Only rbf
+            is supported.
+        ridge_factor: (float32) ridge factor (diagonal variance) added to the
+            low-rank covariance.
+        n_features: (int) number of Fourier features K.
+        seed: (int) random seed for the Fourier features.
+        name: (str) name of the random variable
+
+    Returns:
+        (ed.RandomVariable) A random variable representing the Gaussian Process,
+            dimension (N,)
+
+    Raises:
+        (ValueError) If kernel_func is not rbf.
+    """
+    if kernel_func is not rbf:
+        raise ValueError("Random Fourier feature prior only supports rbf kernel.")
+
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    N, _ = X.shape.as_list()
+
+    feature = random_fourier_features(X, ls=ls, n_features=n_features, seed=seed)
+
+    return dist_util.MultivariateNormalLowRankPlusDiag(
+        loc=tf.zeros(N, dtype=tf.float32),
+        cov_diag=ridge_factor * tf.ones(N, dtype=tf.float32),
+        cov_factor=feature,
+        name=name)
+
+
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 """ Predictive Sampling functions """
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -155,10 +660,45 @@ def sample_posterior_mean(X_new, X, f_sample, ls, kernel_func=rbf, ridge_factor=
     Kx = kernel_func(X, X_new, ls=ls)
     K = kernel_func(X, ls=ls, ridge_factor=ridge_factor)
     # add ridge factor to stabilize inversion.
-    K_inv_f = tf.matrix_solve(K, f_sample)
+    K_inv_f = matrix_util.psd_solve(K, f_sample)
     return tf.matmul(Kx, K_inv_f, transpose_a=True)
 
 
+def _get_prior_chol(X, ls, kernel_func, ridge_factor, K=None):
+    """Looks up cached Cholesky factor of K(X, X), or computes it from K.
+
+    Args:
+        X: (np.ndarray of float32) training locations, N x D
+        ls: (float) training lengthscale
+        kernel_func: (function) kernel function for distance among X.
+        ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition.
+        K: (np.ndarray or None) Value of kernel matrix K(X, X). If None then
+            only look up the cache.
+
+    Returns:
+        (np.ndarray of float64 or None) Cholesky factor of K(X, X), or None
+            if not cached and K is not provided.
+    """
+    chol_key = misc_util.make_hash_key(
+        X, np.asarray(ls, dtype=np.float32),
+        np.asarray(ridge_factor, dtype=np.float32)) + (kernel_func,)
+
+    if chol_key in _PRIOR_CHOL_CACHE:
+        _PRIOR_CHOL_CACHE.move_to_end(chol_key)
+        return _PRIOR_CHOL_CACHE[chol_key]
+
+    if K is None:
+        return None
+
+    K_chol = matrix_util.cholesky_jitter(K)
+
+    _PRIOR_CHOL_CACHE[chol_key] = K_chol
+    while len(_PRIOR_CHOL_CACHE) > _PRIOR_CHOL_CACHE_SIZE:
+        _PRIOR_CHOL_CACHE.popitem(last=False)
+
+    return K_chol
+
+
 def sample_posterior_full(X_new, X, f_sample, ls,
                           kernel_func=rbf,
                           kernel_func_xn=None,
@@ -172,6 +712,11 @@ def sample_posterior_full(X_new, X, f_sample, ls,
         E(f*|f) = K(X*, X)K(X, X)^{-1}f
         Var(f*|f) = K(X*, X*) - K(X*, X)K(X, X)^{-1}K(X, X*)
 
+    Both are computed using triangular solves against the (cached) Cholesky
+    factor of K(X, X), then all M samples are drawn through one Cholesky
+    decomposition of Var(f*|f), with adaptive jitter if it is not numerically
+    positive definite.
+
     Args:
         X_new: (np.ndarray of float32) testing locations, N_new x D
         X: (np.ndarray of float32) training locations, N x D
@@ -184,35 +729,48 @@ def sample_posterior_full(X_new, X, f_sample, ls,
         kernel_func_nn: (function or None) kernel function for distance among X_new,
             if None then set to kernel_func.
         ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition.
+        return_mean: (bool) If True then return the conditional mean only.
+        return_vcov: (bool) If True then return the conditional covariance only.
 
     Returns:
          (np.ndarray of float32) N_new x M vectors of posterior predictive mean samples
     """
-    X = tf.convert_to_tensor(X, dtype=tf.float32)
-    X_new = tf.convert_to_tensor(X_new, dtype=tf.float32)
-    f_sample = tf.convert_to_tensor(f_sample, dtype=tf.float32)
-
-    N_new, _ = X_new.shape.as_list()
-    N, M = f_sample.shape.as_list()
+    X = np.asarray(X, dtype=np.float32)
+    X_new = np.asarray(X_new, dtype=np.float32)
+    f_sample = np.asarray(f_sample, dtype=np.float64)
 
     if kernel_func_xn is None:
         kernel_func_xn = kernel_func
     if kernel_func_nn is None:
         kernel_func_nn = kernel_func
 
+    K_chol = _get_prior_chol(X, ls, kernel_func, ridge_factor)
+
     # compute basic components
-    Kxx = kernel_func_nn(X_new, X_new, ls=ls)
-    Kx = kernel_func_xn(X, X_new, ls=ls)
-    K = kernel_func(X, ls=ls, ridge_factor=ridge_factor)
-    K_inv = tf.matrix_inverse(K)
+    pred_graph = tf.Graph()
+    with pred_graph.as_default():
+        X_tensor = tf.convert_to_tensor(X, dtype=tf.float32)
+        X_new_tensor = tf.convert_to_tensor(X_new, dtype=tf.float32)
 
-    # compute conditional mean and variance.
-    mu_sample = tf.matmul(Kx, tf.matmul(K_inv, f_sample), transpose_a=True)
-    Sigma = Kxx - tf.matmul(Kx, tf.matmul(K_inv, Kx), transpose_a=True)
+        kernel_tensors = {"Kx": kernel_func_xn(X_tensor, X_new_tensor, ls=ls)}
+        if not return_mean:
+            kernel_tensors["Kxx"] = kernel_func_nn(X_new_tensor, X_new_tensor, ls=ls)
+        if K_chol is None:
+            kernel_tensors["K"] = kernel_func(X_tensor, ls=ls,
+                                              ridge_factor=ridge_factor)
 
-    # sample
-    with tf.Session() as sess:
-        cond_means, cond_cov, Kxx_val = sess.run([mu_sample, Sigma, Kxx])
+        with tf.Session() as sess:
+            kernel_vals = sess.run(kernel_tensors)
+
+    if K_chol is None:
+        K_chol = _get_prior_chol(X, ls, kernel_func, ridge_factor,
+                                 K=kernel_vals["K"])
+
+    # compute conditional mean and variance.
+    cond_means, cond_cov = matrix_util.gaussian_conditional(
+        K_chol, K_xn=kernel_vals["Kx"].astype(np.float64),
+        K_nn=kernel_vals.get("Kxx", None),
+        f_sample=f_sample)
 
     if return_mean:
         return cond_means.astype(np.float32)
@@ -220,9 +778,762 @@ def sample_posterior_full(X_new, X, f_sample, ls,
     if return_vcov:
         return cond_cov.astype(np.float32)
 
-    f_new_centered = np.random.multivariate_normal(
-        mean=[0] * N_new, cov=cond_cov, size=M).T
-    f_new = f_new_centered + cond_means
+    # sample
+    f_new = matrix_util.sample_gaussian_chol(cond_means, cond_cov)
+
+    return f_new.astype(np.float32)
+
+
+def kernel_diag(X, ls, kernel_func=rbf):
+    """Computes diagonal of kernel matrix k(x_i, x_i) without forming it.
+
+    For rbf (and any kernel with k(x, x) = 1) the diagonal is constant.
+    Other kernels are evaluated on one feature at a time, which costs
+    O(N) memory instead of O(N^2).
+
+    Args:
+        X: (tf.Tensor of float32) features of dimension (N, D).
+        ls: (float) length scale parameter.
+        kernel_func: (function) kernel function.
+
+    Returns:
+        (tf.Tensor of float32) Diagonal of kernel matrix, shape (N, ).
+    """
+    if kernel_func is rbf:
+        return tf.ones(tf.shape(X)[:1], dtype=tf.float32)
+
+    return tf.map_fn(
+        lambda x: tf.reshape(kernel_func(x[tf.newaxis], x[tf.newaxis], ls=ls), []),
+        X)
+
+
+def _predict_chunk_size(n_obs, n_sample, memory_budget, marginal_only):
+    """Computes number of prediction locations per tile under a memory budget.
+
+    Per tile of size T, the float64 working set is roughly
+        2 * N_obs x T (cross kernel and its triangular solve A)
+            + 2 * T x M (mean and samples) + T (conditional variance)
+            + 3 * T x T (tile kernel, conditional covariance and its
+                         Cholesky factor, skipped if marginal_only)
+
+    Args:
+        n_obs: (int) Number of training locations.
+        n_sample: (int) Number of posterior samples M.
+        memory_budget: (float) Memory budget per tile in megabytes.
+        marginal_only: (bool) Whether conditional covariance is skipped.
+
+    Returns:
+        (int) Tile size, at least 1.
+    """
+    n_elem = memory_budget * 2 ** 20 / 8.
+    lin_coef = 2 * n_obs + 2 * n_sample + 1
+    quad_coef = 3
+
+    if marginal_only:
+        chunk_size = n_elem / lin_coef
+    else:
+        # solve quad_coef * T**2 + lin_coef * T <= n_elem
+        chunk_size = (np.sqrt(lin_coef ** 2 + 4 * quad_coef * n_elem) -
+                      lin_coef) / (2 * quad_coef)
+
+    return max(int(chunk_size), 1)
+
+
+def sample_posterior_chunked(X_new, X, f_sample, ls,
+                             kernel_func=rbf,
+                             kernel_func_xn=None,
+                             kernel_func_nn=None,
+                             ridge_factor=1e-3,
+                             chunk_size=None, memory_budget=256.,
+                             marginal_only=False):
+    """Streams posterior predictive over tiles of X_new.
+
+    Memory-bounded version of sample_posterior_full for large prediction
+    grids. X_new is processed in consecutive tiles of size chunk_size, such
+    that only N_obs x T cross-kernel and T x T conditional covariance are
+    held in memory at any time (see _predict_chunk_size). The kernel graph
+    is built once with a placeholder for the tile, and the Cholesky factor
+    of K(X, X) as well as K(X, X)^{-1}f are computed once and shared across
+    tiles.
+
+    Samples are drawn independently across tiles, i.e. they are exact
+    marginally within each tile but do not carry cross-tile correlation.
+    If marginal_only=True, only the conditional mean and the diagonal of
+    Var(f*|f) are computed, and the tile covariance is never formed, i.e.
+    K(X*, X*) is only evaluated on its diagonal (see kernel_diag).
+    The marginal predictive variance over posterior samples of f is then
+        Var(f*) = cond_var + Var_M(cond_mean).
+
+    Args:
+        X_new: (np.ndarray of float32) testing locations, N_new x D
+        X: (np.ndarray of float32) training locations, N x D
+        f_sample: (np.ndarray of float32) M samples of posterior GP sample,
+            N_obs x N_sample
+        ls: (float) training lengthscale
+        kernel_func: (function) kernel function for distance among X.
+        kernel_func_xn: (function or None) kernel function for distance between X and X_new,
+            if None then set to kernel_func.
+        kernel_func_nn: (function or None) kernel function for distance among X_new,
+            if None then set to kernel_func.
+        ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition.
+        chunk_size: (int or None) Number of prediction locations per tile.
+            If None then derived from memory_budget.
+        memory_budget: (float) Approximate working memory per tile in megabytes,
+            used only if chunk_size is None.
+        marginal_only: (bool) If True then yield conditional mean and variance
+            instead of samples.
+
+    Yields:
+        tile_slice: (slice) Indices of X_new covered by the current tile.
+        tile_output: (np.ndarray of float32) T x M posterior predictive samples,
+            or if marginal_only a tuple of T x M conditional means and
+            length-T conditional variances.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    X_new = np.asarray(X_new, dtype=np.float32)
+    f_sample = np.asarray(f_sample, dtype=np.float64)
+
+    N_new = X_new.shape[0]
+    N_obs, N_sample = f_sample.shape
+
+    if kernel_func_xn is None:
+        kernel_func_xn = kernel_func
+    if kernel_func_nn is None:
+        kernel_func_nn = kernel_func
+
+    if chunk_size is None:
+        chunk_size = _predict_chunk_size(N_obs, N_sample,
+                                         memory_budget, marginal_only)
+
+    K_chol = _get_prior_chol(X, ls, kernel_func, ridge_factor)
+
+    # build kernel graph once, with placeholder for the prediction tile.
+    pred_graph = tf.Graph()
+    with pred_graph.as_default():
+        X_tensor = tf.convert_to_tensor(X, dtype=tf.float32)
+        X_tile = tf.placeholder(tf.float32, shape=[None, X_new.shape[1]])
+
+        Kx_tile = kernel_func_xn(X_tensor, X_tile, ls=ls)
+        if marginal_only:
+            Kxx_tile = kernel_diag(X_tile, ls=ls, kernel_func=kernel_func_nn)
+        else:
+            Kxx_tile = kernel_func_nn(X_tile, X_tile, ls=ls)
+
+        sess = tf.Session()
+        if K_chol is None:
+            K_val = sess.run(kernel_func(X_tensor, ls=ls,
+                                         ridge_factor=ridge_factor))
+            K_chol = _get_prior_chol(X, ls, kernel_func, ridge_factor, K=K_val)
+
+    # K(X, X)^{-1}f is shared by all tiles
+    K_inv_f = linalg.cho_solve((K_chol, True), f_sample)
+
+    try:
+        for tile_start in range(0, N_new, chunk_size):
+            tile_slice = slice(tile_start, min(tile_start + chunk_size, N_new))
+            Kx_val, Kxx_val = sess.run([Kx_tile, Kxx_tile],
+                                       feed_dict={X_tile: X_new[tile_slice]})
+            Kx_val = Kx_val.astype(np.float64)
+
+            cond_means = np.matmul(Kx_val.T, K_inv_f)
+            A = linalg.solve_triangular(K_chol, Kx_val, lower=True)
+
+            if marginal_only:
+                cond_var = np.maximum(Kxx_val - np.sum(A ** 2, axis=0), 0.)
+                yield tile_slice, (cond_means.astype(np.float32),
+                                   cond_var.astype(np.float32))
+            else:
+                cond_cov = Kxx_val - np.matmul(A.T, A)
+                f_new = matrix_util.sample_gaussian_chol(cond_means, cond_cov)
+                yield tile_slice, f_new.astype(np.float32)
+    finally:
+        sess.close()
+
+
+def sample_posterior_rff(X_new, X, f_sample, ls,
+                         kernel_func=rbf, ridge_factor=1e-3,
+                         n_features=_RFF_NUM_FEATURES_DEFAULT,
+                         seed=_RFF_SEED_DEFAULT, return_mean=False):
+    """Sample posterior predictive distribution under the RFF prior.
+
+    Under prior_rff, f = Phi w + e with w ~ N(0, I) and e ~ N(0, ridge_factor I),
+    using the same seeded Fourier features. The posterior w | f is Gaussian
+    with precision C = I + Phi^T Phi / ridge_factor (Woodbury), and posterior
+    predictive samples are f* = Phi* w. Only a K x K Cholesky is required,
+    and the cost O(N K^2 + K^3) is linear in N.
+
+    Args:
+        X_new: (np.ndarray of float32) testing locations, N_new x D
+        X: (np.ndarray of float32) training locations, N x D
+        f_sample: (np.ndarray of float32) M samples of posterior GP sample,
+            N_obs x N_sample
+        ls: (float) training lengthscale
+        kernel_func: (function) kernel function to approximate. Only rbf
+            is supported.
+        ridge_factor: (float32) ridge factor, see prior_rff.
+        n_features: (int) number of Fourier features K, see prior_rff.
+        seed: (int) random seed for the Fourier features, see prior_rff.
+        return_mean: (bool) If True then return the conditional mean only.
+
+    Returns:
+         (np.ndarray of float32) N_new x M vectors of posterior predictive samples
+
+    Raises:
+        (ValueError) If kernel_func is not rbf.
+    """
+    if kernel_func is not rbf:
+        raise ValueError("Random Fourier feature prior only supports rbf kernel.")
+
+    X = np.asarray(X, dtype=np.float32)
+    X_new = np.asarray(X_new, dtype=np.float32)
+    f_sample = np.asarray(f_sample, dtype=np.float64)
+
+    # compute features on the same basis as prior_rff
+    pred_graph = tf.Graph()
+    with pred_graph.as_default():
+        features = [random_fourier_features(X_val, ls=ls,
+                                            n_features=n_features, seed=seed)
+                    for X_val in (X, X_new)]
+
+        with tf.Session() as sess:
+            feature, feature_new = [
+                feature_val.astype(np.float64)
+                for feature_val in sess.run(features)]
+
+    # posterior precision and mean for feature weights w
+    precision = (np.eye(n_features) +
+                 feature.T.dot(feature) / ridge_factor)
+    precision_chol = matrix_util.cholesky_jitter(precision)
+
+    w_mean = linalg.cho_solve((precision_chol, True),
+                              feature.T.dot(f_sample) / ridge_factor)
+
+    if return_mean:
+        return feature_new.dot(w_mean).astype(np.float32)
+
+    # sample
+    w_sample = w_mean + linalg.solve_triangular(
+        precision_chol, np.random.normal(size=w_mean.shape),
+        lower=True, trans="T")
+
+    return feature_new.dot(w_sample).astype(np.float32)
+
+
+def posterior_sampler(prior_func):
+    """Returns posterior predictive sampler matching a GP prior.
+
+    Args:
+        prior_func: (function) Gaussian process prior, e.g. prior, prior_rff,
+            prior_ski or prior_vecchia.
+
+    Returns:
+        (function) Posterior predictive sampler with args
+            (X_new, X, f_sample, ls, **kwargs). Defaults to sample_posterior_full
+            for the exact priors (prior and prior_whitened).
+    """
+    sampler_dict = {prior_rff: sample_posterior_rff,
+                    prior_ski: sample_posterior_ski,
+                    prior_vecchia: sample_posterior_vecchia}
+    return sampler_dict.get(prior_func, sample_posterior_full)
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Structured Kernel Interpolation """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+def ski_grid(X, grid_size=None):
+    """Defines regular grid for structured kernel interpolation (KISS-GP).
+
+    Args:
+        X: (np.ndarray of float32) input features of dimension (N, D).
+        grid_size: (int, list of int or None) number of grid points for
+            each dimension. If None then use about _SKI_NUM_GRID_DEFAULT
+            grid points in total.
+
+    Returns:
+        (list of np.ndarray of float32) Equally spaced grid spanning the range
+            of X in each dimension.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    _, D = X.shape
+
+    if grid_size is None:
+        grid_size = int(_SKI_NUM_GRID_DEFAULT ** (1. / D))
+    if np.ndim(grid_size) == 0:
+        grid_size = [grid_size] * D
+
+    return [np.linspace(X[:, dim].min(), X[:, dim].max(),
+                        num=max(grid_size[dim], 2)).astype(np.float32)
+            for dim in range(D)]
+
+
+def ski_extend_grid(grid_list, X):
+    """Extends SKI grid with the same spacing to cover features X.
+
+    Since the kernel is stationary, K_UU on the original grid is a sub-matrix
+    of that on the extended grid, and the interpolation weights of points
+    inside the original grid are unchanged.
+
+    Args:
+        grid_list: (list of np.ndarray) grid for each dimension, see ski_grid.
+        X: (np.ndarray of float32) features of dimension (N, D) to cover.
+
+    Returns:
+        (list of np.ndarray of float32) Extended grid for each dimension.
+    """
+    X = np.asarray(X, dtype=np.float32)
+
+    grid_list_ext = []
+    for dim, grid in enumerate(grid_list):
+        grid_step = (grid[-1] - grid[0]) / (len(grid) - 1)
+        if grid_step <= 0:
+            grid_list_ext.append(grid)
+            continue
+
+        num_lower = int(np.ceil(max(grid[0] - X[:, dim].min(), 0.) / grid_step))
+        num_upper = int(np.ceil(max(X[:, dim].max() - grid[-1], 0.) / grid_step))
+
+        grid_list_ext.append(np.concatenate(
+            [grid[0] - grid_step * np.arange(num_lower, 0, -1),
+             grid,
+             grid[-1] + grid_step * np.arange(1, num_upper + 1)]).astype(np.float32))
+
+    return grid_list_ext
+
+
+def ski_interp_matrix(X, grid_list):
+    """Computes sparse interpolation matrix W from X onto grid.
+
+    Args:
+        X: (np.ndarray of float32) input features of dimension (N, D).
+        grid_list: (list of np.ndarray) grid for each dimension, see ski_grid.
+
+    Returns:
+        (tf.SparseTensor of float32) Interpolation matrix of dimension (N, G).
+    """
+    indices, values, dense_shape = matrix_util.interpolation_weights(X, grid_list)
+    return tf.SparseTensor(indices=indices, values=values,
+                           dense_shape=dense_shape)
+
+
+def _ski_grid_ls(ls, dim):
+    """Extracts length scale for one grid dimension."""
+    return ls if _is_scalar(ls) else ls[dim]
+
+
+def ski_kernel_matmul(X, V, ls, kernel_func=rbf, ridge_factor=0.,
+                      grid_size=None):
+    """Multiplies SKI kernel matrix (W K_UU W^T + ridge * I) with V.
+
+    K_UU is the kernel matrix on the grid, which is Toeplitz in 1D and
+    Kronecker product of Toeplitz matrices in multiple dimensions, therefore
+    the product costs O(N + G log G) per column of V.
+
+    Args:
+        X: (np.ndarray of float32) input features of dimension (N, D).
+        V: (tf.Tensor of float32) matrix of dimension (N, M).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) stationary kernel function that is separable
+            across dimensions, e.g. rbf.
+        ridge_factor: (float32) ridge factor added to the diagonal.
+        grid_size: (int, list of int or None) grid size, see ski_grid.
+
+    Returns:
+        (tf.Tensor of float32) Matrix product of dimension (N, M).
+    """
+    grid_list = ski_grid(X, grid_size)
+    interp_mat = ski_interp_matrix(X, grid_list)
+
+    grid_cols = [kernel_func(tf.constant(grid[:1, np.newaxis]),
+                             tf.constant(grid[:, np.newaxis]),
+                             ls=_ski_grid_ls(ls, dim))[0]
+                 for dim, grid in enumerate(grid_list)]
+
+    WtV = tf.sparse_tensor_dense_matmul(interp_mat, V, adjoint_a=True)
+    KWtV = matrix_util.kronecker_toeplitz_matmul(grid_cols, WtV)
+
+    return tf.sparse_tensor_dense_matmul(interp_mat, KWtV) + ridge_factor * V
+
+
+def prior_ski(X, ls, kernel_func=rbf, ridge_factor=1e-3,
+              grid_size=None, name=None):
+    """Defines Gaussian Process prior using structured kernel interpolation.
+
+    Approximates the Gaussian process prior with f = W u + e, where
+        u ~ MVN(0, K_UU) on a regular grid, W is the sparse (multi-)linear
+        interpolation matrix and e ~ N(0, ridge_factor * I), i.e.
+
+        f ~ MVN(0, W K_UU W^T + ridge_factor * I).
+
+    The Cholesky factor of K_UU is kept as the list of per-dimension grid
+    factors, and W is only used through sparse products (see
+    dist_util.MultivariateNormalLowRankPlusDiagDistribution). The log density
+    still needs one G x G capacitance Cholesky, i.e. it costs
+    O(N 4^D + G^2 sum_d G_d + G^3) time and O(G^2) memory instead of
+    O(N^3) and O(N^2), which pays off for N >> G. Under the "iterative"
+    linear algebra backend, the log density only uses the O(N + G log G)
+    products of ski_kernel_matmul.
+
+    Args:
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) stationary kernel function that is separable
+            across dimensions, e.g. rbf.
+        ridge_factor: (float32) ridge factor (diagonal variance) added to the
+            interpolated covariance.
+        grid_size: (int, list of int or None) grid size, see ski_grid.
+        name: (str) name of the random variable
+
+    Returns:
+        (ed.RandomVariable) A random variable representing the Gaussian Process,
+            dimension (N,)
+    """
+    X = np.asarray(X, dtype=np.float32)
+    N, _ = X.shape
+
+    if matrix_util.get_linalg_backend() == matrix_util.LINALG_BACKEND_ITERATIVE:
+        return dist_util.MultivariateNormalIterative(
+            loc=tf.zeros(N, dtype=tf.float32),
+            cov_matmul_fn=functools.partial(ski_kernel_matmul, X,
+                                            ls=ls, kernel_func=kernel_func,
+                                            ridge_factor=ridge_factor,
+                                            grid_size=grid_size),
+            name=name)
+
+    grid_list = ski_grid(X, grid_size)
+    interp_mat = ski_interp_matrix(X, grid_list)
+
+    # grid kernels are severely ill-conditioned, so factorize in float64.
+    grid_chols = []
+    for dim, grid in enumerate(grid_list):
+        K_grid = tf.cast(kernel_func(tf.constant(grid[:, np.newaxis]),
+                                     ls=_ski_grid_ls(ls, dim)), tf.float64)
+        K_grid += _SKI_GRID_JITTER * tf.eye(len(grid), dtype=tf.float64)
+        grid_chols.append(tf.cast(tf.cholesky(K_grid), tf.float32))
+
+    return dist_util.MultivariateNormalLowRankPlusDiag(
+        loc=tf.zeros(N, dtype=tf.float32),
+        cov_diag=ridge_factor * tf.ones(N, dtype=tf.float32),
+        cov_factor=grid_chols,
+        interp_matrix=interp_mat,
+        name=name)
+
+
+def sample_posterior_ski(X_new, X, f_sample, ls,
+                         kernel_func=rbf, ridge_factor=1e-3,
+                         grid_size=None, return_mean=False):
+    """Sample posterior predictive distribution under the SKI prior.
+
+    Under prior_ski, f = W u + e with u = L_UU z, z ~ N(0, I). The posterior
+    z | f is Gaussian with precision C = I + L_UU^T W^T W L_UU / ridge_factor,
+    and posterior predictive samples are f* = W* L_UU z. Only a G x G
+    Cholesky is required, and the cost is linear in N and N_new.
+
+    The grid is the one used by prior_ski on X. If X_new falls outside of it,
+    the grid is extended with the same spacing (see ski_extend_grid), which
+    leaves the prior of f on X unchanged.
+
+    Args:
+        X_new: (np.ndarray of float32) testing locations, N_new x D
+        X: (np.ndarray of float32) training locations, N x D
+        f_sample: (np.ndarray of float32) M samples of posterior GP sample,
+            N_obs x N_sample
+        ls: (float) training lengthscale
+        kernel_func: (function) stationary kernel function that is separable
+            across dimensions, e.g. rbf.
+        ridge_factor: (float32) ridge factor, see prior_ski.
+        grid_size: (int, list of int or None) grid size, see ski_grid.
+        return_mean: (bool) If True then return the conditional mean only.
+
+    Returns:
+         (np.ndarray of float32) N_new x M vectors of posterior predictive samples
+    """
+    X = np.asarray(X, dtype=np.float32)
+    X_new = np.asarray(X_new, dtype=np.float32)
+    f_sample = np.asarray(f_sample, dtype=np.float64)
+
+    grid_list = ski_extend_grid(ski_grid(X, grid_size), X_new)
+
+    # compute Cholesky factor of grid kernel
+    pred_graph = tf.Graph()
+    with pred_graph.as_default():
+        grid_kernels = [kernel_func(tf.constant(grid[:, np.newaxis]),
+                                    ls=_ski_grid_ls(ls, dim))
+                        for dim, grid in enumerate(grid_list)]
+
+        with tf.Session() as sess:
+            grid_kernel_vals = sess.run(grid_kernels)
+
+    grid_chol = functools.reduce(
+        np.kron, [matrix_util.cholesky_jitter(
+            K + _SKI_GRID_JITTER * np.eye(K.shape[0])) for K in grid_kernel_vals])
+
+    # sparse interpolation matrices
+    interp_mat, interp_mat_new = [
+        sparse.csr_matrix((values, (indices[:, 0], indices[:, 1])), shape=shape)
+        for indices, values, shape in (
+            matrix_util.interpolation_weights(X, grid_list),
+            matrix_util.interpolation_weights(X_new, grid_list))]
+
+    # posterior precision and mean for whitened grid values z
+    WtW = (interp_mat.T.dot(interp_mat)).toarray()
+    precision = (np.eye(grid_chol.shape[0]) +
+                 grid_chol.T.dot(WtW).dot(grid_chol) / ridge_factor)
+    precision_chol = matrix_util.cholesky_jitter(precision)
+
+    z_mean = linalg.cho_solve(
+        (precision_chol, True),
+        grid_chol.T.dot(interp_mat.T.dot(f_sample)) / ridge_factor)
+
+    if return_mean:
+        return interp_mat_new.dot(grid_chol.dot(z_mean)).astype(np.float32)
+
+    # sample
+    z_sample = z_mean + linalg.solve_triangular(
+        precision_chol, np.random.normal(size=z_mean.shape),
+        lower=True, trans="T")
+
+    return interp_mat_new.dot(grid_chol.dot(z_sample)).astype(np.float32)
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Vecchia Approximation """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+def vecchia_ordering(X, method="coord"):
+    """Defines ordering of input locations for Vecchia approximation.
+
+    Args:
+        X: (np.ndarray of float32) input features of dimension (N, D).
+        method: (str) "coord" to sort by coordinates (first dimension
+            first), or "random" for a (fixed-seed) random permutation.
+
+    Returns:
+        (np.ndarray of int64) Permutation of range(N).
+
+    Raises:
+        (ValueError) If method is not recognized.
+    """
+    if method == "coord":
+        return np.lexsort(X.T[::-1]).astype(np.int64)
+    elif method == "random":
+        return np.random.RandomState(0).permutation(X.shape[0]).astype(np.int64)
+
+    raise ValueError("Ordering method must be one of ('coord', 'random'), "
+                     "observed '{}'.".format(method))
+
+
+def _vecchia_neighbors_search(X_ordered, n_neighbor):
+    """Finds n_neighbor nearest preceding neighbors using a KD-tree.
+
+    Candidates are first searched among 4 * n_neighbor nearest points of the
+    full set. Elements with insufficient preceding candidates fall back to
+    brute-force search over all preceding points.
+    """
+    N = X_ordered.shape[0]
+    neighbor_index = -np.ones((N, n_neighbor), dtype=np.int64)
+
+    num_query = min(N, 4 * n_neighbor + 1)
+    _, query_index = spatial.cKDTree(X_ordered).query(X_ordered, k=num_query)
+    query_index = query_index.reshape(N, num_query)
+
+    for i in range(1, N):
+        num_prev = min(i, n_neighbor)
+
+        candidate = query_index[i][query_index[i] < i][:num_prev]
+        if len(candidate) < num_prev:
+            dist = np.sum((X_ordered[:i] - X_ordered[i]) ** 2, axis=-1)
+            candidate = np.argsort(dist, kind="mergesort")[:num_prev]
+
+        neighbor_index[i, :num_prev] = candidate
+
+    return neighbor_index
+
+
+def vecchia_neighbors(X, n_neighbor=_VECCHIA_NUM_NEIGHBOR_DEFAULT,
+                      ordering="coord"):
+    """Computes (cached) ordering and nearest preceding neighbor sets.
+
+    Args:
+        X: (np.ndarray of float32) input features of dimension (N, D).
+        n_neighbor: (int) size m of the neighbor sets.
+        ordering: (str) ordering method, see vecchia_ordering.
+
+    Returns:
+        order: (np.ndarray of int64) Ordering of X, shape (N, ).
+        neighbor_index: (np.ndarray of int64) Ordered position of neighbors
+            for each ordered element, -1 for padding, shape (N, m).
+    """
+    X = np.asarray(X, dtype=np.float32)
+
+    cache_key = misc_util.make_hash_key(X) + (n_neighbor, ordering)
+    if cache_key in _VECCHIA_NEIGHBOR_CACHE:
+        _VECCHIA_NEIGHBOR_CACHE.move_to_end(cache_key)
+        return _VECCHIA_NEIGHBOR_CACHE[cache_key]
+
+    order = vecchia_ordering(X, method=ordering)
+    neighbor_index = _vecchia_neighbors_search(X[order], n_neighbor)
+
+    _VECCHIA_NEIGHBOR_CACHE[cache_key] = (order, neighbor_index)
+    while len(_VECCHIA_NEIGHBOR_CACHE) > _VECCHIA_NEIGHBOR_CACHE_SIZE:
+        _VECCHIA_NEIGHBOR_CACHE.popitem(last=False)
+
+    return order, neighbor_index
+
+
+def _vecchia_square_dist(X_a, X_b, ls):
+    """Computes batched ||x-x'||^2 / ls**2 between (B, m_a, D) and (B, m_b, D)."""
+    diff = X_a[:, :, np.newaxis, :] - X_b[:, np.newaxis, :, :]
+
+    if _is_scalar(ls):
+        return np.sum(diff ** 2, axis=-1) / ls ** 2
+    return tf.reduce_sum(tf.square(diff / ls), axis=-1)
+
+
+def _vecchia_conditionals(X_cond, X_target, neighbor_mask, ls, ridge_factor):
+    """Computes regression weights and variances of f(x_target) | f(X_cond).
+
+    Args:
+        X_cond: (np.ndarray of float32) Neighbor locations, shape (B, m, D).
+        X_target: (np.ndarray of float32) Target locations, shape (B, D).
+        neighbor_mask: (np.ndarray of bool) False for padded neighbors, shape (B, m).
+        ls: (float32) length scale parameter.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+
+    Returns:
+        cond_weights: (tf.Tensor of float32) shape (B, m).
+        cond_var: (tf.Tensor of float32) shape (B, ).
+    """
+    mask = neighbor_mask.astype(np.float32)
+    mask_mat = mask[:, :, np.newaxis] * mask[:, np.newaxis, :]
+    pad_diag = np.eye(mask.shape[1], dtype=np.float32) * (1. - mask)[:, np.newaxis, :]
+
+    # rbf kernel among neighbors, with padded rows replaced by identity.
+    K_nn = (mask_mat * tf.exp(-_vecchia_square_dist(X_cond, X_cond, ls) / 2) +
+            pad_diag + ridge_factor * np.eye(mask.shape[1], dtype=np.float32))
+    K_nt = mask[:, :, np.newaxis] * tf.exp(
+        -_vecchia_square_dist(X_cond, X_target[:, np.newaxis, :], ls) / 2)
+
+    K_nn_inv_nt = tf.cholesky_solve(tf.cholesky(K_nn), K_nt)
+
+    cond_weights = tf.squeeze(K_nn_inv_nt, -1)
+    cond_var = (1. + ridge_factor -
+                tf.reduce_sum(cond_weights * tf.squeeze(K_nt, -1), axis=-1))
+
+    return cond_weights, cond_var
+
+
+def prior_vecchia(X, ls, kernel_func=rbf, ridge_factor=1e-3,
+                  n_neighbor=_VECCHIA_NUM_NEIGHBOR_DEFAULT,
+                  ordering="coord", name=None):
+    """Defines Gaussian Process prior using Vecchia approximation.
+
+    Approximates the joint density by a product of small conditionals,
+
+        p(f) = prod_i p(f_i | f_{N(i)}),
+
+    where N(i) are the m nearest neighbors of x_i among the locations
+    preceding it in the ordering (found using a KD-tree). The implied
+    precision matrix is sparse, and the log density costs O(N m^3).
+
+    Args:
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        ls: (float32) length scale parameter.
+        kernel_func: (function) kernel function to approximate. Only rbf
+            is supported.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        n_neighbor: (int) size m of the neighbor sets.
+        ordering: (str) ordering method, see vecchia_ordering.
+        name: (str) name of the random variable
+
+    Returns:
+        (ed.RandomVariable) A random variable representing the Gaussian Process,
+            dimension (N,)
+
+    Raises:
+        (ValueError) If kernel_func is not rbf.
+    """
+    if kernel_func is not rbf:
+        raise ValueError("Vecchia prior only supports rbf kernel.")
+
+    X = np.asarray(X, dtype=np.float32)
+    N, _ = X.shape
+
+    order, neighbor_index = vecchia_neighbors(X, n_neighbor=n_neighbor,
+                                              ordering=ordering)
+    X_ordered = X[order]
+
+    cond_weights, cond_var = _vecchia_conditionals(
+        X_cond=X_ordered[np.maximum(neighbor_index, 0)],
+        X_target=X_ordered,
+        neighbor_mask=neighbor_index >= 0,
+        ls=ls, ridge_factor=ridge_factor)
+
+    return dist_util.MultivariateNormalVecchia(
+        loc=tf.zeros(N, dtype=tf.float32),
+        cond_weights=cond_weights,
+        cond_var=cond_var,
+        order=order,
+        neighbor_index=neighbor_index,
+        name=name)
+
+
+def sample_posterior_vecchia(X_new, X, f_sample, ls,
+                             ridge_factor=1e-3,
+                             n_neighbor=_VECCHIA_NUM_NEIGHBOR_DEFAULT,
+                             return_mean=False):
+    """Sample posterior predictive distribution under the Vecchia prior.
+
+    Each new location is conditioned on its m nearest training locations,
+
+        f*_j | f ~ N(b_j^T f_{N(j)}, d_j),
+
+    independently across new locations, such that the cost is O(N_new m^3)
+    and does not grow with N.
+
+    Args:
+        X_new: (np.ndarray of float32) testing locations, N_new x D
+        X: (np.ndarray of float32) training locations, N x D
+        f_sample: (np.ndarray of float32) M samples of posterior GP sample,
+            N_obs x N_sample
+        ls: (float) training lengthscale
+        ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition.
+        n_neighbor: (int) size m of the neighbor sets.
+        return_mean: (bool) If True then return the conditional mean only.
+
+    Returns:
+         (np.ndarray of float32) N_new x M vectors of posterior predictive samples
+    """
+    X = np.asarray(X, dtype=np.float32)
+    X_new = np.asarray(X_new, dtype=np.float32)
+    f_sample = np.asarray(f_sample, dtype=np.float32)
+
+    n_neighbor = min(n_neighbor, X.shape[0])
+    _, neighbor_index = spatial.cKDTree(X).query(X_new, k=n_neighbor)
+    neighbor_index = neighbor_index.reshape(X_new.shape[0], n_neighbor)
+
+    pred_graph = tf.Graph()
+    with pred_graph.as_default():
+        cond_weights, cond_var = _vecchia_conditionals(
+            X_cond=X[neighbor_index], X_target=X_new,
+            neighbor_mask=np.ones_like(neighbor_index, dtype=bool),
+            ls=ls, ridge_factor=ridge_factor)
+
+        with tf.Session() as sess:
+            cond_weights_val, cond_var_val = sess.run([cond_weights, cond_var])
+
+    # conditional mean, shape (N_new, M)
+    cond_means = np.einsum("jk,jkm->jm", cond_weights_val, f_sample[neighbor_index])
+
+    if return_mean:
+        return cond_means
+
+    cond_sdev = np.sqrt(np.maximum(cond_var_val, 0.))[:, np.newaxis]
+    f_new = cond_means + cond_sdev * np.random.normal(size=cond_means.shape)
 
     return f_new.astype(np.float32)
 
@@ -341,6 +1652,13 @@ Variational posterior:
 Consequently, U can be marginalized out, such that q(F) becomes 
     q(F|m, S) ~ MVN(F| Mu =     Kxz Kzz^{-1} m
                        Sigma =  Kxx - Kxz Kzz^{-1} (Kzz - S) Kzz^{-1} Kxz^T)
+
+In practice, we model S = LL^T and keep only the diagonal of the Nystrom
+residual Kxx - Kxz Kzz^{-1} Kxz^T, such that
+
+    Sigma = diag(Kxx - Kxz Kzz^{-1} Kxz^T) + (Kxz Kzz^{-1} L) (Kxz Kzz^{-1} L)^T,
+
+and the log density, sampling and KL(q(U) || p(U)) all cost O(Nx Nz^2).
 """
 
 
@@ -353,7 +1671,7 @@ def variational_sgpr(X, Z, ls=1., kernel_func=rbf, ridge_factor=1e-3,
         X: (np.ndarray of float32) input training features, with dimension (Nx, D).
         Z: (np.ndarray of float32) inducing points, with dimension (Nz, D).
         ls: (float32) length scale parameter.
-        kernel_func: (function) kernel function.
+        kernel_func: (function) stationary kernel function.
         ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition
         mfvi_mixture: (float32) Whether to output variational family with a
             mixture of MFVI.
@@ -363,8 +1681,11 @@ def variational_sgpr(X, Z, ls=1., kernel_func=rbf, ridge_factor=1e-3,
             For compatibility purpose with other variational family.
 
     Returns:
-        q_f, q_sig: (ed.RandomVariable) variational family.
-        q_f_mean, q_f_sdev: (tf.Variable) variational parameters for q_f
+        q_f: (ed.RandomVariable) variational family.
+        qf_mean: (tf.Tensor) mean of q_f, shape (Nx, ).
+        qf_cov: (tuple of tf.Tensor) covariance of q_f in low-rank-plus-diagonal
+            form (qf_cov_diag, qf_cov_factor), of shape (Nx, ) and (Nx, Nz).
+        mixture_par_list: (list of tf.Variable) parameters for MFVI mixture.
     """
     X = tf.convert_to_tensor(X, dtype=tf.float32)
     Z = tf.convert_to_tensor(Z, dtype=tf.float32)
@@ -372,46 +1693,57 @@ def variational_sgpr(X, Z, ls=1., kernel_func=rbf, ridge_factor=1e-3,
     Nx, Nz = X.shape.as_list()[0], Z.shape.as_list()[0]
 
     # 1. Prepare constants
-    # compute matrix constants
-    Kxx = kernel_func(X, ls=ls)
+    # compute matrix constants, only diagonal of Kxx is needed.
+    # kernel is stationary, therefore diag(Kxx) is constant.
+    Kxx_diag = tf.fill([Nx], tf.reshape(kernel_func(X[:1], ls=ls), []))
     Kxz = kernel_func(X, Z, ls=ls)
     Kzz = kernel_func(Z, ls=ls, ridge_factor=ridge_factor)
 
-    # compute null covariance matrix using Cholesky decomposition
-    Kzz_chol_inv = tf.matrix_inverse(tf.cholesky(Kzz))
-    Kzz_inv = tf.matmul(Kzz_chol_inv, Kzz_chol_inv, transpose_a=True)
-
-    Kxz_Kzz_chol_inv = tf.matmul(Kxz, Kzz_chol_inv, transpose_b=True)
-    Kxz_Kzz_inv = tf.matmul(Kxz, Kzz_inv)
-    Sigma_pre = Kxx - tf.matmul(Kxz_Kzz_chol_inv, Kxz_Kzz_chol_inv, transpose_b=True)
+    # compute Nystrom projection using Cholesky decomposition
+    Kzz_chol = tf.cholesky(Kzz)
+    Kzz_chol_inv_Kzx = tf.matrix_triangular_solve(Kzz_chol, tf.transpose(Kxz))
+    Kxz_Kzz_inv = tf.transpose(
+        tf.matrix_triangular_solve(tf.transpose(Kzz_chol), Kzz_chol_inv_Kzx,
+                                   lower=False))
+    Sigma_pre_diag = tf.nn.relu(
+        Kxx_diag - tf.reduce_sum(tf.square(Kzz_chol_inv_Kzx), axis=0))
 
     # 2. Define variational parameters
     # define free parameters (i.e. mean and full covariance of f_latent)
     m = tf.get_variable(shape=[Nz], name='{}_mean_latent'.format(name))
     s = tf.get_variable(shape=[Nz * (Nz + 1) / 2], name='{}_cov_latent_s'.format(name))
     L = fill_triangular(s, name='{}_cov_latent_chol'.format(name))
-    S = tf.matmul(L, L, transpose_b=True, name='{}_cov_latent'.format(name))
 
     # compute sparse gp variational parameter
-    # (i.e. mean and covariance of P(f_obs | f_latent))
+    # (i.e. mean and covariance of P(f_obs | f_latent)), where
+    # covariance is represented as diag(qf_cov_diag) + qf_cov_factor qf_cov_factor^T
     qf_mean = tf.tensordot(Kxz_Kzz_inv, m, [[1], [0]], name='{}_mean'.format(name))
-    qf_cov = (Sigma_pre +
-              tf.matmul(Kxz_Kzz_inv,
-                        tf.matmul(S, Kxz_Kzz_inv, transpose_b=True)) +
-              ridge_factor * tf.eye(Nx, dtype=tf.float32))
+    qf_cov_diag = tf.add(Sigma_pre_diag, ridge_factor,
+                         name='{}_cov_diag'.format(name))
+    qf_cov_factor = tf.matmul(Kxz_Kzz_inv, L, name='{}_cov_factor'.format(name))
+    qf_cov = (qf_cov_diag, qf_cov_factor)
 
     # define variational family
     mixture_par_list = []
     if mfvi_mixture:
-        gp_dist = tfd.MultivariateNormalFullCovariance(loc=qf_mean,
-                                                       covariance_matrix=qf_cov)
+        gp_dist = dist_util.VariationalGaussianProcessSparseDistribution(
+            loc=qf_mean,
+            cov_diag=qf_cov_diag,
+            cov_factor=qf_cov_factor,
+            inducing_mean=m,
+            inducing_scale=L,
+            prior_scale=Kzz_chol)
         q_f, mixture_par_list = inference_util.make_mfvi_sgp_mixture_family(
             n_mixture=n_mixture, N=Nx,
             gp_dist=gp_dist, name=name)
     else:
-        q_f = ed.MultivariateNormalFullCovariance(loc=qf_mean,
-                                                  covariance_matrix=qf_cov,
-                                                  name=name)
+        q_f = dist_util.VariationalGaussianProcessSparse(loc=qf_mean,
+                                                         cov_diag=qf_cov_diag,
+                                                         cov_factor=qf_cov_factor,
+                                                         inducing_mean=m,
+                                                         inducing_scale=L,
+                                                         prior_scale=Kzz_chol,
+                                                         name=name)
 
     return q_f, qf_mean, qf_cov, mixture_par_list
 
@@ -424,8 +1756,9 @@ def variational_sgpr_sample(n_sample, qf_mean, qf_cov,
         n_sample: (int) number of samples to draw
         qf_mean: (tf.Tensor of float32) mean parameters for
             variational family
-        qf_cov: (tf.Tensor of float32) covariance for parameters for
-            variational family
+        qf_cov: (tf.Tensor of float32 or tuple) covariance for parameters for
+            variational family, either a full covariance matrix or a tuple
+            (qf_cov_diag, qf_cov_factor) in low-rank-plus-diagonal form.
         mfvi_mixture: (bool) Whether to sample from a MFVI-SGP mixture
         mixture_par_list: (list of np.ndarray) List of mixture distribution
             parameters, containing [mixture_logits, qf_mean_mfvi, qf_sdev_mfvi].
@@ -435,8 +1768,13 @@ def variational_sgpr_sample(n_sample, qf_mean, qf_cov,
     Returns:
         (np.ndarray) sampled values.
     """
-    q_f = tfd.MultivariateNormalFullCovariance(loc=qf_mean,
-                                               covariance_matrix=qf_cov, )
+    if isinstance(qf_cov, (tuple, list)):
+        qf_cov_diag, qf_cov_factor = qf_cov
+        q_f = dist_util.MultivariateNormalLowRankPlusDiagDistribution(
+            loc=qf_mean, cov_diag=qf_cov_diag, cov_factor=qf_cov_factor)
+    else:
+        q_f = tfd.MultivariateNormalFullCovariance(loc=qf_mean,
+                                                   covariance_matrix=qf_cov, )
     q_f_sample = q_f.sample(n_sample)
 
     if mfvi_mixture:
@@ -488,7 +1826,13 @@ Then
 
     (Kss + S^{-1})^{-1} = L H^{-1} L^T,
 
-where H = I + L^T Kss L.
+where H = I + L^T Kss L. Writing Kss = Lss Lss^T and A = Lss^T L, H shares
+its spectrum with B = I + A A^T, so that a single Cholesky factor of B gives
+log|H| and the low-rank-plus-diagonal form
+
+    Sigma = diag(Kxx - P^T P) + P^T B^{-1} P,    where P = Lss^{-1} Kxs^T,
+
+see inference_util.make_decoupled_gp_parameters.
 """
 
 
@@ -502,7 +1846,7 @@ def variational_dgpr(X, Z, Zm=None, ls=1., kernel_func=rbf, ridge_factor=1e-3,
         Zm: (np.ndarray of float32 or None) inducing points for mean, shape (Nm, D).
             If None then same as Z
         ls: (float32) length scale parameter.
-        kernel_func: (function) kernel function.
+        kernel_func: (function) stationary kernel function.
         ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition
         mfvi_mixture: (float32) Whether to output variational family with a
             mixture of MFVI.
@@ -512,8 +1856,11 @@ def variational_dgpr(X, Z, Zm=None, ls=1., kernel_func=rbf, ridge_factor=1e-3,
             For compatibility purpose with other variational family.
 
     Returns:
-        q_f, q_sig: (ed.RandomVariable) variational family.
-        q_f_mean, q_f_sdev: (tf.Variable) variational parameters for q_f
+        q_f: (ed.RandomVariable) variational family.
+        qf_mean: (tf.Tensor) mean of q_f, shape (Nx, ).
+        qf_cov: (tuple of tf.Tensor) covariance of q_f in low-rank-plus-diagonal
+            form (qf_cov_diag, qf_cov_factor), of shape (Nx, ) and (Nx, Ns).
+        mixture_par_list: (list of tf.Variable) parameters for MFVI mixture.
     """
     X = tf.convert_to_tensor(X)
     Zs = tf.convert_to_tensor(Z)
@@ -521,41 +1868,27 @@ def variational_dgpr(X, Z, Zm=None, ls=1., kernel_func=rbf, ridge_factor=1e-3,
 
     Nx, Nm, Ns = X.shape.as_list()[0], Zm.shape.as_list()[0], Zs.shape.as_list()[0]
 
-    # 1. Prepare constants
-    # compute matrix constants
-    Kxx = kernel_func(X, ls=ls)
-    Kmm = kernel_func(Zm, ls=ls)
-    Kxm = kernel_func(X, Zm, ls=ls)
-    Kxs = kernel_func(X, Zs, ls=ls)
-    Kss = kernel_func(Zs, ls=ls, ridge_factor=ridge_factor)
-
-    # 2. Define variational parameters
+    # 1. Define variational parameters
     # define free parameters (i.e. mean and full covariance of f_latent)
     m = tf.get_variable(shape=[Nm, 1], name='{}_mean_latent'.format(name))
     s = tf.get_variable(shape=[Ns * (Ns + 1) / 2], name='{}_cov_latent_s'.format(name))
     L = fill_triangular(s, name='{}_cov_latent_chol'.format(name))
 
-    # components for KL objective
-    H = tf.eye(Ns) + tf.matmul(L, tf.matmul(Kss, L), transpose_a=True)
-    cond_cov_inv = tf.matmul(L, tf.matrix_solve(H, tf.transpose(L)))
-
-    func_norm_mm = tf.matmul(m, tf.matmul(Kmm, m), transpose_a=True)
-    log_det_ss = tf.log(tf.matrix_determinant(H))
-    cond_norm_ss = tf.reduce_sum(tf.multiply(Kss, cond_cov_inv))
-
-    # compute sparse gp variational parameter (i.e. mean and covariance of P(f_obs | f_latent))
-    qf_mean = tf.squeeze(tf.tensordot(Kxm, m, [[1], [0]]), name='{}_mean'.format(name))
-    qf_cov = (Kxx -
-              tf.matmul(Kxs, tf.matmul(cond_cov_inv, Kxs, transpose_b=True)) +
-              ridge_factor * tf.eye(Nx, dtype=tf.float32)
-              )
+    # 2. Compute decoupled gp variational parameter and components for KL objective
+    (qf_mean, qf_cov_diag, qf_cov_factor,
+     func_norm_mm, log_det_ss, cond_norm_ss) = (
+        inference_util.make_decoupled_gp_parameters(
+            m, L, X, Zm, Zs, ls=ls, kern_func=kernel_func,
+            ridge_factor=ridge_factor, mean_name='{}_mean'.format(name)))
+    qf_cov = (qf_cov_diag, qf_cov_factor)
 
     # 3. Define variational family
     mixture_par_list = []
     if mfvi_mixture:
         gp_dist = dist_util.VariationalGaussianProcessDecoupledDistribution(
             loc=qf_mean,
-            covariance_matrix=qf_cov,
+            cov_diag=qf_cov_diag,
+            cov_factor=qf_cov_factor,
             func_norm_mm=func_norm_mm,
             log_det_ss=log_det_ss,
             cond_norm_ss=cond_norm_ss)
@@ -565,7 +1898,8 @@ def variational_dgpr(X, Z, Zm=None, ls=1., kernel_func=rbf, ridge_factor=1e-3,
             gp_dist=gp_dist, name=name)
     else:
         q_f = dist_util.VariationalGaussianProcessDecoupled(loc=qf_mean,
-                                                            covariance_matrix=qf_cov,
+                                                            cov_diag=qf_cov_diag,
+                                                            cov_factor=qf_cov_factor,
                                                             func_norm_mm=func_norm_mm,
                                                             log_det_ss=log_det_ss,
                                                             cond_norm_ss=cond_norm_ss,
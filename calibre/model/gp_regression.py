@@ -426,8 +426,9 @@ def variational_sgpr_sample(n_sample, qf_mean, qf_vcov,
         n_sample: (int) number of samples to draw
         qf_mean: (tf.Tensor of float32) mean parameters for
             variational family
-        qf_vcov: (tf.Tensor of float32) covariance for parameters for
-            variational family
+        qf_vcov: (tf.Tensor of float32 or tuple) covariance for parameters for
+            variational family, either a full covariance matrix or a tuple
+            (qf_cov_diag, qf_cov_factor) in low-rank-plus-diagonal form.
         mfvi_mixture: (bool) Whether to sample from a MFVI-SGP mixture
         mixture_par_list: (list of np.ndarray) List of mixture distribution
             parameters, containing:
@@ -442,9 +443,15 @@ def variational_sgpr_sample(n_sample, qf_mean, qf_vcov,
     """
 
     """Generates f samples from GPR mean-field variational family."""
-    q_f = tfd.MultivariateNormalFullCovariance(loc=qf_mean,
-                                               covariance_matrix=qf_vcov,
-                                               name='q_f')
+    if isinstance(qf_vcov, (tuple, list)):
+        qf_cov_diag, qf_cov_factor = qf_vcov
+        q_f = dist_util.MultivariateNormalLowRankPlusDiagDistribution(
+            loc=qf_mean, cov_diag=qf_cov_diag, cov_factor=qf_cov_factor,
+            name='q_f')
+    else:
+        q_f = tfd.MultivariateNormalFullCovariance(loc=qf_mean,
+                                                   covariance_matrix=qf_vcov,
+                                                   name='q_f')
     q_f_sample = q_f.sample(n_sample)
 
     if mfvi_mixture:
@@ -525,15 +532,7 @@ def variational_dgpr(X, Zm, Zs, ls=1., kern_func=rbf, ridge_factor=1e-3,
 
     Nx, Nm, Ns = X.shape.as_list()[0], Zm.shape.as_list()[0], Zs.shape.as_list()[0]
 
-    # 1. Prepare constants
-    # compute matrix constants
-    Kxx = kern_func(X, ls=ls)
-    Kmm = kern_func(Zm, ls=ls)
-    Kxm = kern_func(X, Zm, ls=ls)
-    Kxs = kern_func(X, Zs, ls=ls)
-    Kss = kern_func(Zs, ls=ls, ridge_factor=ridge_factor)
-
-    # 2. Define variational parameters
+    # 1. Define variational parameters
     # define mean and variance for sigma
     q_sig_mean = tf.get_variable(shape=[], name='q_sig_mean')
     q_sig_sdev = tf.exp(tf.get_variable(shape=[], name='q_sig_sdev'))
@@ -543,27 +542,21 @@ def variational_dgpr(X, Zm, Zs, ls=1., kern_func=rbf, ridge_factor=1e-3,
     s = tf.get_variable(shape=[Ns * (Ns + 1) / 2], name='qf_s')
     L = fill_triangular(s, name='qf_chol')
 
-    # components for KL objective
-    H = tf.eye(Ns) + tf.matmul(L, tf.matmul(Kss, L), transpose_a=True)
-    cond_cov_inv = tf.matmul(L, tf.matrix_solve(H, tf.transpose(L)))
-
-    func_norm_mm = tf.matmul(m, tf.matmul(Kmm, m), transpose_a=True)
-    log_det_ss = tf.log(tf.matrix_determinant(H))
-    cond_norm_ss = tf.reduce_sum(tf.multiply(Kss, cond_cov_inv))
-
-    # compute sparse gp variational parameter (i.e. mean and covariance of P(f_obs | f_latent))
-    qf_mean = tf.squeeze(tf.tensordot(Kxm, m, [[1], [0]]), name='qf_mean')
-    qf_cov = (Kxx -
-              tf.matmul(Kxs, tf.matmul(cond_cov_inv, Kxs, transpose_b=True)) +
-              ridge_factor * tf.eye(Nx, dtype=tf.float32)
-              )
+    # 2. Compute decoupled gp variational parameter and components for KL objective
+    (qf_mean, qf_cov_diag, qf_cov_factor,
+     func_norm_mm, log_det_ss, cond_norm_ss) = (
+        inference_util.make_decoupled_gp_parameters(
+            m, L, X, Zm, Zs, ls=ls, kern_func=kern_func,
+            ridge_factor=ridge_factor, mean_name='qf_mean'))
+    qf_cov = (qf_cov_diag, qf_cov_factor)
 
     # define variational family
     mixture_par_list = []
     if mfvi_mixture:
         gp_dist = dist_util.VariationalGaussianProcessDecoupledDistribution(
             loc=qf_mean,
-            covariance_matrix=qf_cov,
+            cov_diag=qf_cov_diag,
+            cov_factor=qf_cov_factor,
             func_norm_mm=func_norm_mm,
             log_det_ss=log_det_ss,
             cond_norm_ss=cond_norm_ss)
@@ -573,7 +566,8 @@ def variational_dgpr(X, Zm, Zs, ls=1., kern_func=rbf, ridge_factor=1e-3,
             gp_dist=gp_dist, name='q_f')
     else:
         q_f = dist_util.VariationalGaussianProcessDecoupled(loc=qf_mean,
-                                                            covariance_matrix=qf_cov,
+                                                            cov_diag=qf_cov_diag,
+                                                            cov_factor=qf_cov_factor,
                                                             func_norm_mm=func_norm_mm,
                                                             log_det_ss=log_det_ss,
                                                             cond_norm_ss=cond_norm_ss,
@@ -1,4 +1,4 @@
-"""Defines 1D Monotonic Gaussian Process regression model.
+"""Defines Monotonic Gaussian Process regression model.
 
 For a Gaussian Process f ~ N(0, K), its derivative f' ~ N(0, ddK)
 also follows a Gaussian Process (since derivative is a linear operator).
@@ -11,6 +11,10 @@ where if K[i, j] = k(x, x'), then
     dK is the "Gradient Kernel Matrix":  dK[i, j] = dx k(x, x')
     ddK is the "Hessian Kernel Matrix": ddK[i, j] = dx dx' k(x, x'))
 
+For D-dimensional input, f' stacks the partial derivatives along a chosen
+subset of P input dimensions (`deriv_dims`), so that dK and ddK are of
+dimension (P * N_deriv, N) and (P * N_deriv, P * N_deriv).
+
 Consequently, we can perform monotonic regression by define a
     random variable C representing the positivity constraint on the
     derivative, such that it has support on {f' | f' > 0}.
@@ -20,6 +24,10 @@ Write out the likelihood:
 
 where P(C | f') can be Probit [2] or Logistic [3].
 
+For large N, `sparse_model` conditions both f and f' on the joint inducing
+values u = [f(Z), f'(Z_deriv)], so that training and prediction cost
+O((N + N_deriv) * Nu^2) rather than O((N + N_deriv)^3).
+
 #### References
 
 [1]:    Carl Rasmussen and Christopher Williams. Gaussian Processes for Machine Learning.
@@ -31,7 +39,11 @@ where P(C | f') can be Probit [2] or Logistic [3].
         _35th International Conference on Machine Learning_, 2018.
         http://proceedings.mlr.press/v80/lorenzi18a.html
 """
+import collections
+
 import numpy as np
+import scipy.linalg as linalg
+import scipy.stats as stats
 
 import tensorflow as tf
 import tensorflow_probability as tfp
@@ -40,7 +52,9 @@ from tensorflow_probability import edward2 as ed
 import calibre.model.gaussian_process as gp
 import calibre.model.gp_regression as gpr
 
+import calibre.util.misc as misc_util
 import calibre.util.matrix as matrix_util
+import calibre.util.distribution as dist_util
 import calibre.util.inference as inference_util
 
 from tensorflow.python.ops.distributions.util import fill_triangular
@@ -54,6 +68,15 @@ DEFAULT_PAR_SHIFT = np.array(-5.).astype(np.float32)
 DEFAULT_PAR_SCALE = np.array(1.).astype(np.float32)
 DEFAULT_CDF_CENTER = np.array(0.).astype(np.float32)
 
+DEFAULT_ACTIVE_SET_PROB_THRESHOLD = 0.05
+DEFAULT_ACTIVE_SET_MAX_NEW_POINTS = 10
+DEFAULT_ACTIVE_SET_MAX_ITER = 5
+
+# cache of conditional parameters for f_pred | f_obs, f_deriv,
+# see compute_pred_cond_params.
+_PRED_COND_PARAMS_CACHE = collections.OrderedDict()
+_PRED_COND_PARAMS_CACHE_SIZE = 4
+
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 """ Gradient and Hessian Kernel functions """
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -62,6 +85,9 @@ DEFAULT_CDF_CENTER = np.array(0.).astype(np.float32)
 def pair_diff_1d(X, X2=None, ls=1.):
     """Computes pairwise difference between two sets of 1D features.
 
+    The lengthscale-free difference x - x' is taken from the geometry cache
+    (see gp.pairwise_diff) and rescaled.
+
     Args:
         X: (tf.Tensor) First set of features of dim N x D.
         X2: (tf.Tensor or None) Second set of features of dim N2 x D.
@@ -73,19 +99,168 @@ def pair_diff_1d(X, X2=None, ls=1.):
     Raises:
         (ValueError) If feature dimension of X and X2 disagrees.
     """
-    N, D = X.shape
+    return gp.pairwise_diff(X, X2)[:, :, 0] / ls
 
-    X = X / ls
 
-    if X2 is None:
-        return X - tf.reshape(X, (D, N))
+def _check_deriv_dims(X, deriv_dims=None):
+    """Validates input dimensions to take derivative along.
+
+    Args:
+        X: (tf.Tensor) Features of dim N x D.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        (list of int) Input dimensions to take derivative along.
+
+    Raises:
+        (ValueError) If deriv_dims is empty or out of range for X.
+    """
+    _, D = X.shape.as_list()
+    if deriv_dims is None:
+        return list(range(D))
 
-    N2, D2 = X2.shape
-    if D != D2:
-        raise ValueError('Dimension of X and X2 does not match.')
+    deriv_dims = list(deriv_dims)
+    if not deriv_dims:
+        raise ValueError('deriv_dims must not be empty.')
+    if min(deriv_dims) < 0 or max(deriv_dims) >= D:
+        raise ValueError('deriv_dims {} out of range for feature '
+                         'dimension {}.'.format(deriv_dims, D))
+    return deriv_dims
+
+
+def rbf_fused(X, X2=None, ls=1., deriv_dims=None):
+    """Computes RBF kernel, gradient and hessian kernel in one pass.
+
+    The scaled difference d = (x - x') / ls and exp(- ||d||**2 / 2) are
+    computed once and shared between (for derivative dimensions p, q)
+
+        k(x, x')            = exp(- ||d||**2 / 2)
+        dx_p k(x, x')       = - (1 / ls) * d_p * k(x, x')
+        dx_p dx'_q k(x, x') = (1 / ls**2) * (delta_pq - d_p * d_q) * k(x, x')
+
+    The P derivative dimensions are stacked dimension-major, i.e. the
+    gradient kernel has shape (P * N, N2) where rows [p * N, (p + 1) * N)
+    correspond to derivative along deriv_dims[p], and the hessian kernel
+    has shape (P * N, P * N2).
+
+    Since the graph is pruned at run time, blocks that are not fetched
+    incur no computation.
+
+    Args:
+        X: (tf.Tensor) First set of features of dim N x D.
+        X2: (tf.Tensor or None) Second set of features of dim N2 x D.
+        ls: (float) value for length scale
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        K: (tf.Tensor) A N x N2 kernel matrix.
+        dK: (tf.Tensor) A (P * N) x N2 gradient kernel matrix.
+        ddK: (tf.Tensor) A (P * N) x (P * N2) hessian kernel matrix.
+
+    Raises:
+        (ValueError) If deriv_dims is out of range for X.
+    """
+    deriv_dims = _check_deriv_dims(X, deriv_dims)
+    num_dims = len(deriv_dims)
+
+    diff = gp.pairwise_diff(X, X2) / ls
+    N, N2, _ = diff.shape.as_list()
+
+    K = tf.exp(-tf.reduce_sum(tf.square(diff), axis=-1) / 2)
+
+    # derivative differences, shape (P, N, N2)
+    diff_deriv = tf.transpose(tf.gather(diff, deriv_dims, axis=-1), [2, 0, 1])
+
+    dK = -(1 / ls) * diff_deriv * K
+    dK = tf.reshape(dK, [num_dims * N, N2])
+
+    # hessian blocks, shape (P, P, N, N2) -> (P * N, P * N2)
+    delta = tf.eye(num_dims, dtype=K.dtype)[:, :, tf.newaxis, tf.newaxis]
+    ddK = ((1 / ls ** 2) *
+           (delta - diff_deriv[:, tf.newaxis] * diff_deriv[tf.newaxis]) * K)
+    ddK = tf.reshape(tf.transpose(ddK, [0, 2, 1, 3]),
+                     [num_dims * N, num_dims * N2])
+
+    return K, dK, ddK
+
+
+def rbf_grad(X, X2=None, ls=1., ridge_factor=0., deriv_dims=None):
+    """Defines RBF gradient kernel along given input dimensions.
+
+    Here gradient is taken with respect to left input x:
+
+    dx_p k(x, x') = - (1 / ls) * ( (x_p - x'_p) / ls ) *
+                    exp(- || x - x' ||**2 / 2 * ls**2)
+
+    Args:
+        X: (tf.Tensor) First set of features of dim N x D.
+        X2: (tf.Tensor or None) Second set of features of dim N2 x D.
+        ls: (float) value for length scale
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) P input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        (tf.Tensor) A (P * N) x N2 tensor.
+    """
+    _, dK, _ = rbf_fused(X, X2, ls=ls, deriv_dims=deriv_dims)
+
+    if ridge_factor and X2 is None:
+        dK = dK + ridge_factor * tf.eye(*dK.shape.as_list(), dtype=tf.float32)
 
-    X2 = X2 / ls
-    return X - tf.reshape(X2, (D2, N2))
+    return dK
+
+
+def rbf_hess(X, X2=None, ls=1., ridge_factor=0., deriv_dims=None):
+    """Defines RBF hessian kernel along given input dimensions.
+
+    dx_p dx'_q k(x, x') = (1 / ls**2) *
+                          (delta_pq - (x_p - x'_p) * (x_q - x'_q) / ls**2 ) *
+                          exp(- ||x - x'||**2 / 2 * ls**2 )
+
+    Args:
+        X: (tf.Tensor) First set of features of dim N x D.
+        X2: (tf.Tensor or None) Second set of features of dim N2 x D.
+        ls: (float) value for length scale
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) P input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        (tf.Tensor) A (P * N) x (P * N2) tensor.
+    """
+    _, _, ddK = rbf_fused(X, X2, ls=ls, deriv_dims=deriv_dims)
+
+    if ridge_factor and X2 is None:
+        ddK = ddK + ridge_factor * tf.eye(ddK.shape.as_list()[0], dtype=tf.float32)
+
+    return ddK
+
+
+def rbf_fused_1d(X, X2=None, ls=1.):
+    """Computes RBF kernel, gradient and hessian kernel for 1D input in one pass.
+
+    See rbf_fused.
+
+    Args:
+        X: (tf.Tensor) First set of features of dim N x D.
+        X2: (tf.Tensor or None) Second set of features of dim N2 x D.
+        ls: (float) value for length scale
+
+    Returns:
+        K, dK, ddK: (tf.Tensor) N x N2 tensors for kernel, gradient kernel
+            and hessian kernel matrices.
+
+    Raises:
+        (ValueError) If Dimension of X is not 1.
+    """
+    N, D = X.shape.as_list()
+    if D != 1:
+        raise ValueError('Feature dimension of X must be 1.')
+
+    return rbf_fused(X, X2, ls=ls, deriv_dims=[0])
 
 
 def rbf_grad_1d(X, X2=None, ls=1., ridge_factor=0.):
@@ -112,13 +287,7 @@ def rbf_grad_1d(X, X2=None, ls=1., ridge_factor=0.):
     if D != 1:
         raise ValueError('Feature dimension of X must be 1.')
 
-    if ridge_factor and X2 is None:
-        ridge_mat = ridge_factor * tf.eye(N, dtype=tf.float32)
-    else:
-        ridge_mat = 0
-
-    return (-(1 / ls) * pair_diff_1d(X, X2, ls=ls) *
-            tf.exp(-gp.square_dist(X, X2, ls=ls) / 2) + ridge_mat)
+    return rbf_grad(X, X2, ls=ls, ridge_factor=ridge_factor, deriv_dims=[0])
 
 
 def rbf_hess_1d(X, X2=None, ls=1., ridge_factor=0.):
@@ -144,13 +313,88 @@ def rbf_hess_1d(X, X2=None, ls=1., ridge_factor=0.):
     if D != 1:
         raise ValueError('Feature dimension of X must be 1.')
 
-    if ridge_factor and X2 is None:
-        ridge_mat = ridge_factor * tf.eye(N, dtype=tf.float32)
+    return rbf_hess(X, X2, ls=ls, ridge_factor=ridge_factor, deriv_dims=[0])
+
+
+def rbf_joint(X, X_deriv=None, ls=1., ridge_factor=0., deriv_dims=None):
+    """Computes blocks of the joint covariance of [f, f'] for RBF kernel.
+
+        [f, f'] ~ N( [0], [ K,   dK' ]  )
+                     [0], [ dK,  ddK ]
+
+    where f' stacks the partial derivatives along deriv_dims (dimension-major).
+    If X_deriv is X (or None), all three blocks are computed from a single
+    fused pass over X. Otherwise each block is computed from one pass over
+    its own pair of feature sets.
+
+    Args:
+        X: (tf.Tensor) Features with dimension (N, D).
+        X_deriv: (tf.Tensor or None) Feature location to place derivative
+            constraint on shape (N_deriv, D). If None, X_deriv=X
+        ls: (float) value for length scale
+        ridge_factor: (float32) ridge factor to add to diagonal of K and ddK.
+        deriv_dims: (list of int or None) P input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        K: (tf.Tensor) Kernel matrix k(X, X), shape (N, N).
+        dK: (tf.Tensor) Gradient kernel matrix dx k(X_deriv, X),
+            shape (P * N_deriv, N).
+        ddK: (tf.Tensor) Hessian kernel matrix,
+            shape (P * N_deriv, P * N_deriv).
+    """
+    if X_deriv is None or X_deriv is X:
+        K, dK, ddK = rbf_fused(X, ls=ls, deriv_dims=deriv_dims)
     else:
-        ridge_mat = 0
+        K, _, _ = rbf_fused(X, ls=ls, deriv_dims=deriv_dims)
+        _, dK, _ = rbf_fused(X_deriv, X, ls=ls, deriv_dims=deriv_dims)
+        _, _, ddK = rbf_fused(X_deriv, ls=ls, deriv_dims=deriv_dims)
+
+    if ridge_factor:
+        K = K + ridge_factor * tf.eye(K.shape.as_list()[0], dtype=tf.float32)
+        ddK = ddK + ridge_factor * tf.eye(ddK.shape.as_list()[0], dtype=tf.float32)
+
+    return K, dK, ddK
 
-    return ((1 / ls ** 2) * (1 - gp.square_dist(X, X2, ls=ls)) *
-            tf.exp(-gp.square_dist(X, X2, ls=ls) / 2) + ridge_mat)
+
+def rbf_pred_blocks(X_new, X_obs, X_deriv, ls=1., deriv_dims=None):
+    """Computes kernel blocks for the joint prior of [f_new, f_obs, f_deriv].
+
+    Distances and exponentials are shared between blocks whenever the
+    feature sets coincide, i.e. [K_oo, K'_do, K''_dd] and [K_on, K'_dn]
+    are each computed in one pass when X_deriv is X_obs.
+
+    Args:
+        X_new: (tf.Tensor of float32) testing locations, (N_new, D)
+        X_obs: (tf.Tensor of float32) training locations, (N_obs, D)
+        X_deriv: (tf.Tensor of float32) derivative locations, (N_deriv, D)
+        ls: (float32) Length scale parameter
+        deriv_dims: (list of int or None) P input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        K_nn, K_no, K_dn, K_oo, K_do, K_dd: (tf.Tensor) kernel blocks,
+            where K_dn, K_do are gradient kernel and K_dd hessian kernel
+            matrices, with P * N_deriv rows.
+    """
+    K_nn, _, _ = rbf_fused(X_new, ls=ls, deriv_dims=deriv_dims)
+    K_oo, K_do, K_dd = rbf_joint(X_obs, X_deriv, ls=ls, deriv_dims=deriv_dims)
+
+    if X_deriv is X_obs:
+        K_on, K_dn, _ = rbf_fused(X_obs, X_new, ls=ls, deriv_dims=deriv_dims)
+        K_no = tf.transpose(K_on)
+    else:
+        K_no, _, _ = rbf_fused(X_new, X_obs, ls=ls, deriv_dims=deriv_dims)
+        _, K_dn, _ = rbf_fused(X_deriv, X_new, ls=ls, deriv_dims=deriv_dims)
+
+    return K_nn, K_no, K_dn, K_oo, K_do, K_dd
+
+
+def _is_default_rbf(kernel_func_ff, kernel_func_df, kernel_func_dd):
+    """Checks if kernel functions are the RBF kernel and its derivatives."""
+    return (kernel_func_ff is gp.rbf and
+            kernel_func_df in (rbf_grad, rbf_grad_1d) and
+            kernel_func_dd in (rbf_hess, rbf_hess_1d))
 
 
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -160,9 +404,11 @@ def rbf_hess_1d(X, X2=None, ls=1., ridge_factor=0.):
 
 def deriv_prior(f, X, X_deriv=None, ls=1.,
                 kernel_func=gp.rbf,
-                grad_func=rbf_grad_1d,
-                hess_func=rbf_hess_1d,
+                grad_func=rbf_grad,
+                hess_func=rbf_hess,
                 ridge_factor=1e-3,
+                deriv_dims=None,
+                cond_params=None,
                 name="gp_f_deriv"):
     """Defines the conditional prior distribution of f' | f.
 
@@ -175,6 +421,9 @@ def deriv_prior(f, X, X_deriv=None, ls=1.,
         f' | f ~ N( Mu    = dK inv(K) f,
                     Sigma = ddK - dK inv(K) dK' )
 
+    For D > 1, f' stacks the partial derivatives along each of the P
+    dimensions in deriv_dims, i.e. f' has shape (P * N_deriv, ).
+
     Args:
         f: (ed.RandomVariable) Gaussian Process prior
         X: (tf.Tensor) Features with dimension (N, D).
@@ -185,35 +434,104 @@ def deriv_prior(f, X, X_deriv=None, ls=1.,
         grad_func: (function) Gradient kernel function for kernel_func
         hess_func: (function) Hessian kernel function for kernel_func
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along, only used for RBF kernel. If None, then all D dimensions.
+        cond_params: (tuple of tf.Tensor or None) Pre-computed projection
+            dK inv(K) and Cholesky factor of Sigma for fixed ls, see
+            compute_deriv_cond_params. If None then compute from kernels.
         name: (str) name of the random variable.
 
     Returns:
         (ed.RandomVariable) Conditional Prior for Gaussian Process Derivative.
     """
+    if cond_params is not None:
+        P_df, Sigma_chol = cond_params
+        Mu = tf.matmul(P_df, tf.expand_dims(f, -1))
+
+        return ed.MultivariateNormalTriL(loc=tf.squeeze(Mu, axis=-1),
+                                         scale_tril=Sigma_chol,
+                                         name=name)
+
     if X_deriv is None:
         X_deriv = X
 
     # compute basic components
-    dK = grad_func(X_deriv, X, ls=ls)
-    ddK = hess_func(X_deriv, ls=ls, ridge_factor=ridge_factor)
-    K = kernel_func(X, ls=ls, ridge_factor=ridge_factor)
-    K_inv = tf.matrix_inverse(K)
+    if _is_default_rbf(kernel_func, grad_func, hess_func):
+        K, dK, ddK = rbf_joint(X, X_deriv, ls=ls, ridge_factor=ridge_factor,
+                               deriv_dims=deriv_dims)
+    else:
+        dK = grad_func(X_deriv, X, ls=ls)
+        ddK = hess_func(X_deriv, ls=ls, ridge_factor=ridge_factor)
+        K = kernel_func(X, ls=ls, ridge_factor=ridge_factor)
+    K_inv_dK_f = matrix_util.psd_solve(
+        K, tf.concat([tf.transpose(dK), tf.expand_dims(f, -1)], axis=1))
+    K_inv_dK, K_inv_f = K_inv_dK_f[:, :-1], K_inv_dK_f[:, -1:]
 
     # compute conditional mean and variance.
-    Sigma = ddK - tf.matmul(dK, tf.matmul(K_inv, dK, transpose_b=True))
-    Mu = tf.matmul(dK, tf.matmul(K_inv, tf.expand_dims(f, -1)))
+    Sigma = ddK - tf.matmul(dK, K_inv_dK)
+    Mu = tf.matmul(dK, K_inv_f)
 
     return ed.MultivariateNormalTriL(loc=tf.squeeze(Mu),
                                      scale_tril=tf.cholesky(Sigma),
                                      name=name)
 
 
+def compute_deriv_cond_params(X, X_deriv=None, ls=1.,
+                              ridge_factor=1e-3, deriv_dims=None):
+    """Computes fixed-lengthscale parameters for the priors of f and f' | f.
+
+    Under fixed ls, the Cholesky factor of K, the projection dK inv(K) and
+    the Cholesky factor of Sigma = ddK - dK inv(K) dK' in `deriv_prior` are
+    constants. Computing them once allows the log joint to be evaluated with
+    one matrix-vector product and two triangular solves.
+
+    For stability, numpy float64 is used for the decomposition.
+
+    Args:
+        X: (np.ndarray of float32) Features with dimension (N, D).
+        X_deriv: (np.ndarray of float32 or None) Feature location to place
+            derivative constraint on shape (N_deriv, D). If None, X_deriv=X
+        ls: (float32) length scale parameter for RBF kernel.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        K_chol: (np.ndarray of float32) Cholesky factor of K, shape (N, N).
+        P_df: (np.ndarray of float32) Projection dK inv(K),
+            shape (P * N_deriv, N).
+        Sigma_chol: (np.ndarray of float32) Cholesky factor of Sigma,
+            shape (P * N_deriv, P * N_deriv).
+    """
+    share_deriv = X_deriv is None or X_deriv is X
+
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    X_deriv = X if share_deriv else tf.convert_to_tensor(X_deriv, dtype=tf.float32)
+
+    K, dK, ddK = rbf_joint(X, X_deriv, ls=ls, ridge_factor=ridge_factor,
+                           deriv_dims=deriv_dims)
+
+    with tf.Session() as sess:
+        K_val, dK_val, ddK_val = sess.run([K, dK, ddK])
+
+    K_chol = matrix_util.cholesky_jitter(K_val)
+    P_df = linalg.cho_solve((K_chol, True), dK_val.T.astype(np.float64)).T
+
+    Sigma = ddK_val - np.matmul(P_df, dK_val.T)
+    Sigma_chol = matrix_util.cholesky_jitter(Sigma)
+
+    return (K_chol.astype(np.float32),
+            P_df.astype(np.float32),
+            Sigma_chol.astype(np.float32))
+
+
 def pred_cond_prior_v0(gp, gp_deriv,
                        X_new, X_obs, X_deriv, ls,
                        kernel_func_ff=gp.rbf,
-                       kernel_func_df=rbf_grad_1d,
-                       kernel_func_dd=rbf_hess_1d,
+                       kernel_func_df=rbf_grad,
+                       kernel_func_dd=rbf_hess,
                        ridge_factor=1e-3,
+                       deriv_dims=None,
                        name="gp_pred"):
     """Defines the prior of f_pred | f_obs, f_derive.
 
@@ -251,6 +569,8 @@ def pred_cond_prior_v0(gp, gp_deriv,
         kernel_func_df: (function) gradient kernel function dx k(x, x')
         kernel_func_dd: (function) hessian kernel function dxdx' k(x, x')
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along, only used for RBF kernel. If None, then all D dimensions.
         name: (str) name of the random variable.
 
     Returns:
@@ -261,26 +581,33 @@ def pred_cond_prior_v0(gp, gp_deriv,
         (ValueError) If length scale parameter is not provided.
     """
     # compute matrix components
-    K_nn = kernel_func_ff(X_new, ls=ls, ridge_factor=ridge_factor)
+    if _is_default_rbf(kernel_func_ff, kernel_func_df, kernel_func_dd):
+        K_nn, K_no, dK_dn, K_oo, dK_do, ddK_dd = rbf_pred_blocks(
+            X_new, X_obs, X_deriv, ls=ls, deriv_dims=deriv_dims)
+        K_nn = K_nn + ridge_factor * tf.eye(K_nn.shape.as_list()[0], dtype=tf.float32)
+    else:
+        K_nn = kernel_func_ff(X_new, ls=ls, ridge_factor=ridge_factor)
 
-    K_no = kernel_func_ff(X_new, X_obs, ls=ls)
-    dK_dn = kernel_func_df(X_deriv, X_new, ls=ls)
+        K_no = kernel_func_ff(X_new, X_obs, ls=ls)
+        dK_dn = kernel_func_df(X_deriv, X_new, ls=ls)
 
-    K_oo = kernel_func_ff(X_obs, ls=ls)
-    dK_do = kernel_func_df(X_deriv, X_obs, ls=ls)
-    ddK_dd = kernel_func_dd(X_deriv, ls=ls)
+        K_oo = kernel_func_ff(X_obs, ls=ls)
+        dK_do = kernel_func_df(X_deriv, X_obs, ls=ls)
+        ddK_dd = kernel_func_dd(X_deriv, ls=ls)
 
     # assemble matrix and sample
     K_n_od = matrix_util.make_block_matrix(K_no, tf.transpose(dK_dn))
     K_odod = matrix_util.make_block_matrix(K_oo, tf.transpose(dK_do), ddK_dd,
                                            ridge_factor=ridge_factor)
-    K_odod_inv = tf.matrix_inverse(K_odod)
-
     gp_all = tf.expand_dims(tf.concat([gp, gp_deriv], axis=0), -1)
 
+    K_odod_inv_n_f = matrix_util.psd_solve(
+        K_odod, tf.concat([tf.transpose(K_n_od), gp_all], axis=1))
+    K_odod_inv_n, K_odod_inv_f = K_odod_inv_n_f[:, :-1], K_odod_inv_n_f[:, -1:]
+
     # compute conditional mean and variance.
-    Mu = tf.matmul(K_n_od, tf.matmul(K_odod_inv, gp_all))
-    Sigma = K_nn - tf.matmul(K_n_od, tf.matmul(K_odod_inv, K_n_od, transpose_b=True))
+    Mu = tf.matmul(K_n_od, K_odod_inv_f)
+    Sigma = K_nn - tf.matmul(K_n_od, K_odod_inv_n)
 
     # build random variable
     return ed.MultivariateNormalTriL(loc=tf.squeeze(Mu),
@@ -291,9 +618,10 @@ def pred_cond_prior_v0(gp, gp_deriv,
 def pred_cond_prior_v1(gp, gp_deriv,
                        X_new, X_obs, X_deriv, ls,
                        kernel_func_ff=gp.rbf,
-                       kernel_func_df=rbf_grad_1d,
-                       kernel_func_dd=rbf_hess_1d,
+                       kernel_func_df=rbf_grad,
+                       kernel_func_dd=rbf_hess,
                        ridge_factor=1e-3,
+                       deriv_dims=None,
                        name="gp_pred"):
     """Defines the prior of f_pred | f_obs, f_derive.
 
@@ -331,6 +659,8 @@ def pred_cond_prior_v1(gp, gp_deriv,
         kernel_func_df: (function) gradient kernel function dx k(x, x')
         kernel_func_dd: (function) hessian kernel function dxdx' k(x, x')
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along, only used for RBF kernel. If None, then all D dimensions.
         name: (str) name of the random variable.
 
     Returns:
@@ -340,33 +670,41 @@ def pred_cond_prior_v1(gp, gp_deriv,
     Raises:
         (ValueError) If length scale parameter is not provided.
     """
+    share_deriv = X_deriv is X_obs
+
     X_new = tf.convert_to_tensor(X_new, dtype=tf.float32)
     X_obs = tf.convert_to_tensor(X_obs, dtype=tf.float32)
-    X_deriv = tf.convert_to_tensor(X_deriv, dtype=tf.float32)
+    X_deriv = (X_obs if share_deriv else
+               tf.convert_to_tensor(X_deriv, dtype=tf.float32))
 
     N_obs, _ = X_obs.shape.as_list()
     N_deriv, _ = X_deriv.shape.as_list()
 
     # compute matrix components
-    K_nn = tf.stop_gradient(kernel_func_ff(X_new, ls=ls,
-                                           ridge_factor=ridge_factor))
+    if _is_default_rbf(kernel_func_ff, kernel_func_df, kernel_func_dd):
+        K_nn, K_no, K_dn, K_oo, K_do, K_dd = rbf_pred_blocks(
+            X_new, X_obs, X_deriv, ls=ls, deriv_dims=deriv_dims)
+        K_nn = K_nn + ridge_factor * tf.eye(K_nn.shape.as_list()[0], dtype=tf.float32)
+        K_oo = K_oo + ridge_factor * tf.eye(N_obs, dtype=tf.float32)
+        K_dd = K_dd + ridge_factor * tf.eye(K_dd.shape.as_list()[0], dtype=tf.float32)
+    else:
+        K_nn = kernel_func_ff(X_new, ls=ls, ridge_factor=ridge_factor)
+
+        K_no = kernel_func_ff(X_new, X_obs, ls=ls, ridge_factor=ridge_factor)
+        K_dn = kernel_func_df(X_deriv, X_new, ls=ls, ridge_factor=ridge_factor)
 
-    K_no = tf.stop_gradient(kernel_func_ff(X_new, X_obs, ls=ls,
-                                           ridge_factor=ridge_factor))
-    K_dn = tf.stop_gradient(kernel_func_df(X_deriv, X_new, ls=ls,
-                                           ridge_factor=ridge_factor))
+        K_oo = kernel_func_ff(X_obs, ls=ls, ridge_factor=ridge_factor)
+        K_do = kernel_func_df(X_deriv, X_obs, ls=ls, ridge_factor=ridge_factor)
+        K_dd = kernel_func_dd(X_deriv, ls=ls, ridge_factor=ridge_factor)
 
-    K_oo = tf.stop_gradient(kernel_func_ff(X_obs, ls=ls,
-                                           ridge_factor=ridge_factor))
-    K_do = tf.stop_gradient(kernel_func_df(X_deriv, X_obs, ls=ls,
-                                           ridge_factor=ridge_factor))
-    K_dd = tf.stop_gradient(kernel_func_dd(X_deriv, ls=ls,
-                                           ridge_factor=ridge_factor))
+    (K_nn, K_no, K_dn,
+     K_oo, K_do, K_dd) = [tf.stop_gradient(K_mat) for K_mat in
+                          (K_nn, K_no, K_dn, K_oo, K_do, K_dd)]
 
     P_no, P_nd, Sigma_chol = inference_util.make_cond_gp_parameters(
         K_00=K_nn, K_11=K_oo, K_22=K_dd,
         K_01=K_no, K_20=K_dn, K_21=K_do,
-        ridge_factor=ridge_factor)
+        ridge_factor_K=0., ridge_factor_Sigma=0.)
 
     # compute conditional mean and variance.
     Mu = (tf.matmul(P_no, gp[:, tf.newaxis]) +
@@ -380,12 +718,18 @@ def pred_cond_prior_v1(gp, gp_deriv,
 
 def compute_pred_cond_params(X_new, X_obs, X_deriv, ls,
                              kernel_func_ff=gp.rbf,
-                             kernel_func_df=rbf_grad_1d,
-                             kernel_func_dd=rbf_hess_1d,
+                             kernel_func_df=rbf_grad,
+                             kernel_func_dd=rbf_hess,
                              ridge_factor_K=1e-3,
-                             ridge_factor_Sigma=1e-3):
+                             ridge_factor_Sigma=1e-3,
+                             deriv_dims=None):
     """Computes model parameters for prior f_pred | f_obs, f_deriv.
 
+    Results are cached on the value of (X_new, X_obs, X_deriv, ls) when these
+    are not tf.Tensors, so that repeated calls (e.g. across MCMC runs) skip
+    the kernel computation and decomposition. The returned arrays are shared
+    with the cache, hence read-only.
+
     Args:
         X_new: (tf.Tensor of float32) testing locations, (N_new, D)
         X_obs: (tf.Tensor of float32) training locations, (N_obs, D)
@@ -396,36 +740,95 @@ def compute_pred_cond_params(X_new, X_obs, X_deriv, ls,
         kernel_func_dd: (function) hessian kernel function dxdx' k(x, x')
         ridge_factor_K: (float32) ridge factor to stabilize Cholesky decomposition.
         ridge_factor_Sigma: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along, only used for RBF kernel. If None, then all D dimensions.
 
     Returns:
         P_01 (np.ndarray) Projection from f_obs to f_new
         P_02 (np.ndarray) Projection from f_deriv to f_new
         Sigma_chol (np.ndarray) Cholesky decomposition for Sigma
     """
+    cache_key = _pred_cond_cache_key(
+        X_new, X_obs, X_deriv, ls,
+        kernel_funcs=(kernel_func_ff, kernel_func_df, kernel_func_dd),
+        ridge_factors=(ridge_factor_K, ridge_factor_Sigma),
+        deriv_dims=deriv_dims)
+
+    if cache_key in _PRED_COND_PARAMS_CACHE:
+        _PRED_COND_PARAMS_CACHE.move_to_end(cache_key)
+        return _PRED_COND_PARAMS_CACHE[cache_key]
+
+    share_deriv = X_deriv is X_obs
+
     X_new = tf.convert_to_tensor(X_new, dtype=tf.float32)
     X_obs = tf.convert_to_tensor(X_obs, dtype=tf.float32)
-    X_deriv = tf.convert_to_tensor(X_deriv, dtype=tf.float32)
+    X_deriv = (X_obs if share_deriv else
+               tf.convert_to_tensor(X_deriv, dtype=tf.float32))
 
     N_obs, _ = X_obs.shape.as_list()
     N_deriv, _ = X_deriv.shape.as_list()
 
     # compute matrix components
-    K_nn = kernel_func_ff(X_new, ls=ls)
+    if _is_default_rbf(kernel_func_ff, kernel_func_df, kernel_func_dd):
+        K_nn, K_no, K_dn, K_oo, K_do, K_dd = rbf_pred_blocks(
+            X_new, X_obs, X_deriv, ls=ls, deriv_dims=deriv_dims)
+    else:
+        K_nn = kernel_func_ff(X_new, ls=ls)
 
-    K_no = kernel_func_ff(X_new, X_obs, ls=ls)
-    K_dn = kernel_func_df(X_deriv, X_new, ls=ls)
+        K_no = kernel_func_ff(X_new, X_obs, ls=ls)
+        K_dn = kernel_func_df(X_deriv, X_new, ls=ls)
 
-    K_oo = kernel_func_ff(X_obs, ls=ls)
-    K_do = kernel_func_df(X_deriv, X_obs, ls=ls)
-    K_dd = kernel_func_dd(X_deriv, ls=ls)
+        K_oo = kernel_func_ff(X_obs, ls=ls)
+        K_do = kernel_func_df(X_deriv, X_obs, ls=ls)
+        K_dd = kernel_func_dd(X_deriv, ls=ls)
 
-    return inference_util.make_cond_gp_parameters(
+    pred_cond_pars = inference_util.make_cond_gp_parameters(
         K_00=K_nn, K_11=K_oo, K_22=K_dd,
         K_01=K_no, K_20=K_dn, K_21=K_do,
         ridge_factor_K=ridge_factor_K,
         ridge_factor_Sigma=ridge_factor_Sigma
     )
 
+    if cache_key is not None:
+        # protect cached arrays against in-place modification by callers.
+        for par in pred_cond_pars:
+            par.flags.writeable = False
+
+        _PRED_COND_PARAMS_CACHE[cache_key] = pred_cond_pars
+        while len(_PRED_COND_PARAMS_CACHE) > _PRED_COND_PARAMS_CACHE_SIZE:
+            _PRED_COND_PARAMS_CACHE.popitem(last=False)
+
+    return pred_cond_pars
+
+
+def _pred_cond_cache_key(X_new, X_obs, X_deriv, ls,
+                         kernel_funcs, ridge_factors, deriv_dims=None):
+    """Returns cache key for compute_pred_cond_params, None if not cacheable.
+
+    Args:
+        X_new: (np.ndarray or tf.Tensor) testing locations, (N_new, D)
+        X_obs: (np.ndarray or tf.Tensor) training locations, (N_obs, D)
+        X_deriv: (np.ndarray or tf.Tensor) derivative locations, (N_deriv, D)
+        ls: (float32 or tf.Tensor) Length scale parameter
+        kernel_funcs: (tuple of function) Kernel functions.
+        ridge_factors: (tuple of float32) Ridge factors.
+        deriv_dims: (list of int or None) Derivative dimensions.
+
+    Returns:
+        (tuple or None) Hashable cache key.
+    """
+    inputs = (X_new, X_obs, X_deriv, ls)
+    if any(isinstance(value, (tf.Tensor, tf.Variable, ed.RandomVariable))
+           for value in inputs):
+        return None
+
+    return misc_util.make_hash_key(
+        X_new, X_obs, X_deriv,
+        np.asarray(ls, dtype=np.float32),
+        np.asarray(ridge_factors, dtype=np.float32)) + (
+               tuple(kernel_funcs),
+               None if deriv_dims is None else tuple(deriv_dims))
+
 
 def pred_cond_prior(gp, gp_deriv,
                     pred_cond_pars,
@@ -481,7 +884,8 @@ def pred_cond_prior(gp, gp_deriv,
                                      name=name)
 
 
-def model(X, X_deriv=None, ls=1., ridge_factor=1e-3):
+def model(X, X_deriv=None, ls=1., ridge_factor=1e-3, deriv_dims=None,
+          cond_params=None):
     """Defines the Gaussian Process Model with derivative random variable.
 
     Args:
@@ -491,12 +895,21 @@ def model(X, X_deriv=None, ls=1., ridge_factor=1e-3):
             constraint on shape (N_deriv, D). If None, X_deriv=X
         ls: (float32) length scale parameter.
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
+        cond_params: (tuple of tf.Tensor or None) Pre-computed
+            (K_chol, P_df, Sigma_chol) for fixed ls, see
+            compute_deriv_cond_params. If None then compute from kernels.
 
     Returns:
          (tf.Tensors of float32) model parameters.
     """
     X = tf.convert_to_tensor(X, dtype=tf.float32)
 
+    K_chol, deriv_cond_params = None, None
+    if cond_params is not None:
+        K_chol, deriv_cond_params = cond_params[0], cond_params[1:]
+
     if X_deriv is not None:
         X_deriv = tf.convert_to_tensor(X_deriv, dtype=tf.float32)
     else:
@@ -508,11 +921,14 @@ def model(X, X_deriv=None, ls=1., ridge_factor=1e-3):
         ls = tf.convert_to_tensor(ls, dtype=tf.float32)
 
     gp_f = gp.prior(X, ls, kernel_func=gp.rbf,
-                    ridge_factor=ridge_factor, name="gp_f")
+                    ridge_factor=ridge_factor, scale_tril=K_chol,
+                    name="gp_f")
     gp_f_deriv = deriv_prior(gp_f, X, X_deriv, ls,
                              kernel_func=gp.rbf,
-                             grad_func=rbf_grad_1d, hess_func=rbf_hess_1d,
-                             ridge_factor=ridge_factor, name="gp_f_deriv")
+                             grad_func=rbf_grad, hess_func=rbf_hess,
+                             ridge_factor=ridge_factor, deriv_dims=deriv_dims,
+                             cond_params=deriv_cond_params,
+                             name="gp_f_deriv")
 
     sigma = ed.Normal(loc=DEFAULT_PAR_SHIFT, scale=DEFAULT_PAR_SCALE, name='sigma')
 
@@ -524,7 +940,7 @@ def model(X, X_deriv=None, ls=1., ridge_factor=1e-3):
 
 
 def model_pred(X, X_deriv=None, X_pred=None, ls=1.,
-               pred_cond_pars=None, ridge_factor=1e-3):
+               pred_cond_pars=None, ridge_factor=1e-3, deriv_dims=None):
     """Defined Model for GP with Derivative and also predictions.
 
     Args:
@@ -538,6 +954,8 @@ def model_pred(X, X_deriv=None, X_pred=None, ls=1.,
             (P_01, P_02, Sigma_chol) for pred_cond_prior. See
             inference_util.make_cond_gp_parameters
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
 
     Returns:
          (tf.Tensors of float32) model parameters.
@@ -563,9 +981,10 @@ def model_pred(X, X_deriv=None, X_pred=None, ls=1.,
                     ridge_factor=ridge_factor, name="gp_f")
     gp_f_deriv = deriv_prior(gp_f, X, X_deriv, ls,
                              kernel_func=gp.rbf,
-                             grad_func=rbf_grad_1d,
-                             hess_func=rbf_hess_1d,
-                             ridge_factor=ridge_factor, name="gp_f_deriv")
+                             grad_func=rbf_grad,
+                             hess_func=rbf_hess,
+                             ridge_factor=ridge_factor, deriv_dims=deriv_dims,
+                             name="gp_f_deriv")
     gp_f_pred = pred_cond_prior(gp_f, gp_f_deriv,
                                 pred_cond_pars=pred_cond_pars,
                                 name="gp_f_pred")
@@ -579,6 +998,149 @@ def model_pred(X, X_deriv=None, X_pred=None, ls=1.,
     return gp_f, gp_f_pred, gp_f_deriv, sigma, y, ls
 
 
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Sparse model definition """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+"""Implements a sparse monotonic GP using inducing values and inducing derivatives.
+
+Select inducing points Z and Z_deriv, and denote the joint inducing values
+    u = [f(Z), f'(Z_deriv)] ~ N(0, K_uu), where
+
+            K_uu =  [K_zz    K'_zd ]
+                    [K'_dz   K''_dd]
+
+Then f and f' are conditionally independent given u (i.e. FITC):
+    f  | u ~ N(P_f u,  diag(K_ff - Q_ff)),   P_f = K_fu inv(K_uu)
+    f' | u ~ N(P_d u,  diag(K''_ff - Q''_ff)),  P_d = K'_fu inv(K_uu)
+
+which only involves the Cholesky factor of K_uu, therefore costs
+O((N + N_deriv) * Nu^2) with Nu = Nz + P * Nz_deriv.
+"""
+
+
+def _nystrom_projection(K_uu_chol, K_ux, K_xx_diag, ridge_factor=1e-3):
+    """Computes projection K_xu inv(K_uu) and residual diag(K_xx - Q_xx).
+
+    Args:
+        K_uu_chol: (tf.Tensor) Cholesky factor of K_uu, shape (Nu, Nu).
+        K_ux: (tf.Tensor) Cross covariance, shape (Nu, N).
+        K_xx_diag: (tf.Tensor or float) Diagonal of K_xx.
+        ridge_factor: (float32) ridge factor added to residual variance.
+
+    Returns:
+        P: (tf.Tensor) Projection K_xu inv(K_uu), shape (N, Nu).
+        D: (tf.Tensor) Residual variance, shape (N, ).
+    """
+    K_uu_chol_inv_ux = tf.matrix_triangular_solve(K_uu_chol, K_ux)
+    P = tf.transpose(tf.matrix_triangular_solve(
+        tf.transpose(K_uu_chol), K_uu_chol_inv_ux, lower=False))
+    D = tf.nn.relu(
+        K_xx_diag - tf.reduce_sum(tf.square(K_uu_chol_inv_ux), axis=0)) + ridge_factor
+    return P, D
+
+
+def sparse_cond_params(X, Z, X_deriv=None, Z_deriv=None, ls=1.,
+                       ridge_factor=1e-3, deriv_dims=None):
+    """Computes parameters of f | u and f' | u for sparse monotonic GP.
+
+    Args:
+        X: (tf.Tensor or np.ndarray) Features with dimension (N, D).
+        Z: (tf.Tensor or np.ndarray) Inducing points with dimension (Nz, D).
+        X_deriv: (tf.Tensor or None) Feature location to place derivative
+            constraint on shape (N_deriv, D). If None, X_deriv=X
+        Z_deriv: (tf.Tensor or None) Inducing points for derivative with
+            dimension (Nz_deriv, D). If None, Z_deriv=Z
+        ls: (tf.Tensor of float32) length scale parameter for RBF kernel.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+        K_uu_chol: (tf.Tensor) Cholesky factor of K_uu, shape (Nu, Nu).
+        P_f, D_f: (tf.Tensor) Projection and residual variance for f | u,
+            shape (N, Nu) and (N, ).
+        P_d, D_d: (tf.Tensor) Projection and residual variance for f' | u,
+            shape (P * N_deriv, Nu) and (P * N_deriv, ).
+    """
+    share_deriv = X_deriv is None or X_deriv is X
+    share_induce = Z_deriv is None or Z_deriv is Z
+
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    Z = tf.convert_to_tensor(Z, dtype=tf.float32)
+    X_deriv = X if share_deriv else tf.convert_to_tensor(X_deriv, dtype=tf.float32)
+    Z_deriv = Z if share_induce else tf.convert_to_tensor(Z_deriv, dtype=tf.float32)
+
+    # covariance of inducing values
+    K_zz, dK_zz, ddK_zz = rbf_joint(Z, Z_deriv, ls=ls, deriv_dims=deriv_dims)
+    K_uu = matrix_util.make_block_matrix(K_zz, tf.transpose(dK_zz), ddK_zz,
+                                         ridge_factor=ridge_factor)
+    K_uu_chol = tf.cholesky(K_uu)
+
+    # cross covariance between inducing values and f, f'
+    K_xz, _, _ = rbf_fused(X, Z, ls=ls, deriv_dims=deriv_dims)
+    _, dK_zx, _ = rbf_fused(Z_deriv, X, ls=ls, deriv_dims=deriv_dims)
+    K_ux = tf.concat([tf.transpose(K_xz), dK_zx], axis=0)
+
+    _, dK_dz, _ = rbf_fused(X_deriv, Z, ls=ls, deriv_dims=deriv_dims)
+    _, _, ddK_dz = rbf_fused(X_deriv, Z_deriv, ls=ls, deriv_dims=deriv_dims)
+    K_ud = tf.transpose(tf.concat([dK_dz, ddK_dz], axis=1))
+
+    # projection and residual, note diag(K) = 1 and diag(K'') = 1 / ls**2
+    P_f, D_f = _nystrom_projection(K_uu_chol, K_ux, 1., ridge_factor)
+    P_d, D_d = _nystrom_projection(K_uu_chol, K_ud, 1. / ls ** 2, ridge_factor)
+
+    return K_uu_chol, P_f, D_f, P_d, D_d
+
+
+def sparse_model(X, Z, X_deriv=None, Z_deriv=None, ls=1.,
+                 ridge_factor=1e-3, deriv_dims=None):
+    """Defines the sparse Gaussian Process Model with derivative random variable.
+
+    Args:
+        X: (np.ndarray of float32) input training features.
+        with dimension (N, D).
+        Z: (np.ndarray of float32) inducing points with dimension (Nz, D).
+        X_deriv: (tf.Tensor or None) Feature location to place derivative
+            constraint on shape (N_deriv, D). If None, X_deriv=X
+        Z_deriv: (tf.Tensor or None) Inducing points for derivative with
+            dimension (Nz_deriv, D). If None, Z_deriv=Z
+        ls: (float32) length scale parameter.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
+
+    Returns:
+         (tf.Tensors of float32) model parameters.
+    """
+    if ls is not None:
+        ls = ed.Normal(loc=DEFAULT_PAR_SHIFT, scale=DEFAULT_PAR_SCALE, name='ls')
+    else:
+        ls = tf.convert_to_tensor(ls, dtype=tf.float32)
+
+    K_uu_chol, P_f, D_f, P_d, D_d = sparse_cond_params(
+        X, Z, X_deriv, Z_deriv, ls=ls,
+        ridge_factor=ridge_factor, deriv_dims=deriv_dims)
+
+    gp_u = ed.MultivariateNormalTriL(loc=tf.zeros(K_uu_chol.shape.as_list()[0]),
+                                     scale_tril=K_uu_chol,
+                                     name="gp_u")
+    gp_f = ed.MultivariateNormalDiag(loc=tf.tensordot(P_f, gp_u, [[1], [0]]),
+                                     scale_diag=tf.sqrt(D_f),
+                                     name="gp_f")
+    gp_f_deriv = ed.MultivariateNormalDiag(loc=tf.tensordot(P_d, gp_u, [[1], [0]]),
+                                           scale_diag=tf.sqrt(D_d),
+                                           name="gp_f_deriv")
+
+    sigma = ed.Normal(loc=DEFAULT_PAR_SHIFT, scale=DEFAULT_PAR_SCALE, name='sigma')
+
+    y = ed.MultivariateNormalDiag(loc=gp_f,
+                                  scale_identity_multiplier=tf.exp(sigma),
+                                  name="y")
+
+    return gp_u, gp_f, gp_f_deriv, sigma, y, ls
+
+
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 """ Model likelihood function for MCMC and VI """
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -587,7 +1149,8 @@ def model_pred(X, X_deriv=None, X_pred=None, ls=1.,
 def make_log_likelihood_function(X_train, X_deriv,
                                  y_train, ls=None,
                                  ridge_factor=5e-3, deriv_prior_scale=1e-3,
-                                 cdf_constraint=False):
+                                 cdf_constraint=False, precompute_cond=False,
+                                 deriv_dims=None):
     """Makes log joint likelihood function for monotonic GP regression.
 
     To be used for MCMC sampling.
@@ -605,6 +1168,13 @@ def make_log_likelihood_function(X_train, X_deriv,
             f_deriv. For detail, see [2].
         cdf_constraint: (bool) Whether to impose cdf constraint
             (i.e. f < 0 and f > 1).
+        precompute_cond: (bool) Whether to pre-compute the Cholesky factors
+            and projection of the priors of f and f' | f as constants
+            when ls is fixed, see compute_deriv_cond_params. The log joint
+            then only involves triangular solves and matrix-vector products.
+            Ignored if ls is None.
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
 
     Returns:
         (function) A log-joint probability function.
@@ -617,6 +1187,14 @@ def make_log_likelihood_function(X_train, X_deriv,
     if not ls:
         model_var_names += ["ls"]
 
+    cond_params = None
+    if ls and precompute_cond:
+        cond_params = [
+            tf.constant(cond_param, dtype=tf.float32) for cond_param in
+            compute_deriv_cond_params(X_train, X_deriv, ls=ls,
+                                      ridge_factor=ridge_factor,
+                                      deriv_dims=deriv_dims)]
+
     log_joint = ed.make_log_joint_fn(model)
 
     def target_log_prob_fn(*model_var_positional_args):
@@ -630,43 +1208,124 @@ def make_log_likelihood_function(X_train, X_deriv,
         if "ls" not in model_var_kwargs.keys():
             model_var_kwargs["ls"] = ls
 
-        # the probit likelihood on derivative
-        log_lkhd_constraint = tfd.Normal(
-            loc=DEFAULT_CDF_CENTER, scale=deriv_prior_scale).log_cdf(
-            model_var_kwargs["gp_f_deriv"])
+        log_lkhd_constraint = _constraint_log_likelihood(
+            model_var_kwargs["gp_f"], model_var_kwargs["gp_f_deriv"],
+            deriv_prior_scale=deriv_prior_scale,
+            cdf_constraint=cdf_constraint)
 
-        if cdf_constraint:
-            # constraint 1: f > 0
-            log_lkhd_constraint_ge_zero = tfd.Normal(
-                loc=DEFAULT_CDF_CENTER, scale=deriv_prior_scale).log_cdf(
-                model_var_kwargs["gp_f"])
+        log_joint_rest = log_joint(
+            X=X_train, X_deriv=X_deriv, y=y_train,
+            ridge_factor=ridge_factor, deriv_dims=deriv_dims,
+            cond_params=cond_params, **model_var_kwargs)
+        return tf.reduce_mean(log_lkhd_constraint) + log_joint_rest
 
-            # constraint 2: f < 1
-            log_lkhd_constraint_le_one = tfd.Normal(
-                loc=DEFAULT_CDF_CENTER, scale=deriv_prior_scale).log_cdf(
-                1 - model_var_kwargs["gp_f"])
+    return target_log_prob_fn
 
-            log_lkhd_constraint = tf.concat([
-                log_lkhd_constraint,
-                log_lkhd_constraint_ge_zero,
-                log_lkhd_constraint_le_one,
-            ], axis=0)
+
+def make_sparse_log_likelihood_function(X_train, X_deriv, Z, Z_deriv,
+                                        y_train, ls=None,
+                                        ridge_factor=5e-3, deriv_prior_scale=1e-3,
+                                        cdf_constraint=False, deriv_dims=None):
+    """Makes log joint likelihood function for sparse monotonic GP regression.
+
+    To be used for MCMC sampling. See `sparse_model`.
+
+    Args:
+        X_train: (tf.Tensor) Training samples, shape (N_obs, D)
+        X_deriv: (tf.Tensor) Locations of derivative constraints,
+            shape (N_deriv, D)
+        Z: (tf.Tensor) Inducing points, shape (Nz, D)
+        Z_deriv: (tf.Tensor or None) Inducing points for derivative,
+            shape (Nz_deriv, D). If None, Z_deriv=Z
+        y_train: (tf.Tensor) Training labels, shape (N_obs, )
+        ls: (tf.Tensor or None) Value of length scale parameter,
+            if None then will be added to the likelihood function.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_prior_scale: (float32) Value for Prior scale parameter for
+            probit likelihood function imposing positivity contraint on
+            f_deriv. For detail, see [2].
+        cdf_constraint: (bool) Whether to impose cdf constraint
+            (i.e. f < 0 and f > 1).
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
+
+    Returns:
+        (function) A log-joint probability function.
+            Its inputs are `sparse_model`'s parameters, and output the model's
+            un-normalized log likelihood (a scalar tf.Tensor).
+
+    """
+    model_var_names = ["gp_u", "gp_f", "gp_f_deriv", "sigma"]
+
+    if ls is None:
+        model_var_names += ["ls"]
+
+    log_joint = ed.make_log_joint_fn(sparse_model)
+
+    def target_log_prob_fn(*model_var_positional_args):
+        """Unnormalized target density as a function of states."""
+        model_var_kwargs = dict(zip(model_var_names,
+                                    model_var_positional_args))
+
+        if "ls" not in model_var_kwargs.keys():
+            model_var_kwargs["ls"] = ls
+
+        log_lkhd_constraint = _constraint_log_likelihood(
+            model_var_kwargs["gp_f"], model_var_kwargs["gp_f_deriv"],
+            deriv_prior_scale=deriv_prior_scale,
+            cdf_constraint=cdf_constraint)
 
         log_joint_rest = log_joint(
-            X=X_train, X_deriv=X_deriv, y=y_train,
-            ridge_factor=ridge_factor,
+            X=X_train, Z=Z, X_deriv=X_deriv, Z_deriv=Z_deriv, y=y_train,
+            ridge_factor=ridge_factor, deriv_dims=deriv_dims,
             **model_var_kwargs)
         return tf.reduce_mean(log_lkhd_constraint) + log_joint_rest
 
     return target_log_prob_fn
 
 
+def _constraint_log_likelihood(gp_f, gp_f_deriv,
+                               deriv_prior_scale=1e-3, cdf_constraint=False):
+    """Computes probit log likelihood for derivative (and cdf) constraints.
+
+    Args:
+        gp_f: (tf.Tensor) Function values, shape (N_obs, ).
+        gp_f_deriv: (tf.Tensor) Derivative values, shape (N_deriv, ).
+        deriv_prior_scale: (float32) Prior scale parameter for probit likelihood.
+        cdf_constraint: (bool) Whether to impose cdf constraint
+            (i.e. f < 0 and f > 1).
+
+    Returns:
+        (tf.Tensor) Element-wise constraint log likelihood.
+    """
+    # the probit likelihood on derivative
+    log_lkhd_constraint = tfd.Normal(
+        loc=DEFAULT_CDF_CENTER, scale=deriv_prior_scale).log_cdf(gp_f_deriv)
+
+    if cdf_constraint:
+        # constraint 1: f > 0
+        log_lkhd_constraint_ge_zero = tfd.Normal(
+            loc=DEFAULT_CDF_CENTER, scale=deriv_prior_scale).log_cdf(gp_f)
+
+        # constraint 2: f < 1
+        log_lkhd_constraint_le_one = tfd.Normal(
+            loc=DEFAULT_CDF_CENTER, scale=deriv_prior_scale).log_cdf(1 - gp_f)
+
+        log_lkhd_constraint = tf.concat([
+            log_lkhd_constraint,
+            log_lkhd_constraint_ge_zero,
+            log_lkhd_constraint_le_one,
+        ], axis=0)
+
+    return log_lkhd_constraint
+
+
 def make_log_likelihood_function_with_pred(
         X_train, X_deriv, X_pred,
         y_train, ls=None, pred_cond_pars=None,
         ridge_factor=5e-3,
         deriv_prior_scale=1e-3,
-        cdf_constraint=False):
+        cdf_constraint=False, deriv_dims=None):
     """Makes log joint likelihood function for monotonic GP regression.
 
     To be used for MCMC sampling.
@@ -688,6 +1347,8 @@ def make_log_likelihood_function_with_pred(
             f_deriv. For detail, see [2].
         cdf_constraint: (bool) Whether to impose cdf constraint
             (i.e. f < 0 and f > 1).
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
 
     Returns:
         (function) A log-joint probability function.
@@ -753,6 +1414,7 @@ def make_log_likelihood_function_with_pred(
             y=y_train,
             ridge_factor=ridge_factor,
             pred_cond_pars=pred_cond_pars,
+            deriv_dims=deriv_dims,
             **model_var_kwargs)
         return tf.reduce_mean(log_lkhd_constraint) + log_joint_rest
 
@@ -817,9 +1479,10 @@ def make_log_likelihood_tensor(gp_f, gp_f_deriv,
 def sample_posterior_predictive(X_new, X_obs, X_deriv,
                                 f_sample, f_deriv_sample,
                                 kernel_func_ff=gp.rbf,
-                                kernel_func_df=rbf_grad_1d,
-                                kernel_func_dd=rbf_hess_1d,
-                                ls=None, ridge_factor=1e-3):
+                                kernel_func_df=rbf_grad,
+                                kernel_func_dd=rbf_hess,
+                                ls=None, ridge_factor=1e-3,
+                                deriv_dims=None):
     """Sample posterior predictive of f based on f_train and f_derive.
 
     The full joint likelihood of f_new (f_0), f_obs (f_1), f_deriv (f_2) is:
@@ -844,6 +1507,9 @@ def sample_posterior_predictive(X_new, X_obs, X_deriv,
         Mu = K_n_od * inv(K_odod) * [f_o, f_d]^T
         Sigma = K_nn - K_n_od * inv(K_odod) * K_n_od^T
 
+    Both are computed by triangular solves against the Cholesky factor of K_odod,
+    then all samples are drawn through one Cholesky decomposition of Sigma.
+
     Args:
         X_new: (tf.Tensor of float32) testing locations, (N_new, D)
         X_obs: (tf.Tensor of float32) training locations, (N_obs, D)
@@ -857,6 +1523,10 @@ def sample_posterior_predictive(X_new, X_obs, X_deriv,
         kernel_func_dd: (function) hessian kernel function dxdx' k(x, x')
         ls: (float32) Length scale parameter
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along, only used for RBF kernel. If None, then all D dimensions.
+            f_deriv_sample stacks derivatives along each dimension, i.e. has
+            shape (P * N_deriv, N_sample).
 
     Returns:
          (tf.Tensor of float32) N_new x N_sample vectors of posterior
@@ -865,9 +1535,12 @@ def sample_posterior_predictive(X_new, X_obs, X_deriv,
     Raises:
         (ValueError) If length scale parameter is not provided.
     """
+    share_deriv = X_deriv is X_obs
+
     X_new = tf.convert_to_tensor(X_new, dtype=tf.float32)
     X_obs = tf.convert_to_tensor(X_obs, dtype=tf.float32)
-    X_deriv = tf.convert_to_tensor(X_deriv, dtype=tf.float32)
+    X_deriv = (X_obs if share_deriv else
+               tf.convert_to_tensor(X_deriv, dtype=tf.float32))
 
     f_sample = tf.convert_to_tensor(f_sample, dtype=tf.float32)
     f_deriv_sample = tf.convert_to_tensor(f_deriv_sample, dtype=tf.float32)
@@ -887,46 +1560,291 @@ def sample_posterior_predictive(X_new, X_obs, X_deriv,
         raise ValueError('Length scale parameter ("ls") must be provided.')
 
     # compute matrix components
-    K_nn = kernel_func_ff(X_new, ls=ls)
+    if _is_default_rbf(kernel_func_ff, kernel_func_df, kernel_func_dd):
+        K_nn, K_no, K_dn, K_oo, K_do, K_dd = rbf_pred_blocks(
+            X_new, X_obs, X_deriv, ls=ls, deriv_dims=deriv_dims)
+    else:
+        K_nn = kernel_func_ff(X_new, ls=ls)
+
+        K_no = kernel_func_ff(X_new, X_obs, ls=ls)
+        K_dn = kernel_func_df(X_deriv, X_new, ls=ls)
+
+        K_oo = kernel_func_ff(X_obs, ls=ls)
+        K_do = kernel_func_df(X_deriv, X_obs, ls=ls)
+        K_dd = kernel_func_dd(X_deriv, ls=ls)
+
+    # assemble joint covariance of [f_obs, f_deriv], and cross covariance with f_new
+    K_odod = matrix_util.make_block_matrix(K_oo, tf.transpose(K_do), K_dd,
+                                           ridge_factor=ridge_factor)
+    K_od_n = tf.concat([tf.transpose(K_no), K_dn], axis=0)
+    f_all_sample = tf.concat([f_sample, f_deriv_sample], axis=0)
 
-    K_no = kernel_func_ff(X_new, X_obs, ls=ls)
-    K_dn = kernel_func_df(X_deriv, X_new, ls=ls)
+    with tf.Session() as sess:
+        K_odod_val, K_od_n_val, K_nn_val, f_all_val = sess.run(
+            [K_odod, K_od_n, K_nn, f_all_sample])
 
-    K_oo = kernel_func_ff(X_obs, ls=ls)
-    K_do = kernel_func_df(X_deriv, X_obs, ls=ls)
-    K_dd = kernel_func_dd(X_deriv, ls=ls)
+    # compute conditional mean and variance using Cholesky factor of K_odod.
+    K_odod_chol = matrix_util.cholesky_jitter(K_odod_val)
+    cond_means, cond_cov = matrix_util.gaussian_conditional(
+        K_odod_chol, K_xn=K_od_n_val.astype(np.float64),
+        K_nn=K_nn_val, f_sample=f_all_val.astype(np.float64))
 
-    K_oo_inv_od = tf.linalg.solve(K_oo, tf.transpose(K_do))
-    K_dd_inv_do = tf.linalg.solve(K_dd, K_do)
+    # sample
+    f_new = matrix_util.sample_gaussian_chol(cond_means, cond_cov)
+    return f_new.astype(np.float32)
 
-    # assemble projection matrix
-    K_nd_o = tf.transpose(K_dn) - tf.matmul(K_no, K_oo_inv_od)
-    K_dd_o = K_dd - tf.matmul(K_do, K_oo_inv_od)
-    K_no_d = K_no - tf.matmul(K_dn, K_dd_inv_do, transpose_a=True)
-    K_oo_d = K_oo - tf.matmul(K_do, K_dd_inv_do, transpose_a=True)
 
-    K_oo_d_inv = tf.matrix_inverse(K_oo_d)
-    K_dd_o_inv = tf.matrix_inverse(
-        K_dd_o + ridge_factor * tf.eye(N_deriv, dtype=tf.float32))
+def sample_posterior_predictive_sparse(X_new, Z, Z_deriv, u_sample,
+                                       ls=None, ridge_factor=1e-3,
+                                       deriv_dims=None):
+    """Sample posterior predictive of f based on samples of inducing values.
 
-    P_no = tf.matmul(K_no_d, K_oo_d_inv)
-    P_nd = tf.matmul(K_nd_o, K_dd_o_inv)
+    Under the sparse model (see `sparse_model`), f_new is conditionally
+    independent of (f_obs, f_deriv) given u, therefore:
 
-    # compute conditional mean and variance.
-    mu_sample = tf.matmul(P_no, f_sample) + tf.matmul(P_nd, f_deriv_sample)
-    Sigma = (K_nn -
-             tf.matmul(P_no, K_no, transpose_b=True) + tf.matmul(P_nd, K_dn))
+        f_new | u ~ N(P_new * u, diag(K_nn - Q_nn))
+
+    which costs O(N_new * Nu^2) instead of O((N_obs + N_deriv)^3).
+
+    Args:
+        X_new: (tf.Tensor of float32) testing locations, (N_new, D)
+        Z: (tf.Tensor of float32) inducing points, (Nz, D)
+        Z_deriv: (tf.Tensor of float32 or None) inducing points for
+            derivative, (Nz_deriv, D). If None, Z_deriv=Z
+        u_sample: (tf.Tensor of float32) Samples for inducing values u,
+            (Nu, N_sample)
+        ls: (float32) Length scale parameter
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions to take derivative
+            along. If None, then all D dimensions.
+
+    Returns:
+         (np.ndarray of float32) N_new x N_sample vectors of posterior
+            predictive samples.
+
+    Raises:
+        (ValueError) If length scale parameter is not provided.
+    """
+    if not ls:
+        raise ValueError('Length scale parameter ("ls") must be provided.')
+
+    X_new = tf.convert_to_tensor(X_new, dtype=tf.float32)
+    u_sample = tf.convert_to_tensor(u_sample, dtype=tf.float32)
+
+    _, P_new, D_new, _, _ = sparse_cond_params(
+        X_new, Z, X_new, Z_deriv, ls=ls,
+        ridge_factor=ridge_factor, deriv_dims=deriv_dims)
 
-    # sample
     with tf.Session() as sess:
-        cond_means, cond_cov = sess.run([mu_sample, Sigma])
+        P_new_val, D_new_val, u_val = sess.run([P_new, D_new, u_sample])
 
-    f_new_centered = np.random.multivariate_normal(
-        mean=[0] * N_new, cov=cond_cov, size=N_sample).T
-    f_new = f_new_centered + cond_means
+    # sample
+    cond_means = np.dot(P_new_val, u_val)
+    f_new = cond_means + (np.sqrt(D_new_val)[:, None] *
+                          np.random.normal(size=cond_means.shape))
     return f_new.astype(np.float32)
 
 
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Active-set derivative constraints """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+"""Adaptively places derivative constraints where monotonicity is at risk.
+
+Each derivative location adds P rows and columns to the joint covariance,
+yet most locations in a dense X_deriv grid are far from violating f' > 0.
+The active-set procedure therefore starts from a coarse X_deriv, and
+alternates between:
+
+    1. fitting the model with the current X_deriv,
+    2. computing P(f' < 0 | f_obs, f_deriv) on a dense candidate grid,
+    3. adding the candidates whose violation probability exceeds a threshold,
+
+until no candidate is at risk, so that N_deriv stays small.
+"""
+
+
+def deriv_violation_prob(X_cand, X_obs, X_deriv,
+                         f_sample, f_deriv_sample,
+                         ls=None, ridge_factor=1e-3, deriv_dims=None):
+    """Computes posterior probability of f' < 0 at candidate locations.
+
+    For each posterior sample of (f_obs, f_deriv), f'_cand is Gaussian with
+    mean Mu_s and sample-independent variance Sigma (same notation as
+    `sample_posterior_predictive`), therefore the violation probability
+    is estimated without sampling f'_cand as:
+
+        P(f'_cand < 0) = mean_s Phi(- Mu_s / sqrt(diag(Sigma)))
+
+    Args:
+        X_cand: (np.ndarray of float32) candidate locations, (N_cand, D)
+        X_obs: (np.ndarray of float32) training locations, (N_obs, D)
+        X_deriv: (np.ndarray of float32) current derivative locations,
+            (N_deriv, D)
+        f_sample: (np.ndarray of float32) Samples for f in training set,
+            (N_obs, N_sample)
+        f_deriv_sample: (np.ndarray of float32) Samples for f_deriv,
+            (P * N_deriv, N_sample)
+        ls: (float32) Length scale parameter
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
+
+    Returns:
+        (np.ndarray of float32) Violation probability for each candidate
+            location, maximized over derivative dimensions, shape (N_cand, ).
+
+    Raises:
+        (ValueError) If length scale parameter is not provided.
+    """
+    if not ls:
+        raise ValueError('Length scale parameter ("ls") must be provided.')
+
+    share_deriv = X_deriv is X_obs
+
+    X_cand = tf.convert_to_tensor(X_cand, dtype=tf.float32)
+    X_obs = tf.convert_to_tensor(X_obs, dtype=tf.float32)
+    X_deriv = (X_obs if share_deriv else
+               tf.convert_to_tensor(X_deriv, dtype=tf.float32))
+
+    N_cand, _ = X_cand.shape.as_list()
+    num_dims = len(_check_deriv_dims(X_cand, deriv_dims))
+
+    # compute matrix components, note diag(K'') = 1 / ls**2
+    K_oo, K_do, K_dd = rbf_joint(X_obs, X_deriv, ls=ls, deriv_dims=deriv_dims)
+    _, dK_co, _ = rbf_fused(X_cand, X_obs, ls=ls, deriv_dims=deriv_dims)
+    _, _, ddK_cd = rbf_fused(X_cand, X_deriv, ls=ls, deriv_dims=deriv_dims)
+    ddK_cc = tf.fill([num_dims * N_cand], 1. / ls ** 2)
+
+    K_odod = matrix_util.make_block_matrix(K_oo, tf.transpose(K_do), K_dd,
+                                           ridge_factor=ridge_factor)
+    K_od_c = tf.concat([tf.transpose(dK_co), tf.transpose(ddK_cd)], axis=0)
+
+    with tf.Session() as sess:
+        K_odod_val, K_od_c_val, K_cc_diag_val = sess.run(
+            [K_odod, K_od_c, ddK_cc])
+
+    # conditional mean for each sample, and (shared) conditional variance
+    f_all_val = np.concatenate([f_sample, f_deriv_sample],
+                               axis=0).astype(np.float64)
+    K_odod_chol = matrix_util.cholesky_jitter(K_odod_val)
+    A = linalg.solve_triangular(K_odod_chol, K_od_c_val.astype(np.float64),
+                                lower=True)
+    cond_means = np.matmul(
+        A.T, linalg.solve_triangular(K_odod_chol, f_all_val, lower=True))
+    cond_sd = np.sqrt(np.maximum(K_cc_diag_val - np.sum(A ** 2, axis=0), 0.)
+                      + ridge_factor)
+
+    violation_prob = np.mean(
+        stats.norm.cdf(-cond_means / cond_sd[:, np.newaxis]), axis=1)
+
+    # maximize over derivative dimensions
+    violation_prob = np.max(violation_prob.reshape(-1, N_cand), axis=0)
+    return violation_prob.astype(np.float32)
+
+
+def update_active_set(X_deriv, X_cand, violation_prob,
+                      prob_threshold=DEFAULT_ACTIVE_SET_PROB_THRESHOLD,
+                      max_new_points=DEFAULT_ACTIVE_SET_MAX_NEW_POINTS):
+    """Adds candidate locations at risk of violating monotonicity to X_deriv.
+
+    Args:
+        X_deriv: (np.ndarray of float32) current derivative locations,
+            (N_deriv, D)
+        X_cand: (np.ndarray of float32) candidate locations, (N_cand, D)
+        violation_prob: (np.ndarray of float32) P(f' < 0) at each candidate
+            location, (N_cand, ). See `deriv_violation_prob`.
+        prob_threshold: (float) Minimal violation probability for a
+            candidate to be added.
+        max_new_points: (int or None) Maximum number of locations to add,
+            the ones with highest violation probability are added first.
+            If None then all qualifying candidates are added.
+
+    Returns:
+        X_deriv_new: (np.ndarray of float32) updated derivative locations,
+            (N_deriv + N_add, D)
+        N_add: (int) Number of added locations.
+    """
+    X_deriv = np.asarray(X_deriv, dtype=np.float32)
+    X_cand = np.asarray(X_cand, dtype=np.float32)
+
+    # skip candidates already in the active set
+    is_active = np.any(
+        np.all(np.isclose(X_cand[:, np.newaxis], X_deriv[np.newaxis]),
+               axis=-1), axis=-1)
+
+    cand_id = np.where((violation_prob > prob_threshold) & ~is_active)[0]
+    cand_id = cand_id[np.argsort(-violation_prob[cand_id])][:max_new_points]
+
+    X_deriv_new = np.concatenate([X_deriv, X_cand[cand_id]], axis=0)
+    return X_deriv_new, len(cand_id)
+
+
+def fit_active_set(fit_func, X_obs, X_deriv_init, X_cand, ls,
+                   prob_threshold=DEFAULT_ACTIVE_SET_PROB_THRESHOLD,
+                   max_new_points=DEFAULT_ACTIVE_SET_MAX_NEW_POINTS,
+                   max_iter=DEFAULT_ACTIVE_SET_MAX_ITER,
+                   ridge_factor=1e-3, deriv_dims=None, verbose=True):
+    """Fits monotonic GP while adaptively growing derivative constraints.
+
+    Args:
+        fit_func: (function) Fits the model for a given X_deriv, with
+            signature fit_func(X_deriv) -> (f_sample, f_deriv_sample),
+            where samples are of shape (N_sample, N_obs) and
+            (N_sample, P * N_deriv) (i.e. as returned by
+            tfp.mcmc.sample_chain with `make_log_likelihood_function`).
+        X_obs: (np.ndarray of float32) training locations, (N_obs, D)
+        X_deriv_init: (np.ndarray of float32) initial (coarse) derivative
+            locations, (N_deriv_init, D)
+        X_cand: (np.ndarray of float32) candidate locations, (N_cand, D)
+        ls: (float32) Length scale parameter
+        prob_threshold: (float) Minimal violation probability for a
+            candidate to be added.
+        max_new_points: (int or None) Maximum number of locations to add
+            per iteration.
+        max_iter: (int) Maximum number of refits.
+        ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
+        verbose: (bool) Whether to print progress.
+
+    Returns:
+        X_deriv: (np.ndarray of float32) final derivative locations.
+        f_sample: (np.ndarray of float32) Samples for f from final fit,
+            (N_sample, N_obs)
+        f_deriv_sample: (np.ndarray of float32) Samples for f_deriv from
+            final fit, (N_sample, P * N_deriv)
+    """
+    X_deriv = np.asarray(X_deriv_init, dtype=np.float32)
+
+    for iter_id in range(max_iter):
+        f_sample, f_deriv_sample = fit_func(X_deriv)
+
+        violation_prob = deriv_violation_prob(
+            X_cand, X_obs, X_deriv,
+            f_sample=np.asarray(f_sample).T,
+            f_deriv_sample=np.asarray(f_deriv_sample).T,
+            ls=ls, ridge_factor=ridge_factor, deriv_dims=deriv_dims)
+
+        X_deriv, N_add = update_active_set(
+            X_deriv, X_cand, violation_prob,
+            prob_threshold=prob_threshold,
+            max_new_points=max_new_points)
+
+        if verbose:
+            print("Active set iter {}: max violation prob {:.4f}, "
+                  "{} locations added, N_deriv={}".format(
+                iter_id, np.max(violation_prob), N_add, X_deriv.shape[0]))
+
+        if N_add == 0:
+            break
+    else:
+        # refit with the final active set.
+        f_sample, f_deriv_sample = fit_func(X_deriv)
+
+    return X_deriv, f_sample, f_deriv_sample
+
+
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
 """ Variational family I: Mean field """
 """"""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
@@ -934,9 +1852,10 @@ def sample_posterior_predictive(X_new, X_obs, X_deriv,
 
 def variational_mfvi(X, X_deriv=None, ls=1.,
                      kernel_func=gp.rbf,
-                     grad_func=rbf_grad_1d,
-                     hess_func=rbf_hess_1d,
-                     ridge_factor=1e-3):
+                     grad_func=rbf_grad,
+                     hess_func=rbf_hess,
+                     ridge_factor=1e-3,
+                     deriv_dims=None):
     """Defines the mean-field variational family for GPR.
 
     Approximate with independent, fully-factorized Gaussian RVs,
@@ -954,31 +1873,54 @@ def variational_mfvi(X, X_deriv=None, ls=1.,
         grad_func: (function) Gradient kernel function for kernel_func
         hess_func: (function) Hessian kernel function for kernel_func
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
+        deriv_dims: (list of int or None) P input dimensions to take derivative
+            along, only used for the (multi-dimensional) RBF kernel.
+            If None, then all D dimensions.
 
     Returns:
         q_f, q_f_deriv, q_sig:
             (ed.RandomVariable) variational family.
         q_f_mean, q_f_sdev, qf_deriv_mean, qf_deriv_sdev:
-            (tf.Variable) variational parameters for q_f
+            (tf.Variable) variational parameters for q_f, where
+            qf_deriv_mean, qf_deriv_sdev have shape (P * Nd, ).
 
     Raises:
         (ValueError) If Feature dimension of X and X_deriv are not same.
+        (ValueError) If 1D kernels rbf_grad_1d / rbf_hess_1d are used
+            for X with more than one feature dimension.
     """
+    if X_deriv is None:
+        X_deriv = X
+
     N, D = X.shape
     Nd, Dd = X_deriv.shape
 
     if D != Dd:
         raise ValueError("Feature dimension of X and X_deriv must be same!")
 
+    share_deriv = X_deriv is X
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    X_deriv = X if share_deriv else tf.convert_to_tensor(X_deriv, dtype=tf.float32)
+
     # compute basic components
-    dK = grad_func(X_deriv, X, ls=ls)
-    ddK = hess_func(X_deriv, ls=ls, ridge_factor=ridge_factor)
+    if grad_func is rbf_grad_1d or hess_func is rbf_hess_1d:
+        # explicit 1D kernels, which check the feature dimension of X.
+        dK = grad_func(X_deriv, X, ls=ls)
+        ddK = hess_func(X_deriv, ls=ls, ridge_factor=ridge_factor)
+    elif _is_default_rbf(kernel_func, grad_func, hess_func):
+        _, dK, ddK = rbf_joint(X, X_deriv, ls=ls, ridge_factor=ridge_factor,
+                               deriv_dims=deriv_dims)
+    else:
+        dK = grad_func(X_deriv, X, ls=ls)
+        ddK = hess_func(X_deriv, ls=ls, ridge_factor=ridge_factor)
     ddK_inv = tf.matrix_inverse(ddK)
 
-    # define variational parameters
-    qf_deriv_mean = tf.get_variable(shape=[Nd],
+    # define variational parameters, one per derivative dimension and location.
+    N_deriv_all = ddK.shape.as_list()[0]
+
+    qf_deriv_mean = tf.get_variable(shape=[N_deriv_all],
                                     name='qf_deriv_mean')
-    qf_deriv_sdev = tf.exp(tf.get_variable(shape=[Nd],
+    qf_deriv_sdev = tf.exp(tf.get_variable(shape=[N_deriv_all],
                                            name='qf_deriv_sdev'))
 
     qf_mean = tf.squeeze(tf.matmul(
@@ -1010,14 +1952,17 @@ variational_mfvi_sample = gpr.variational_mfvi_sample
 def variational_sgpr(X, Z, ls,
                      X_deriv=None, Z_deriv=None,
                      kern_func=gp.rbf,
-                     grad_func=rbf_grad_1d,
-                     hess_func=rbf_hess_1d,
-                     ridge_factor=1e-3):
-    """Defines the mean-field variational family for GPR.
-
-    f_deriv: Both Mu and Cov approximated using sparse GP
-    f: Mu is approximated using conditional mean wrt f_deriv,
-       Cov is approximated using sparse GP.
+                     grad_func=rbf_grad,
+                     hess_func=rbf_hess,
+                     ridge_factor=1e-3,
+                     deriv_dims=None):
+    """Defines the sparse variational family for monotonic GPR.
+
+    Both f and f_deriv are conditioned on the joint inducing values
+    u = [f(Z), f'(Z_deriv)], with q(u) = MVN(m, L L^T). The marginal
+    q(f) and q(f_deriv) are then represented in low-rank-plus-diagonal form
+    (see sparse_cond_params), and KL(q(f) || p(f)) is evaluated as
+    KL(q(u) || p(u)). All computations are O((Nx + N_deriv) * Nu^2).
 
     Args:
         X: (np.ndarray of float32) input training features, with dimension (Nx, D).
@@ -1031,15 +1976,20 @@ def variational_sgpr(X, Z, ls,
         grad_func: (function) Gradient kernel function for kernel_func
         hess_func: (function) Hessian kernel function for kernel_func
         ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition
+        deriv_dims: (list of int or None) Input dimensions along which f is
+            monotone. If None, then all D dimensions.
 
     Returns:
         q_f, q_f_deriv, q_sig:
             (ed.RandomVariable) variational family.
         Mu_f, Sigma_f, Mu_df, Sigma_df:
-            (tf.Variable) variational parameters for q_f and q_f_deriv
-            
+            (tf.Variable) variational parameters for q_f and q_f_deriv,
+            with Sigma_f, Sigma_df in low-rank-plus-diagonal form
+            (cov_diag, cov_factor).
+
     Raises:
         (ValueError) If Feature dimension of X / X_deriv / Z are not same.
+        (ValueError) If kernel functions are not RBF kernel and its derivatives.
     """
     if X_deriv is None:
         X_deriv = X
@@ -1055,49 +2005,44 @@ def variational_sgpr(X, Z, ls,
         raise ValueError("Feature dimension of Z, X_deriv, Z_deriv "
                          "must be same as X!")
 
-    # 1. Define variational parameters
+    if not _is_default_rbf(kern_func, grad_func, hess_func):
+        raise ValueError("Sparse monotonic GP only supports RBF kernel.")
+
+    # 1. Define sparse GP parameters
+    K_uu_chol, P_f, D_f, P_df, D_df = sparse_cond_params(
+        X, Z, X_deriv, Z_deriv, ls=ls,
+        ridge_factor=ridge_factor, deriv_dims=deriv_dims)
+    Nu = K_uu_chol.shape.as_list()[0]
+
+    # 2. Define variational parameters
     # define mean and variance for sigma
     q_sig_mean = tf.get_variable(shape=[], name='q_sig_mean')
     q_sig_sdev = tf.exp(tf.get_variable(shape=[], name='q_sig_sdev'))
 
-    # define mean and cov for latent gp_deriv
-    m_df = tf.get_variable(shape=[Ndz], name='qf_deriv_m')
-
-    s_df = tf.get_variable(shape=[Ndz * (Ndz + 1) / 2], name='qf_deriv_s')
-    L_df = fill_triangular(s_df, name='qf_deriv_chol')
-    S_df = tf.matmul(L_df, L_df, transpose_b=True)
-
-    # define cov for latent gp_deriv
-    s_f = tf.get_variable(shape=[Nxz * (Nxz + 1) / 2], name='qf_s')
-    L_f = fill_triangular(s_f, name='qf_chol')
-    S_f = tf.matmul(L_f, L_f, transpose_b=True)
+    # define mean and cov for joint inducing values [f, f_deriv]
+    m_u = tf.get_variable(shape=[Nu], name='qu_m')
+    s_u = tf.get_variable(shape=[Nu * (Nu + 1) / 2], name='qu_s')
+    L_u = fill_triangular(s_u, name='qu_chol')
 
-    # 2. Define sparse GP parameters
-    # parameters for observed f_deriv
-    Mu_df, Sigma_df = inference_util.make_sparse_gp_parameters(
-        m_df, S_df, X_deriv, Z_deriv, ls=ls,
-        kern_func=hess_func,
-        mean_name='qf_deriv_mean')
+    # parameters for observed f and f_deriv
+    Mu_f = tf.tensordot(P_f, m_u, [[1], [0]], name='qf_mean')
+    Mu_df = tf.tensordot(P_df, m_u, [[1], [0]], name='qf_deriv_mean')
 
-    # parameters for observed f
-    dK = grad_func(X_deriv, X, ls=ls)
-    ddK = hess_func(X_deriv, ls=ls, ridge_factor=ridge_factor)
-    ddK_inv = tf.matrix_inverse(ddK)
-
-    Mu_f = tf.squeeze(tf.matmul(
-        dK, tf.matmul(ddK_inv, tf.expand_dims(Mu_df, -1)),
-        transpose_a=True, name='qf_mean'))
-    _, Sigma_f = inference_util.make_sparse_gp_parameters(
-        None, S_f, X, Z, ls=ls,
-        kern_func=gp.rbf, compute_mean=False)
+    Sigma_f = (D_f, tf.matmul(P_f, L_u))
+    Sigma_df = (D_df, tf.matmul(P_df, L_u))
 
     # 3. Define variational family
-    q_f = ed.MultivariateNormalFullCovariance(loc=Mu_f,
-                                              covariance_matrix=Sigma_f,
-                                              name='q_f')
-    q_f_deriv = ed.MultivariateNormalFullCovariance(loc=Mu_df,
-                                                    covariance_matrix=Sigma_df,
-                                                    name='q_f_deriv')
+    q_f = dist_util.VariationalGaussianProcessSparse(loc=Mu_f,
+                                                     cov_diag=Sigma_f[0],
+                                                     cov_factor=Sigma_f[1],
+                                                     inducing_mean=m_u,
+                                                     inducing_scale=L_u,
+                                                     prior_scale=K_uu_chol,
+                                                     name='q_f')
+    q_f_deriv = dist_util.MultivariateNormalLowRankPlusDiag(loc=Mu_df,
+                                                            cov_diag=Sigma_df[0],
+                                                            cov_factor=Sigma_df[1],
+                                                            name='q_f_deriv')
     q_sig = ed.Normal(loc=q_sig_mean,
                       scale=q_sig_sdev, name='q_sig')
 
@@ -1105,4 +2050,4 @@ def variational_sgpr(X, Z, ls,
             Mu_f, Sigma_f, Mu_df, Sigma_df)
 
 
-variational_sgpr_sample = gpr.variational_sgpr_sample
+variational_sgpr_sample = gp.variational_sgpr_sample
@@ -278,6 +278,7 @@ def check_leaf_models(family_tree, base_pred):
 
 def prior(X, base_pred, family_tree=None,
           kernel_func=gp.rbf,
+          prior_func=gp.prior,
           link_func=sparse_softmax,
           ridge_factor=1e-3,
           name="ensemble_weight",
@@ -293,12 +294,18 @@ def prior(X, base_pred, family_tree=None,
             no structure (i.e. flat structure).
         kernel_func: (function) kernel function for base ensemble,
             with args (X, **kwargs). Default to rbf.
+        prior_func: (function) Gaussian process prior for the base weights,
+            e.g. gp.prior, gp.prior_whitened or gp.prior_rff. Default to
+            gp.prior.
         link_func: (function) a link function that transforms the unnormalized
             base ensemble weights to a K-dimension simplex. Default to sparse_softmax.
             This function has args (logits, temp)
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
         name: (str) name of the ensemble weight node on the computation graph.
         **kwargs: Additional parameters to pass to sparse_conditional_weight.
+            Must contain the length scale `ls`. If prior_func is gp.prior or
+            gp.prior_whitened, the Cholesky factor of the weight kernel is
+            computed once and shared by the weight GPs of all nodes.
 
     Returns:
         model_weights: (tf.Tensor of float32)  Tensor of ensemble model weights
@@ -311,9 +318,17 @@ def prior(X, base_pred, family_tree=None,
 
     check_leaf_models(family_tree, base_pred)
 
+    # factorize the weight kernel once, then share it across all node weight GPs.
+    if (gp.uses_scale_tril(prior_func) and
+            kwargs.get("scale_tril", None) is None):
+        kwargs["scale_tril"] = gp.prior_scale_tril(X, ls=kwargs["ls"],
+                                                   kernel_func=kernel_func,
+                                                   ridge_factor=ridge_factor)
+
     # build a dictionary of conditional weights for each node in family_tree.
     node_weight_dict = compute_cond_weights(X, family_tree,
                                             kernel_func=kernel_func,
+                                            prior_func=prior_func,
                                             link_func=link_func,
                                             ridge_factor=ridge_factor,
                                             **kwargs)
@@ -327,6 +342,7 @@ def prior(X, base_pred, family_tree=None,
 def sparse_conditional_weight(X, parent_name, child_names,
                               base_weights=None, temp=None,
                               kernel_func=gp.rbf,
+                              prior_func=gp.prior,
                               link_func=sparse_softmax,
                               ridge_factor=1e-3,
                               **kernel_kwargs):
@@ -350,11 +366,13 @@ def sparse_conditional_weight(X, parent_name, child_names,
             (batch_size, ).
         kernel_func: (function) kernel function for base ensemble,
             with args (X, **kwargs).
+        prior_func: (function) Gaussian process prior for the base weights,
+            with args (X, kernel_func, ridge_factor, name, **kernel_kwargs).
         link_func: (function) a link function that transforms the unnormalized
             base ensemble weights to a K-dimension simplex.
             This function has args (logits, temp)
         ridge_factor: (float32) ridge factor to stabilize Cholesky decomposition.
-        **kernel_kwargs: Additional parameters to pass to kernel_func through gp.prior.
+        **kernel_kwargs: Additional parameters to pass to kernel_func through prior_func.
 
     Returns:
         (list of tf.Tensor) List normalized ensemble weights, dimension (N, M) with
@@ -369,11 +387,18 @@ def sparse_conditional_weight(X, parent_name, child_names,
                          name='{}_{}'.format(TEMP_NAME_PREFIX, parent_name))
 
     if not isinstance(base_weights, tf.Tensor):
+        # siblings share X, ls and ridge_factor, so factorize the kernel only once.
+        if (gp.uses_scale_tril(prior_func) and
+                kernel_kwargs.get("scale_tril", None) is None):
+            kernel_kwargs["scale_tril"] = gp.prior_scale_tril(
+                X, ls=kernel_kwargs["ls"], kernel_func=kernel_func,
+                ridge_factor=ridge_factor)
+
         base_weights = tf.stack([
-            gp.prior(X, kernel_func=kernel_func,
-                     ridge_factor=ridge_factor,
-                     name='{}_{}'.format(BASE_WEIGHT_NAME_PREFIX, model_name),
-                     **kernel_kwargs)
+            prior_func(X, kernel_func=kernel_func,
+                       ridge_factor=ridge_factor,
+                       name='{}_{}'.format(BASE_WEIGHT_NAME_PREFIX, model_name),
+                       **kernel_kwargs)
             for model_name in child_names], axis=-1)
 
     # define transformed random variables
@@ -445,7 +470,7 @@ def variational_family(X, base_pred, family_tree=None,
                          for name in get_nonroot_node_names(family_tree)]
     base_weight_list = [list(gp_vi_family(X, name='vi_{}'.format(weight_name), **kwargs))
                         for weight_name in base_weight_names]
-    base_weight_arr = np.asarray([weight_par[:-1] for weight_par in base_weight_list]).T
+    base_weight_arr = list(zip(*[weight_par[:-1] for weight_par in base_weight_list]))
     mixture_par_arr = [weight_par[-1] for weight_par in base_weight_list]
 
     # prepare outcome containers
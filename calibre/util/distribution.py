@@ -1,4 +1,4 @@
-"""Multivariate Normal distribution class for decoupled representation.
+"""Multivariate Normal distribution classes for decoupled and low-rank representation.
 
 #### References
 
@@ -11,55 +11,292 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import numpy as np
+
 import tensorflow as tf
 import tensorflow_probability as tfp
 from tensorflow_probability.python.edward2.generated_random_variables import _make_random_variable
 from tensorflow_probability.python.distributions import mvn_linear_operator
-from tensorflow_probability.python.distributions import mvn_full_covariance
+
+from tensorflow.python.ops.distributions.util import gen_new_seed
+
+import calibre.util.matrix as matrix_util
 
 tfd = tfp.distributions
 tfb = tfp.bijectors
 
 
 # distribution definition
-class VariationalGaussianProcessDecoupledDistribution(mvn_full_covariance.MultivariateNormalFullCovariance):
-    """Variational Multivariate Normal under Decoupled Representation in [1]"""
+class MultivariateNormalLowRankPlusDiagDistribution(tfd.Distribution):
+    """Multivariate Normal with covariance diag(cov_diag) + U U^T.
+
+    The log density is computed through the Woodbury identity and the
+    matrix determinant lemma, therefore the cost is O(N K^2) for
+    cov_factor U of dimension (N, K), rather than O(N^3).
+
+    If interp_matrix W of dimension (N, G) is given (e.g. structured kernel
+    interpolation), cov_factor is a list of per-dimension grid factors L_d
+    of dimension (G_d, G_d), and the low-rank factor is
+    U = W (L_1 kron ... kron L_D) with G = prod_d G_d. Neither U nor the
+    Kronecker product is formed: products with U use sparse products with W
+    and one grid dimension at a time for the Kronecker product. The G x G
+    capacitance matrix is assembled from the N 4^D non-zeros of
+    W^T D^{-1} W, such that the log density costs
+    O(N 4^D + G^2 sum_d G_d + G^3) time and O(G^2) memory.
+
+    Only unbatched parameters are supported, i.e. loc and cov_diag are of
+    shape (N, ) and cov_factor is of shape (N, K). The Woodbury computation
+    is carried out in float64 to avoid cancellation when cov_diag is small.
+    """
 
     def __init__(self,
-                 loc=None,
-                 covariance_matrix=None,
-                 func_norm_mm=None,
-                 log_det_ss=None,
-                 cond_norm_ss=None,
+                 loc,
+                 cov_diag,
+                 cov_factor,
+                 interp_matrix=None,
                  validate_args=False, allow_nan_stats=True,
-                 name="VariationalGaussianProcessDecoupled"):
-        """Construct Multivariate Normal distribution on `R^k`.
+                 name="MultivariateNormalLowRankPlusDiag"):
+        """Construct Multivariate Normal distribution on `R^N`.
+
+        Args:
+          loc: Floating-point `Tensor` of shape `[N]`.
+          cov_diag: Floating-point `Tensor` of shape `[N]`, positive diagonal
+            component of the covariance matrix.
+          cov_factor: Floating-point `Tensor` of shape `[N, K]`, low-rank
+            component of the covariance matrix. If interp_matrix is given
+            then a list of `Tensor`s of shape `[G_d, G_d]`, whose Kronecker
+            product is the grid factor.
+          interp_matrix: Floating-point `SparseTensor` of shape `[N, G]` or
+            `None`. Sparse interpolation matrix applied to cov_factor.
+          validate_args: Python `bool`, default `False`. When `True` distribution
+            parameters are checked for validity despite possibly degrading runtime
+            performance. When `False` invalid inputs may silently render incorrect
+            outputs.
+          allow_nan_stats: Python `bool`, default `True`. When `True`,
+            statistics (e.g., mean, mode, variance) use the value "`NaN`" to
+            indicate the result is undefined. When `False`, an exception is raised
+            if one or more of the statistic's batch members are undefined.
+          name: Python `str` name prefixed to Ops created by this class.
+        """
+        parameters = dict(locals())
+
+        with tf.name_scope(name, values=[loc, cov_diag]) as name:
+            self._loc = tf.convert_to_tensor(loc, name="loc")
+            self._cov_diag = tf.convert_to_tensor(cov_diag, name="cov_diag",
+                                                  dtype=self._loc.dtype)
+            if interp_matrix is None:
+                self._cov_factor = tf.convert_to_tensor(
+                    cov_factor, name="cov_factor", dtype=self._loc.dtype)
+                factor_list = [self._cov_factor]
+            else:
+                self._cov_factor = [
+                    tf.convert_to_tensor(factor, name="cov_factor",
+                                         dtype=self._loc.dtype)
+                    for factor in cov_factor]
+                factor_list = self._cov_factor
+            self._interp_matrix = interp_matrix
+
+        super(MultivariateNormalLowRankPlusDiagDistribution, self).__init__(
+            dtype=self._loc.dtype,
+            reparameterization_type=tfd.FULLY_REPARAMETERIZED,
+            validate_args=validate_args,
+            allow_nan_stats=allow_nan_stats,
+            parameters=parameters,
+            graph_parents=[self._loc, self._cov_diag] + factor_list,
+            name=name)
+
+    @property
+    def loc(self):
+        return self._loc
+
+    @property
+    def cov_diag(self):
+        return self._cov_diag
+
+    @property
+    def cov_factor(self):
+        return self._cov_factor
+
+    @property
+    def interp_matrix(self):
+        return self._interp_matrix
+
+    def _batch_shape_tensor(self):
+        return tf.constant([], dtype=tf.int32)
+
+    def _batch_shape(self):
+        return tf.TensorShape([])
+
+    def _event_shape_tensor(self):
+        return tf.shape(self._loc)[-1:]
+
+    def _event_shape(self):
+        return self._loc.shape[-1:]
+
+    def _num_rank(self):
+        """Rank K of the low-rank factor U."""
+        if self._interp_matrix is None:
+            return tf.shape(self._cov_factor)[-1]
+        return int(np.prod([factor.shape.as_list()[0]
+                            for factor in self._cov_factor]))
+
+    def _factor_matmul(self, V, dtype):
+        """Computes U V, for V of shape (K, M)."""
+        if self._interp_matrix is None:
+            return tf.matmul(tf.cast(self._cov_factor, dtype), V)
+
+        LV = matrix_util.kronecker_matmul(
+            [tf.cast(factor, dtype) for factor in self._cov_factor], V)
+        return tf.sparse_tensor_dense_matmul(
+            tf.cast(self._interp_matrix, dtype), LV)
+
+    def _factor_t_matmul(self, V, dtype):
+        """Computes U^T V, for V of shape (N, M)."""
+        if self._interp_matrix is None:
+            return tf.matmul(tf.cast(self._cov_factor, dtype), V, transpose_a=True)
+
+        WtV = tf.sparse_tensor_dense_matmul(
+            tf.cast(self._interp_matrix, dtype), V, adjoint_a=True)
+        return matrix_util.kronecker_matmul(
+            [tf.cast(factor, dtype) for factor in self._cov_factor], WtV,
+            transpose_a=True)
+
+    def _dense_factor(self):
+        """Computes U, of shape (N, K)."""
+        return self._factor_matmul(tf.eye(self._num_rank(), dtype=self.dtype),
+                                   self.dtype)
+
+    def _interp_gram(self, cov_diag):
+        """Computes W^T D^{-1} W, of shape (G, G), from the non-zeros of W.
+
+        Each row of W holds the same number C of non-zeros in consecutive
+        order (see matrix_util.interpolation_weights), therefore the N C^2
+        pairwise products are scattered (and summed) into the dense output.
+        """
+        num_obs = tf.shape(cov_diag)[-1]
+        num_grid = self._num_rank()
+
+        cols = tf.reshape(self._interp_matrix.indices[:, 1], [num_obs, -1])
+        vals = (tf.reshape(tf.cast(self._interp_matrix.values, tf.float64),
+                           [num_obs, -1]) /
+                tf.expand_dims(tf.sqrt(cov_diag), -1))
+        num_nonzero = tf.shape(cols)[-1]
+
+        pair_vals = tf.expand_dims(vals, -1) * tf.expand_dims(vals, -2)
+        pair_index = tf.stack(
+            [tf.tile(tf.expand_dims(cols, -1), [1, 1, num_nonzero]),
+             tf.tile(tf.expand_dims(cols, -2), [1, num_nonzero, 1])], axis=-1)
+
+        return tf.scatter_nd(tf.reshape(pair_index, [-1, 2]),
+                             tf.reshape(pair_vals, [-1]),
+                             tf.constant([num_grid, num_grid], dtype=tf.int64))
+
+    def _capacitance_chol(self):
+        """Cholesky factor of capacitance matrix I + U^T D^{-1} U, in float64."""
+        cov_diag = tf.cast(self._cov_diag, tf.float64)
+        num_rank = self._num_rank()
+
+        if self._interp_matrix is None:
+            cov_factor = self._factor_matmul(tf.eye(num_rank, dtype=tf.float64),
+                                             tf.float64)
+            factor_gram = self._factor_t_matmul(
+                cov_factor / tf.expand_dims(cov_diag, -1), tf.float64)
+        else:
+            # L^T (W^T D^{-1} W) L, by two Kronecker products with L^T.
+            grid_factors = [tf.cast(factor, tf.float64)
+                            for factor in self._cov_factor]
+            factor_gram = matrix_util.kronecker_matmul(
+                grid_factors, self._interp_gram(cov_diag), transpose_a=True)
+            factor_gram = matrix_util.kronecker_matmul(
+                grid_factors, tf.transpose(factor_gram), transpose_a=True)
+
+        capacitance = tf.eye(num_rank, dtype=tf.float64) + factor_gram
+        return tf.cholesky(capacitance)
+
+    def _log_prob(self, x):
+        cov_diag = tf.cast(self._cov_diag, tf.float64)
+        num_dim = tf.cast(tf.shape(cov_diag)[-1], tf.float64)
+
+        # flatten sample dimensions, resid has shape (num_batch, N)
+        resid = tf.cast(x - self._loc, tf.float64)
+        resid_flat = tf.reshape(resid, [-1, tf.shape(cov_diag)[-1]])
+        resid_scaled = resid_flat / cov_diag
+
+        # Woodbury identity for quadratic form, shape (K, num_batch)
+        capacitance_chol = self._capacitance_chol()
+        proj = tf.matrix_triangular_solve(
+            capacitance_chol,
+            self._factor_t_matmul(tf.transpose(resid_scaled), tf.float64),
+            lower=True)
+        quad_form = (tf.reduce_sum(resid_flat * resid_scaled, axis=-1) -
+                     tf.reduce_sum(tf.square(proj), axis=0))
+
+        # matrix determinant lemma
+        log_det = (tf.reduce_sum(tf.log(cov_diag)) +
+                   2. * tf.reduce_sum(tf.log(tf.matrix_diag_part(capacitance_chol))))
 
-        The `batch_shape` is the broadcast shape between `loc` and
-        `covariance_matrix` arguments.
+        log_prob = -0.5 * (quad_form + log_det + num_dim * np.log(2. * np.pi))
+        log_prob = tf.reshape(log_prob, tf.shape(x)[:-1])
 
-        The `event_shape` is given by last dimension of the matrix implied by
-        `covariance_matrix`. The last dimension of `loc` (if provided) must
-        broadcast with this.
+        return tf.cast(log_prob, self.dtype)
 
-        A non-batch `covariance_matrix` matrix is a `k x k` symmetric positive
-        definite matrix.  In other words it is (real) symmetric with all eigenvalues
-        strictly positive.
+    def _sample_n(self, n, seed=None):
+        num_dim = tf.shape(self._loc)[-1]
+        num_rank = self._num_rank()
 
-        Additional leading dimensions (if any) will index batches.
+        eps_diag = tf.random_normal([n, num_dim], dtype=self.dtype, seed=seed)
+        eps_factor = tf.random_normal([num_rank, n], dtype=self.dtype,
+                                      seed=gen_new_seed(seed, "low_rank"))
+
+        return (self._loc + tf.sqrt(self._cov_diag) * eps_diag +
+                tf.transpose(self._factor_matmul(eps_factor, self.dtype)))
+
+    def _mean(self):
+        return tf.identity(self._loc)
+
+    def _variance(self):
+        return self._cov_diag + tf.reduce_sum(tf.square(self._dense_factor()), axis=-1)
+
+    def _covariance(self):
+        cov_factor = self._dense_factor()
+        return (tf.matrix_diag(self._cov_diag) +
+                tf.matmul(cov_factor, cov_factor, transpose_b=True))
+
+
+# random variable definition
+MultivariateNormalLowRankPlusDiag = _make_random_variable(
+    MultivariateNormalLowRankPlusDiagDistribution)
+
+
+# distribution definition
+class VariationalGaussianProcessDecoupledDistribution(MultivariateNormalLowRankPlusDiagDistribution):
+    """Variational Multivariate Normal under Decoupled Representation in [1].
+
+    The covariance Kxx - Kxs (Kss + S^{-1})^{-1} Kxs^T is represented in
+    low-rank-plus-diagonal form, therefore sampling and log density cost
+    O(Nx Ns^2) and no Nx x Nx Cholesky decomposition is needed.
+    """
+
+    def __init__(self,
+                 loc,
+                 cov_diag,
+                 cov_factor,
+                 func_norm_mm=None,
+                 log_det_ss=None,
+                 cond_norm_ss=None,
+                 validate_args=False, allow_nan_stats=True,
+                 name="VariationalGaussianProcessDecoupled"):
+        """Construct Multivariate Normal distribution on `R^N`.
 
         Args:
-          loc: Floating-point `Tensor`. If this is set to `None`, `loc` is
-            implicitly `0`. When specified, may have shape `[B1, ..., Bb, k]` where
-            `b >= 0` and `k` is the event size.
-          covariance_matrix: Floating-point, symmetric positive definite `Tensor` of
-            same `dtype` as `loc`.  The strict upper triangle of `covariance_matrix`
-            is ignored, so if `covariance_matrix` is not symmetric no error will be
-            raised (unless `validate_args is True`).  `covariance_matrix` has shape
-            `[B1, ..., Bb, k, k]` where `b >= 0` and `k` is the event size.
+          loc: Floating-point `Tensor` of shape `[N]`.
+          cov_diag: Floating-point `Tensor` of shape `[N]`, positive diagonal
+            component of the covariance matrix.
+          cov_factor: Floating-point `Tensor` of shape `[N, Ns]`, low-rank
+            component of the covariance matrix.
           func_norm_mm: L2 norm for variational mean function.
           log_det_ss: log determinant for covariance.
-          cond_cov_inv: Inverse of conditional covariance.
+          cond_norm_ss: Trace norm of conditional covariance.
           validate_args: Python `bool`, default `False`. When `True` distribution
             parameters are checked for validity despite possibly degrading runtime
             performance. When `False` invalid inputs may silently render incorrect
@@ -69,15 +306,13 @@ class VariationalGaussianProcessDecoupledDistribution(mvn_full_covariance.Multiv
             indicate the result is undefined. When `False`, an exception is raised
             if one or more of the statistic's batch members are undefined.
           name: Python `str` name prefixed to Ops created by this class.
-
-        Raises:
-          ValueError: if neither `loc` nor `covariance_matrix` are specified.
         """
         parameters = dict(locals())
 
         super(VariationalGaussianProcessDecoupledDistribution, self).__init__(
             loc=loc,
-            covariance_matrix=covariance_matrix,
+            cov_diag=cov_diag,
+            cov_factor=cov_factor,
             validate_args=validate_args,
             allow_nan_stats=allow_nan_stats,
             name=name)
@@ -89,15 +324,17 @@ class VariationalGaussianProcessDecoupledDistribution(mvn_full_covariance.Multiv
         self.cond_norm_ss = cond_norm_ss
 
 
-@tf.distributions.RegisterKL(mvn_linear_operator.MultivariateNormalLinearOperator,
-                             VariationalGaussianProcessDecoupledDistribution)
+@tf.distributions.RegisterKL(VariationalGaussianProcessDecoupledDistribution,
+                             mvn_linear_operator.MultivariateNormalLinearOperator)
+@tf.distributions.RegisterKL(VariationalGaussianProcessDecoupledDistribution,
+                             MultivariateNormalLowRankPlusDiagDistribution)
 def _kl_brute_force(a, b, name=None):
-    """Batched KL divergence `KL(a || b)` for decoupled GP in [1].
+    """KL divergence `KL(a || b)` for decoupled GP in [1].
 
     Args:
-      a: Instance of `MultivariateNormalLinearOperator`.
-      b: Instance of `VariationalGaussianProcessDecoupled`.
-      name: (optional) name to use for created ops. Default "kl_mvn".
+      a: Instance of `VariationalGaussianProcessDecoupled`.
+      b: Instance of GP prior distribution.
+      name: (optional) name to use for created ops. Default "kl_dgp_decouple".
 
     Returns:
       scalar kl divergence
@@ -106,11 +343,389 @@ def _kl_brute_force(a, b, name=None):
     with tf.name_scope(
             name,
             "kl_dgp_decouple",
-            values=[b.func_norm_mm, b.log_det_ss, b.cond_norm_ss]):
-        kl_div = 0.5 * (b.func_norm_mm + b.log_det_ss - b.cond_norm_ss)
+            values=[a.func_norm_mm, a.log_det_ss, a.cond_norm_ss]):
+        kl_div = 0.5 * (a.func_norm_mm + a.log_det_ss - a.cond_norm_ss)
         return kl_div
 
 
 # random variable definition
 VariationalGaussianProcessDecoupled = _make_random_variable(
     VariationalGaussianProcessDecoupledDistribution)
+
+
+# distribution definition
+class VariationalGaussianProcessSparseDistribution(MultivariateNormalLowRankPlusDiagDistribution):
+    """Variational Multivariate Normal for sparse GP in low-rank-plus-diagonal form.
+
+    For inducing points Z with q(U) = MVN(m, L L^T), the marginal q(F) has
+    mean Kxz Kzz^{-1} m and covariance
+        diag(Kxx - Qxx) + (Kxz Kzz^{-1} L) (Kxz Kzz^{-1} L)^T,
+    where only the diagonal of the Nystrom residual Kxx - Qxx is kept.
+
+    The KL divergence to the GP prior reduces to KL(q(U) || p(U)), which is
+    computed in O(Nz^3) from the inducing parameters.
+    """
+
+    def __init__(self,
+                 loc,
+                 cov_diag,
+                 cov_factor,
+                 inducing_mean=None,
+                 inducing_scale=None,
+                 prior_scale=None,
+                 validate_args=False, allow_nan_stats=True,
+                 name="VariationalGaussianProcessSparse"):
+        """Construct Multivariate Normal distribution on `R^N`.
+
+        Args:
+          loc: Floating-point `Tensor` of shape `[N]`.
+          cov_diag: Floating-point `Tensor` of shape `[N]`, diagonal of the
+            Nystrom residual Kxx - Kxz Kzz^{-1} Kzx.
+          cov_factor: Floating-point `Tensor` of shape `[N, Nz]`, equal to
+            Kxz Kzz^{-1} L.
+          inducing_mean: Floating-point `Tensor` of shape `[Nz]`, variational
+            mean m of inducing values.
+          inducing_scale: Floating-point `Tensor` of shape `[Nz, Nz]`, lower
+            triangular scale L of inducing values.
+          prior_scale: Floating-point `Tensor` of shape `[Nz, Nz]`, Cholesky
+            factor of Kzz.
+          validate_args: Python `bool`, default `False`. When `True` distribution
+            parameters are checked for validity despite possibly degrading runtime
+            performance. When `False` invalid inputs may silently render incorrect
+            outputs.
+          allow_nan_stats: Python `bool`, default `True`. When `True`,
+            statistics (e.g., mean, mode, variance) use the value "`NaN`" to
+            indicate the result is undefined. When `False`, an exception is raised
+            if one or more of the statistic's batch members are undefined.
+          name: Python `str` name prefixed to Ops created by this class.
+        """
+        parameters = dict(locals())
+
+        super(VariationalGaussianProcessSparseDistribution, self).__init__(
+            loc=loc,
+            cov_diag=cov_diag,
+            cov_factor=cov_factor,
+            validate_args=validate_args,
+            allow_nan_stats=allow_nan_stats,
+            name=name)
+
+        self._parameters = parameters
+
+        self.inducing_mean = inducing_mean
+        self.inducing_scale = inducing_scale
+        self.prior_scale = prior_scale
+
+
+@tf.distributions.RegisterKL(VariationalGaussianProcessSparseDistribution,
+                             mvn_linear_operator.MultivariateNormalLinearOperator)
+@tf.distributions.RegisterKL(VariationalGaussianProcessSparseDistribution,
+                             MultivariateNormalLowRankPlusDiagDistribution)
+def _kl_sparse_gp(a, b, name=None):
+    """KL divergence `KL(a || b)` for sparse GP, i.e. KL(q(U) || p(U)).
+
+    The GP prior b is assumed to share the kernel used to construct a, hence
+    only the inducing parameters of a are used.
+
+    Args:
+      a: Instance of `VariationalGaussianProcessSparse`.
+      b: Instance of GP prior distribution.
+      name: (optional) name to use for created ops. Default "kl_sparse_gp".
+
+    Returns:
+      scalar kl divergence
+    """
+    with tf.name_scope(
+            name,
+            "kl_sparse_gp",
+            values=[a.inducing_mean, a.inducing_scale, a.prior_scale]):
+        num_inducing = tf.cast(tf.shape(a.prior_scale)[-1], a.dtype)
+
+        scale_ratio = tf.matrix_triangular_solve(a.prior_scale, a.inducing_scale)
+        mean_ratio = tf.matrix_triangular_solve(
+            a.prior_scale, tf.expand_dims(a.inducing_mean, -1))
+
+        log_det_prior = 2. * tf.reduce_sum(
+            tf.log(tf.matrix_diag_part(a.prior_scale)))
+        log_det_q = 2. * tf.reduce_sum(
+            tf.log(tf.abs(tf.matrix_diag_part(a.inducing_scale))))
+
+        kl_div = 0.5 * (tf.reduce_sum(tf.square(scale_ratio)) +
+                        tf.reduce_sum(tf.square(mean_ratio)) -
+                        num_inducing + log_det_prior - log_det_q)
+        return kl_div
+
+
+# random variable definition
+VariationalGaussianProcessSparse = _make_random_variable(
+    VariationalGaussianProcessSparseDistribution)
+
+
+# distribution definition
+class MultivariateNormalIterativeDistribution(tfd.Distribution):
+    """Multivariate Normal defined through covariance-vector products.
+
+    The log density is computed with the iterative backend in
+    calibre.util.matrix, i.e. batched conjugate gradient for the quadratic
+    form and stochastic Lanczos quadrature for the log determinant, such that
+    only products of the covariance matrix with (N, M) matrices are required.
+
+    Sampling and covariance fall back to materializing the covariance matrix,
+    since they are not required for computing the log joint.
+    """
+
+    def __init__(self,
+                 loc,
+                 cov_matmul_fn,
+                 precond_diag=None,
+                 num_probe=matrix_util.DEFAULT_SLQ_NUM_PROBE,
+                 max_iter=matrix_util.DEFAULT_CG_MAX_ITER,
+                 tol=matrix_util.DEFAULT_CG_TOL,
+                 seed=matrix_util.DEFAULT_SLQ_SEED,
+                 validate_args=False, allow_nan_stats=True,
+                 name="MultivariateNormalIterative"):
+        """Construct Multivariate Normal distribution on `R^N`.
+
+        Args:
+          loc: Floating-point `Tensor` of static shape `[N]`.
+          cov_matmul_fn: Python `callable` computing the product of the
+            covariance matrix with a `Tensor` of shape `[N, M]`.
+          precond_diag: Floating-point `Tensor` of shape `[N]` or `None`,
+            diagonal (Jacobi) preconditioner for conjugate gradient.
+          num_probe: Python `int`, number of probe vectors for log determinant.
+          max_iter: Python `int`, maximum number of conjugate gradient iterations.
+          tol: Python `float`, relative residual tolerance for conjugate gradient.
+          seed: Python `int`, seed for the (fixed) probe vectors.
+          validate_args: Python `bool`, default `False`. When `True` distribution
+            parameters are checked for validity despite possibly degrading runtime
+            performance. When `False` invalid inputs may silently render incorrect
+            outputs.
+          allow_nan_stats: Python `bool`, default `True`. When `True`,
+            statistics (e.g., mean, mode, variance) use the value "`NaN`" to
+            indicate the result is undefined. When `False`, an exception is raised
+            if one or more of the statistic's batch members are undefined.
+          name: Python `str` name prefixed to Ops created by this class.
+        """
+        parameters = dict(locals())
+
+        with tf.name_scope(name, values=[loc]) as name:
+            self._loc = tf.convert_to_tensor(loc, name="loc")
+            self._precond_diag = (None if precond_diag is None else
+                                  tf.convert_to_tensor(precond_diag,
+                                                       name="precond_diag",
+                                                       dtype=self._loc.dtype))
+
+        self._cov_matmul_fn = cov_matmul_fn
+        self._num_probe = num_probe
+        self._max_iter = max_iter
+        self._tol = tol
+        self._seed = seed
+
+        super(MultivariateNormalIterativeDistribution, self).__init__(
+            dtype=self._loc.dtype,
+            reparameterization_type=tfd.FULLY_REPARAMETERIZED,
+            validate_args=validate_args,
+            allow_nan_stats=allow_nan_stats,
+            parameters=parameters,
+            graph_parents=[self._loc],
+            name=name)
+
+    @property
+    def loc(self):
+        return self._loc
+
+    def _batch_shape_tensor(self):
+        return tf.constant([], dtype=tf.int32)
+
+    def _batch_shape(self):
+        return tf.TensorShape([])
+
+    def _event_shape_tensor(self):
+        return tf.shape(self._loc)[-1:]
+
+    def _event_shape(self):
+        return self._loc.shape[-1:]
+
+    def _log_prob(self, x):
+        num_dim = self._loc.shape.as_list()[-1]
+
+        # flatten sample dimensions, resid has shape (N, num_batch)
+        resid = tf.transpose(tf.reshape(x - self._loc, [-1, num_dim]))
+
+        quad_form, log_det = matrix_util.iterative_quad_logdet(
+            self._cov_matmul_fn, resid,
+            precond_diag=self._precond_diag,
+            num_probe=self._num_probe,
+            max_iter=self._max_iter, tol=self._tol,
+            seed=self._seed)
+
+        log_prob = -0.5 * (quad_form + log_det + num_dim * np.log(2. * np.pi))
+        return tf.reshape(log_prob, tf.shape(x)[:-1])
+
+    def _sample_n(self, n, seed=None):
+        num_dim = self._loc.shape.as_list()[-1]
+
+        scale_tril = tf.cholesky(self._covariance())
+        eps = tf.random_normal([n, num_dim], dtype=self.dtype, seed=seed)
+
+        return self._loc + tf.matmul(eps, scale_tril, transpose_b=True)
+
+    def _mean(self):
+        return tf.identity(self._loc)
+
+    def _covariance(self):
+        num_dim = self._loc.shape.as_list()[-1]
+        return self._cov_matmul_fn(tf.eye(num_dim, dtype=self.dtype))
+
+
+# random variable definition
+MultivariateNormalIterative = _make_random_variable(
+    MultivariateNormalIterativeDistribution)
+
+
+# distribution definition
+class MultivariateNormalVecchiaDistribution(tfd.Distribution):
+    """Multivariate Normal defined by a sequence of sparse conditionals.
+
+    Under a given ordering of the N elements, each element depends only on
+    a small set of previous elements (its neighbors), i.e.
+
+        f_i | f_{N(i)} ~ N(b_i^T f_{N(i)}, d_i),
+
+    which implies a sparse Cholesky factor of the precision matrix,
+        Q = (I - B)^T D^{-1} (I - B).
+
+    The log density therefore costs O(N m) for neighbor sets of size m.
+    """
+
+    def __init__(self,
+                 loc,
+                 cond_weights,
+                 cond_var,
+                 order,
+                 neighbor_index,
+                 validate_args=False, allow_nan_stats=True,
+                 name="MultivariateNormalVecchia"):
+        """Construct Multivariate Normal distribution on `R^N`.
+
+        Args:
+          loc: Floating-point `Tensor` of static shape `[N]`.
+          cond_weights: Floating-point `Tensor` of shape `[N, m]`, regression
+            weights b_i on the neighbors of each (ordered) element. Weights of
+            padded neighbors must be zero.
+          cond_var: Floating-point `Tensor` of shape `[N]`, conditional
+            variance d_i of each (ordered) element.
+          order: Integer `np.ndarray` of shape `[N]`, ordering of elements,
+            i.e. the i-th ordered element is loc[order[i]].
+          neighbor_index: Integer `np.ndarray` of shape `[N, m]`, ordered
+            position of the neighbors of each ordered element, -1 for padding.
+            Neighbors always precede the element in the ordering.
+          validate_args: Python `bool`, default `False`. When `True` distribution
+            parameters are checked for validity despite possibly degrading runtime
+            performance. When `False` invalid inputs may silently render incorrect
+            outputs.
+          allow_nan_stats: Python `bool`, default `True`. When `True`,
+            statistics (e.g., mean, mode, variance) use the value "`NaN`" to
+            indicate the result is undefined. When `False`, an exception is raised
+            if one or more of the statistic's batch members are undefined.
+          name: Python `str` name prefixed to Ops created by this class.
+        """
+        parameters = dict(locals())
+
+        with tf.name_scope(name, values=[loc, cond_weights, cond_var]) as name:
+            self._loc = tf.convert_to_tensor(loc, name="loc")
+            self._cond_weights = tf.convert_to_tensor(cond_weights,
+                                                      name="cond_weights",
+                                                      dtype=self._loc.dtype)
+            self._cond_var = tf.convert_to_tensor(cond_var, name="cond_var",
+                                                  dtype=self._loc.dtype)
+
+        self._order = np.asarray(order, dtype=np.int64)
+        self._neighbor_index = np.asarray(neighbor_index, dtype=np.int64)
+
+        super(MultivariateNormalVecchiaDistribution, self).__init__(
+            dtype=self._loc.dtype,
+            reparameterization_type=tfd.FULLY_REPARAMETERIZED,
+            validate_args=validate_args,
+            allow_nan_stats=allow_nan_stats,
+            parameters=parameters,
+            graph_parents=[self._loc, self._cond_weights, self._cond_var],
+            name=name)
+
+    @property
+    def loc(self):
+        return self._loc
+
+    @property
+    def cond_weights(self):
+        return self._cond_weights
+
+    @property
+    def cond_var(self):
+        return self._cond_var
+
+    def _batch_shape_tensor(self):
+        return tf.constant([], dtype=tf.int32)
+
+    def _batch_shape(self):
+        return tf.TensorShape([])
+
+    def _event_shape_tensor(self):
+        return tf.shape(self._loc)[-1:]
+
+    def _event_shape(self):
+        return self._loc.shape[-1:]
+
+    def _log_prob(self, x):
+        num_dim = self._loc.shape.as_list()[-1]
+
+        # flatten sample dimensions and re-order, shape (num_batch, N)
+        resid = tf.reshape(x - self._loc, [-1, num_dim])
+        resid = tf.gather(resid, self._order, axis=-1)
+
+        # conditional mean from neighbors, shape (num_batch, N)
+        neighbor_val = tf.gather(resid, np.maximum(self._neighbor_index, 0), axis=-1)
+        cond_mean = tf.reduce_sum(neighbor_val * self._cond_weights, axis=-1)
+
+        log_prob = -0.5 * tf.reduce_sum(
+            tf.square(resid - cond_mean) / self._cond_var +
+            tf.log(2. * np.pi * self._cond_var), axis=-1)
+
+        return tf.reshape(log_prob, tf.shape(x)[:-1])
+
+    def _sample_n(self, n, seed=None):
+        num_dim = self._loc.shape.as_list()[-1]
+
+        eps = tf.random_normal([num_dim, n], dtype=self.dtype, seed=seed)
+        innovation = tf.sqrt(tf.expand_dims(self._cond_var, -1)) * eps
+
+        # sequentially sample ordered elements given their neighbors,
+        # element i is stored at position i + 1, padding reads zeros at 0.
+        neighbor_index = tf.constant(self._neighbor_index + 1, dtype=tf.int32)
+
+        def _body(i, sample_arr):
+            neighbor_val = sample_arr.gather(neighbor_index[i])
+            sample_i = (tf.reduce_sum(
+                tf.expand_dims(self._cond_weights[i], -1) * neighbor_val, axis=0)
+                        + innovation[i])
+            return i + 1, sample_arr.write(i + 1, sample_i)
+
+        sample_arr = tf.TensorArray(self.dtype, size=num_dim + 1,
+                                    element_shape=tf.TensorShape([None]),
+                                    clear_after_read=False)
+        sample_arr = sample_arr.write(0, tf.zeros([n], dtype=self.dtype))
+
+        _, sample_arr = tf.while_loop(lambda i, *_: i < num_dim, _body,
+                                      (tf.constant(0), sample_arr))
+        sample_ordered = sample_arr.stack()[1:]
+
+        # restore original order, shape (n, N)
+        sample = tf.gather(sample_ordered, np.argsort(self._order), axis=0)
+        return self._loc + tf.transpose(sample)
+
+    def _mean(self):
+        return tf.identity(self._loc)
+
+
+# random variable definition
+MultivariateNormalVecchia = _make_random_variable(
+    MultivariateNormalVecchiaDistribution)
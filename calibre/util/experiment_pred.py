@@ -14,6 +14,7 @@ def prediction_tailfree(X_pred, X_train,
                         weight_sample_list, resid_sample, temp_sample,
                         default_log_ls_weight=None,
                         default_log_ls_resid=None,
+                        prior_func=gp.prior,
                         ):
     """
     Generates predictive samples for adaptive ensemble
@@ -36,6 +37,9 @@ def prediction_tailfree(X_pred, X_train,
             weight GP.
         default_log_ls_resid: (float32) default value for length-scale parameter for
             residual GP.
+        prior_func: (function) Gaussian process prior used for inference,
+            which selects the matching posterior predictive sampler
+            (see gp.posterior_sampler). Default to gp.prior.
 
     Returns:
         ensemble_sample: (np.ndarray) Samples from full posterior predictive.
@@ -51,20 +55,20 @@ def prediction_tailfree(X_pred, X_train,
     default_log_ls_resid = default_log_ls_resid.astype(np.float32)
 
     # compute GP prediction for weight GP and residual GP
+    sample_posterior = gp.posterior_sampler(prior_func)
+
     model_weight_valid_sample = []
     for model_weight_sample in weight_sample_list:
         model_weight_valid_sample.append(
-            gp.sample_posterior_full(X_new=X_pred, X=X_train,
-                                     f_sample=model_weight_sample.T,
-                                     ls=np.exp(default_log_ls_weight),
-                                     kernel_func=gp.rbf).T.astype(np.float32)
+            sample_posterior(X_new=X_pred, X=X_train,
+                             f_sample=model_weight_sample.T,
+                             ls=np.exp(default_log_ls_weight)).T.astype(np.float32)
         )
 
     ensemble_resid_valid_sample = (
-        gp.sample_posterior_full(X_new=X_pred, X=X_train,
-                                 f_sample=resid_sample.T,
-                                 ls=np.exp(default_log_ls_resid),
-                                 kernel_func=gp.rbf).T
+        sample_posterior(X_new=X_pred, X=X_train,
+                         f_sample=resid_sample.T,
+                         ls=np.exp(default_log_ls_resid)).T
     )
 
     # compute sample for posterior mean
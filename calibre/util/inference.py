@@ -1,10 +1,13 @@
 """Utility functions for posterior inference"""
 import numpy as np
+import scipy.linalg as linalg
 
 import tensorflow as tf
 import tensorflow_probability as tfp
 from tensorflow_probability import edward2 as ed
 
+import calibre.util.matrix as matrix_util
+
 tfd = tfp.distributions
 
 
@@ -21,20 +24,27 @@ def make_value_setter(**model_kwargs):
     return set_values
 
 
-def make_sparse_gp_parameters(m, S,
+def make_sparse_gp_parameters(m, S_chol,
                               X, Z, ls, kern_func,
                               ridge_factor=1e-3,
                               mean_name='qf_mean', compute_mean=True):
     """Produces variational parameters for sparse GP approximation.
 
+    The covariance is returned in low-rank-plus-diagonal form
+        Sigma = diag(Sigma_diag) + Sigma_factor Sigma_factor^T,
+    where Sigma_diag is the diagonal of the Nystrom residual
+    Kxx - Kxz Kzz^{-1} Kzx, and Sigma_factor = Kxz Kzz^{-1} S_chol.
+    Therefore only O(Nx * Nz) memory is needed.
+
     Args:
         m: (tf.Tensor or None) Variational parameter for mean of latent GP, shape (Nz, )
             Can be None if compute_mean=False
-        S: (tf.Tensor) Variational parameter for covariance of latent GP, shape (Nz, Nz)
+        S_chol: (tf.Tensor) Cholesky factor of variational parameter for
+            covariance of latent GP, shape (Nz, Nz)
         X: (np.ndarray of float32) input training features, with dimension (Nx, D).
         Z: (np.ndarray of float32) inducing points, with dimension (Nz, D).
         ls: (float32) length scale parameter.
-        kern_func: (function) kernel function.
+        kern_func: (function) stationary kernel function.
         ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition
         mean_name: (str) name for the mean parameter
         compute_mean: (bool) If False, mean variational parameter is not computed.
@@ -43,35 +53,109 @@ def make_sparse_gp_parameters(m, S,
     Returns:
         Mu (tf.Tensor or none) Mean parameters for sparse Gaussian Process, shape (Nx, ).
             if compute_mean=False, then Mu is None.
-        Sigma (tf.Tensor) Covariance parameters for sparse Gaussian Process, shape (Nx, Nx).
+        Sigma_diag (tf.Tensor) Diagonal covariance parameters for sparse
+            Gaussian Process, shape (Nx, ).
+        Sigma_factor (tf.Tensor) Low-rank covariance parameters for sparse
+            Gaussian Process, shape (Nx, Nz).
     """
-    Nx, Nz = X.shape[0], Z.shape[0]
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    Z = tf.convert_to_tensor(Z, dtype=tf.float32)
+    Nx = X.shape.as_list()[0]
 
-    # compute matrix constants
-    Kxx = kern_func(X, ls=ls)
+    # compute matrix constants,
+    # kernel is stationary, therefore diag(Kxx) is constant.
+    Kxx_diag = tf.fill([Nx], tf.reshape(kern_func(X[:1], ls=ls), []))
     Kxz = kern_func(X, Z, ls=ls)
     Kzz = kern_func(Z, ls=ls, ridge_factor=ridge_factor)
 
-    # compute null covariance matrix using Cholesky decomposition
-    Kzz_chol_inv = tf.matrix_inverse(tf.cholesky(Kzz))
-    Kzz_inv = tf.matmul(Kzz_chol_inv, Kzz_chol_inv, transpose_a=True)
-
-    Kxz_Kzz_chol_inv = tf.matmul(Kxz, Kzz_chol_inv, transpose_b=True)
-    Kxz_Kzz_inv = tf.matmul(Kxz, Kzz_inv)
-    Sigma_pre = Kxx - tf.matmul(Kxz_Kzz_chol_inv, Kxz_Kzz_chol_inv, transpose_b=True)
+    # compute Nystrom projection using Cholesky decomposition
+    Kzz_chol = tf.cholesky(Kzz)
+    Kzz_chol_inv_Kzx = tf.matrix_triangular_solve(Kzz_chol, tf.transpose(Kxz))
+    Kxz_Kzz_inv = tf.transpose(
+        tf.matrix_triangular_solve(tf.transpose(Kzz_chol), Kzz_chol_inv_Kzx,
+                                   lower=False))
 
     # compute sparse gp variational parameter (i.e. mean and covariance of P(f_obs | f_latent))
-    Sigma = (Sigma_pre +
-             tf.matmul(Kxz_Kzz_inv,
-                       tf.matmul(S, Kxz_Kzz_inv, transpose_b=True)) +
-             ridge_factor * tf.eye(Nx))
+    Sigma_diag = tf.nn.relu(
+        Kxx_diag - tf.reduce_sum(tf.square(Kzz_chol_inv_Kzx), axis=0)) + ridge_factor
+    Sigma_factor = tf.matmul(Kxz_Kzz_inv, S_chol)
 
     if compute_mean:
         Mu = tf.tensordot(Kxz_Kzz_inv, m, [[1], [0]], name=mean_name)
     else:
         Mu = None
 
-    return Mu, Sigma
+    return Mu, Sigma_diag, Sigma_factor
+
+
+def make_decoupled_gp_parameters(m, S_chol,
+                                 X, Zm, Zs, ls, kern_func,
+                                 ridge_factor=1e-3,
+                                 mean_name='qf_mean'):
+    """Produces variational parameters for decoupled GP approximation.
+
+    With S = S_chol S_chol^T, Kss = Lss Lss^T and A = Lss^T S_chol, the
+    matrix H = I + S_chol^T Kss S_chol = I + A^T A shares its spectrum with
+    B = I + A A^T. All quantities are computed from a single Cholesky
+    factor of B, where the covariance of q(F)
+        Kxx - Kxs (Kss + S^{-1})^{-1} Kxs^T
+            = (Kxx - P^T P) + P^T B^{-1} P,     P = Lss^{-1} Kxs^T
+    is returned in low-rank-plus-diagonal form, and the KL components are
+        log_det_ss = log|H| = log|B|
+        cond_norm_ss = tr(Kss S_chol H^{-1} S_chol^T) = || chol(B)^{-1} A ||_F^2.
+
+    Args:
+        m: (tf.Tensor) Variational parameter for mean of latent GP, shape (Nm, 1)
+        S_chol: (tf.Tensor) Cholesky factor of variational parameter for
+            covariance of latent GP, shape (Ns, Ns)
+        X: (np.ndarray of float32) input training features, with dimension (Nx, D).
+        Zm: (np.ndarray of float32) inducing points for mean, shape (Nm, D).
+        Zs: (np.ndarray of float32) inducing points for covariance, shape (Ns, D).
+        ls: (float32) length scale parameter.
+        kern_func: (function) stationary kernel function.
+        ridge_factor: (float32) small ridge factor to stabilize Cholesky decomposition
+        mean_name: (str) name for the mean parameter
+
+    Returns:
+        Mu (tf.Tensor) Mean parameters for decoupled Gaussian Process, shape (Nx, ).
+        Sigma_diag (tf.Tensor) Diagonal covariance parameters, shape (Nx, ).
+        Sigma_factor (tf.Tensor) Low-rank covariance parameters, shape (Nx, Ns).
+        func_norm_mm, log_det_ss, cond_norm_ss: (tf.Tensor) scalar components
+            for KL objective.
+    """
+    X = tf.convert_to_tensor(X, dtype=tf.float32)
+    Zm = tf.convert_to_tensor(Zm, dtype=tf.float32)
+    Zs = tf.convert_to_tensor(Zs, dtype=tf.float32)
+    Nx, Ns = X.shape.as_list()[0], Zs.shape.as_list()[0]
+
+    # compute matrix constants,
+    # kernel is stationary, therefore diag(Kxx) is constant.
+    Kxx_diag = tf.fill([Nx], tf.reshape(kern_func(X[:1], ls=ls), []))
+    Kmm = kern_func(Zm, ls=ls)
+    Kxm = kern_func(X, Zm, ls=ls)
+    Kxs = kern_func(X, Zs, ls=ls)
+    Kss = kern_func(Zs, ls=ls, ridge_factor=ridge_factor)
+
+    # Cholesky factor of B = I + A A^T
+    Kss_chol = tf.cholesky(Kss)
+    A = tf.matmul(Kss_chol, S_chol, transpose_a=True)
+    B_chol = tf.cholesky(tf.eye(Ns) + tf.matmul(A, A, transpose_b=True))
+
+    # components for KL objective
+    func_norm_mm = tf.reduce_sum(m * tf.matmul(Kmm, m))
+    log_det_ss = 2. * tf.reduce_sum(tf.log(tf.matrix_diag_part(B_chol)))
+    cond_norm_ss = tf.reduce_sum(tf.square(tf.matrix_triangular_solve(B_chol, A)))
+
+    # compute decoupled gp variational parameter
+    Kss_chol_inv_Ksx = tf.matrix_triangular_solve(Kss_chol, tf.transpose(Kxs))
+    Sigma_diag = tf.nn.relu(
+        Kxx_diag - tf.reduce_sum(tf.square(Kss_chol_inv_Ksx), axis=0)) + ridge_factor
+    Sigma_factor = tf.transpose(
+        tf.matrix_triangular_solve(B_chol, Kss_chol_inv_Ksx))
+
+    Mu = tf.squeeze(tf.tensordot(Kxm, m, [[1], [0]]), axis=-1, name=mean_name)
+
+    return Mu, Sigma_diag, Sigma_factor, func_norm_mm, log_det_ss, cond_norm_ss
 
 
 def make_cond_gp_parameters(K_00, K_11, K_22,
@@ -80,45 +164,77 @@ def make_cond_gp_parameters(K_00, K_11, K_22,
                             ridge_factor_Sigma=1e-3):
     """Computes the conditional posterior for f_new|f_obs, f_deriv.
 
-    For stability, numpy is used instead of tensorflow.
+    Denote f_od = [f_obs, f_deriv] and K_odod its (block) covariance. With the
+    block Cholesky factor of K_odod:
 
+            L = [L_11   0   ],      L_11 = chol(K_11),
+                [L_21   L_22]       L_21 = K_21 L_11^{-T},
+                                    L_22 = chol(K_22 - L_21 L_21^T),
+
+    where K_22 - L_21 L_21^T is the Schur complement of K_11, and
+    A = L^{-1} [K_01, K_20^T]^T, the conditional f_new | f_od is:
+
+            E(f_new | f_od) = A^T L^{-1} f_od = [P_01, P_02] f_od
+            Var(f_new | f_od) = K_00 - A^T A
+
+    For stability, all computation is done in numpy float64 in one pass.
+
+    Args:
+        K_00: (tf.Tensor or np.ndarray) Cov(f_new), shape (N_new, N_new).
+        K_11: (tf.Tensor or np.ndarray) Cov(f_obs), shape (N_obs, N_obs).
+        K_22: (tf.Tensor or np.ndarray) Cov(f_deriv), shape (N_deriv, N_deriv).
+        K_01: (tf.Tensor or np.ndarray) Cov(f_new, f_obs), shape (N_new, N_obs).
+        K_20: (tf.Tensor or np.ndarray) Cov(f_deriv, f_new),
+            shape (N_deriv, N_new).
+        K_21: (tf.Tensor or np.ndarray) Cov(f_deriv, f_obs),
+            shape (N_deriv, N_obs).
+        ridge_factor_K: (float32) ridge factor added to diagonal of K_odod.
+        ridge_factor_Sigma: (float32) ridge factor added to diagonal of Sigma.
+
+    Returns:
+        P_01: (np.ndarray of float32) Projection from f_obs to f_new,
+            shape (N_new, N_obs).
+        P_02: (np.ndarray of float32) Projection from f_deriv to f_new,
+            shape (N_new, N_deriv).
+        Sigma_chol: (np.ndarray of float32) Cholesky factor of
+            Var(f_new | f_od), shape (N_new, N_new).
     """
-    # convert to np array
-    with tf.Session() as sess:
-        K_00, K_11, K_22, K_01, K_20, K_21 = sess.run([
-            K_00, K_11, K_22, K_01, K_20, K_21
-        ])
-        K_00 = K_00.astype(np.float64)
-        K_11 = K_11.astype(np.float64)
-        K_22 = K_22.astype(np.float64)
-        K_01 = K_01.astype(np.float64)
-        K_20 = K_20.astype(np.float64)
-        K_21 = K_21.astype(np.float64)
-
-    # compute matrix components
-    K_11_inv_12 = np.matmul(np.linalg.pinv(K_11), K_21.T)
-    K_22_inv_21 = np.matmul(np.linalg.pinv(K_22), K_21)
-
-    # assemble projection matrix
-    K_02_1 = K_20.T - np.matmul(K_01, K_11_inv_12)
-    K_22_1 = (K_22 - np.matmul(K_21, K_11_inv_12) +
+    K_mats = [K_00, K_11, K_22, K_01, K_20, K_21]
+
+    # convert to np array, evaluating all tensors in a single run.
+    tensor_ids = [mat_id for mat_id, K_mat in enumerate(K_mats)
+                  if isinstance(K_mat, tf.Tensor)]
+    if tensor_ids:
+        with tf.Session() as sess:
+            tensor_vals = sess.run([K_mats[mat_id] for mat_id in tensor_ids])
+        for mat_id, K_val in zip(tensor_ids, tensor_vals):
+            K_mats[mat_id] = K_val
+
+    K_00, K_11, K_22, K_01, K_20, K_21 = [
+        np.asarray(K_mat, dtype=np.float64) for K_mat in K_mats]
+    N_obs = K_11.shape[0]
+
+    # block Cholesky decomposition of K_odod through Schur complement of K_11.
+    L_11 = matrix_util.cholesky_jitter(K_11 + ridge_factor_K * np.eye(N_obs))
+    L_21 = linalg.solve_triangular(L_11, K_21.T, lower=True).T
+    K_22_1 = (K_22 - np.matmul(L_21, L_21.T) +
               ridge_factor_K * np.eye(K_22.shape[0]))
-    K_01_2 = K_01 - np.matmul(K_20.T, K_22_inv_21)
-    K_11_2 = K_11 - np.matmul(K_21.T, K_22_inv_21)
+    L_22 = matrix_util.cholesky_jitter(K_22_1)
 
-    # compute mean projection matrix
-    P_01 = np.matmul(K_01_2, np.linalg.pinv(K_11_2))
-    P_02 = np.matmul(K_02_1, np.linalg.pinv(K_22_1))
+    L = np.block([[L_11, np.zeros((N_obs, K_22.shape[0]))],
+                  [L_21, L_22]])
 
-    # compute Cholesky decomposition for covariance matrix.
-    Sigma = K_00 - K_01.dot(np.linalg.pinv(K_11).dot(K_01.T))
-    # np.matmul(P_01, K_01.T)
-    # - np.matmul(P_02, K_20) +
-    # ridge_factor_Sigma * np.eye(K_00.shape[0]))
+    # projection matrix and conditional covariance.
+    A = linalg.solve_triangular(L, np.concatenate([K_01.T, K_20], axis=0),
+                                lower=True)
+    P = linalg.solve_triangular(L.T, A, lower=False).T
 
-    # Sigma_chol = np.linalg.cholesky(Sigma).astype(np.float32)
+    Sigma = K_00 - np.matmul(A.T, A) + ridge_factor_Sigma * np.eye(K_00.shape[0])
+    Sigma_chol = matrix_util.cholesky_jitter(Sigma)
 
-    return P_01.astype(np.float32), P_02.astype(np.float32), Sigma
+    return (P[:, :N_obs].astype(np.float32),
+            P[:, N_obs:].astype(np.float32),
+            Sigma_chol.astype(np.float32))
 
 
 def make_mfvi_mixture_family(n_mixture, N, name):
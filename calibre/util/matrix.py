@@ -1,7 +1,23 @@
 """Utility functions for Matrix Operations in Tensorflow/Numpy"""
+import itertools
+
 import numpy as np
+import scipy.linalg as linalg
 import tensorflow as tf
 
+# linear algebra backend for large GP solves and log determinants,
+# see set_linalg_backend.
+LINALG_BACKEND_DENSE = "dense"
+LINALG_BACKEND_ITERATIVE = "iterative"
+
+_LINALG_BACKEND = LINALG_BACKEND_DENSE
+
+# default settings for iterative backend.
+DEFAULT_CG_MAX_ITER = 100
+DEFAULT_CG_TOL = 1e-4
+DEFAULT_SLQ_NUM_PROBE = 10
+DEFAULT_SLQ_SEED = 0
+
 
 def pinv(A, reltol=1e-15):
     # Compute the SVD of the input matrix A
@@ -68,4 +84,557 @@ def make_block_matrix(M_00, M_01, M_11=None, ridge_factor=0.):
             ridge_mat = ridge_factor * tf.eye(concat_mat.shape.as_list()[0])
             return concat_mat + ridge_mat
         else:
-            return tf.concat([M_00, M_01], axis=1)
\ No newline at end of file
+            return tf.concat([M_00, M_01], axis=1)
+
+def cholesky_jitter(A, init_jitter=1e-10, max_tries=10):
+    """Computes Cholesky decomposition with adaptive jitter.
+
+    Adds a ridge of size jitter * mean(diag(A)) to the diagonal of A,
+    starting from zero then init_jitter and increasing tenfold until the
+    decomposition succeeds.
+
+    Args:
+        A: (np.ndarray) Symmetric positive semi-definite matrix, shape (N, N).
+        init_jitter: (float) Initial jitter relative to mean diagonal of A.
+        max_tries: (int) Maximum number of jitter values to try.
+
+    Returns:
+        (np.ndarray of float64) Lower-triangular Cholesky factor, shape (N, N).
+
+    Raises:
+        (np.linalg.LinAlgError) If decomposition fails after max_tries.
+    """
+    A = np.asarray(A, dtype=np.float64)
+    diag_scale = np.mean(np.abs(np.diag(A))) if A.size else 1.
+
+    jitter = 0.
+    for _ in range(max_tries + 1):
+        try:
+            return np.linalg.cholesky(A + jitter * diag_scale * np.eye(A.shape[0]))
+        except np.linalg.LinAlgError:
+            jitter = init_jitter if jitter == 0. else jitter * 10.
+
+    raise np.linalg.LinAlgError(
+        "Cholesky decomposition failed with maximum jitter {}.".format(
+            jitter / 10. * diag_scale))
+
+
+def gaussian_conditional(K_chol, K_xn, K_nn, f_sample=None):
+    """Computes Gaussian conditional f_new | f using Cholesky factor of Cov(f).
+
+    With K = L L^T, A = L^{-1} K_xn:
+
+        E(f_new | f) = A^T L^{-1} f
+        Var(f_new | f) = K_nn - A^T A
+
+    Args:
+        K_chol: (np.ndarray) Cholesky factor of Cov(f), shape (N, N).
+        K_xn: (np.ndarray) Cov(f, f_new), shape (N, N_new).
+        K_nn: (np.ndarray or None) Cov(f_new), shape (N_new, N_new).
+            If None then conditional covariance is not computed.
+        f_sample: (np.ndarray or None) Samples of f, shape (N, M).
+            If None then conditional mean is not computed.
+
+    Returns:
+        cond_mean: (np.ndarray of float64 or None) shape (N_new, M).
+        cond_cov: (np.ndarray of float64 or None) shape (N_new, N_new).
+    """
+    A = linalg.solve_triangular(K_chol, K_xn, lower=True)
+
+    cond_mean, cond_cov = None, None
+    if f_sample is not None:
+        cond_mean = np.matmul(
+            A.T, linalg.solve_triangular(K_chol, f_sample, lower=True))
+    if K_nn is not None:
+        cond_cov = K_nn - np.matmul(A.T, A)
+
+    return cond_mean, cond_cov
+
+
+def sample_gaussian_chol(cond_mean, cond_cov, n_sample=None):
+    """Draws Gaussian samples through one (jittered) Cholesky of covariance.
+
+    Args:
+        cond_mean: (np.ndarray) Mean vectors, shape (N, M) (one column per
+            sample) or (N, ).
+        cond_cov: (np.ndarray) Covariance matrix, shape (N, N).
+        n_sample: (int or None) Number of samples if cond_mean is a vector.
+
+    Returns:
+        (np.ndarray of float64) Samples, shape (N, M).
+    """
+    cond_mean = np.asarray(cond_mean)
+    if cond_mean.ndim == 1:
+        cond_mean = np.tile(cond_mean[:, np.newaxis], (1, n_sample or 1))
+
+    cov_chol = cholesky_jitter(cond_cov)
+    eps = np.random.normal(size=cond_mean.shape)
+
+    return cond_mean + np.matmul(cov_chol, eps)
+
+
+def toeplitz_matmul(col, V):
+    """Multiplies symmetric Toeplitz matrix with matrix V using FFT.
+
+    The G x G Toeplitz matrix T with first column col is embedded into a
+    circulant matrix of size 2G - 2, such that T V costs O(G log G) per
+    column of V instead of O(G^2).
+
+    Args:
+        col: (tf.Tensor of float32) First column of T, shape (G, ), G >= 2.
+        V: (tf.Tensor of float32) Matrix of shape (G, M).
+
+    Returns:
+        (tf.Tensor of float32) T V, shape (G, M).
+    """
+    num_grid = tf.shape(col)[0]
+    num_circ = 2 * num_grid - 2
+
+    circ_col = tf.concat([col, tf.reverse(col[1:-1], axis=[0])], axis=0)
+    V_pad = tf.pad(V, [[0, num_grid - 2], [0, 0]])
+
+    circ_fft = tf.spectral.rfft(circ_col)
+    V_fft = tf.spectral.rfft(tf.transpose(V_pad))
+
+    TV = tf.spectral.irfft(circ_fft * V_fft, fft_length=[num_circ])
+    return tf.transpose(TV)[:num_grid]
+
+
+def kronecker_toeplitz_matmul(col_list, V):
+    """Multiplies Kronecker product of symmetric Toeplitz matrices with V.
+
+    Computes (T_1 kron ... kron T_D) V by applying toeplitz_matmul along one
+    grid dimension at a time, with cost O(G sum_d log G_d) per column of V,
+    where G = prod_d G_d.
+
+    Args:
+        col_list: (list of tf.Tensor of float32) First columns of T_d, each
+            of static shape (G_d, ).
+        V: (tf.Tensor of float32) Matrix of shape (G, M).
+
+    Returns:
+        (tf.Tensor of float32) Matrix product, shape (G, M).
+    """
+    grid_sizes = [col.shape.as_list()[0] for col in col_list]
+    num_dim = len(grid_sizes)
+
+    V_grid = tf.reshape(V, grid_sizes + [-1])
+
+    for dim, col in enumerate(col_list):
+        perm = [dim] + [axis for axis in range(num_dim + 1) if axis != dim]
+
+        V_perm = tf.transpose(V_grid, perm)
+        perm_shape = tf.shape(V_perm)
+
+        V_perm = toeplitz_matmul(col, tf.reshape(V_perm, [grid_sizes[dim], -1]))
+        V_grid = tf.transpose(tf.reshape(V_perm, perm_shape), np.argsort(perm))
+
+    return tf.reshape(V_grid, [np.prod(grid_sizes), -1])
+
+
+def kronecker_matmul(mat_list, V, transpose_a=False):
+    """Multiplies Kronecker product of dense matrices with V.
+
+    Computes (A_1 kron ... kron A_D) V by contracting one grid dimension at
+    a time, with cost O(G sum_d G_d) per column of V, where G = prod_d G_d,
+    such that the G x G Kronecker product is never formed.
+
+    Args:
+        mat_list: (list of tf.Tensor) Square matrices A_d, each of static
+            shape (G_d, G_d).
+        V: (tf.Tensor) Matrix of shape (G, M).
+        transpose_a: (bool) If True then multiply with the transpose of the
+            Kronecker product (i.e. with A_1^T kron ... kron A_D^T).
+
+    Returns:
+        (tf.Tensor) Matrix product, shape (G, M).
+    """
+    grid_sizes = [mat.shape.as_list()[0] for mat in mat_list]
+    num_dim = len(grid_sizes)
+
+    V_grid = tf.reshape(V, grid_sizes + [-1])
+
+    for dim, mat in enumerate(mat_list):
+        V_grid = tf.tensordot(mat, V_grid,
+                              axes=[[0 if transpose_a else 1], [dim]])
+        # move contracted dimension back to its position
+        perm = list(range(1, dim + 1)) + [0] + list(range(dim + 1, num_dim + 1))
+        V_grid = tf.transpose(V_grid, perm)
+
+    return tf.reshape(V_grid, [np.prod(grid_sizes), -1])
+
+
+def interpolation_weights(X, grid_list):
+    """Computes sparse multilinear interpolation weights onto a regular grid.
+
+    Each row of X is interpolated from the 2^D corners of its enclosing grid
+    cell. Grid points are ordered as in the Kronecker product of the grid
+    dimensions (i.e. the first dimension varies slowest). Points outside the
+    grid are assigned to the nearest boundary cell. For a degenerate
+    (zero-width) grid dimension, e.g. a constant feature, all weight of that
+    dimension is put on its first grid point.
+
+    Args:
+        X: (np.ndarray) Input locations, shape (N, D).
+        grid_list: (list of np.ndarray) Equally spaced grid for each of the
+            D dimensions, each of size G_d >= 2.
+
+    Returns:
+        indices: (np.ndarray of int64) Sparse indices, shape (N * 2^D, 2),
+            in row-major order.
+        values: (np.ndarray of float32) Interpolation weights, shape (N * 2^D, ).
+        dense_shape: (tuple of int) Shape of the interpolation matrix (N, G).
+    """
+    X = np.asarray(X)
+    num_obs, num_dim = X.shape
+
+    grid_sizes = [len(grid) for grid in grid_list]
+    grid_strides = np.cumprod([1] + grid_sizes[:0:-1])[::-1]
+
+    # locate enclosing grid cell and relative position within cell
+    cell_index, cell_frac = [], []
+    for dim, grid in enumerate(grid_list):
+        grid_step = (grid[-1] - grid[0]) / (len(grid) - 1)
+        if grid_step <= 0:
+            grid_pos = np.zeros(num_obs)
+        else:
+            grid_pos = (X[:, dim] - grid[0]) / grid_step
+
+        index = np.clip(np.floor(grid_pos).astype(np.int64), 0, len(grid) - 2)
+        cell_index.append(index)
+        cell_frac.append(np.clip(grid_pos - index, 0., 1.))
+
+    # collect weights for each corner of the cell
+    col_list, value_list = [], []
+    for corner in itertools.product([0, 1], repeat=num_dim):
+        col = np.zeros(num_obs, dtype=np.int64)
+        value = np.ones(num_obs)
+        for dim, offset in enumerate(corner):
+            col += (cell_index[dim] + offset) * grid_strides[dim]
+            value *= cell_frac[dim] if offset else 1. - cell_frac[dim]
+
+        col_list.append(col)
+        value_list.append(value)
+
+    rows = np.tile(np.arange(num_obs, dtype=np.int64), len(col_list))
+    cols = np.concatenate(col_list)
+    values = np.concatenate(value_list)
+
+    order = np.lexsort((cols, rows))
+    indices = np.stack([rows[order], cols[order]], axis=-1)
+
+    return indices, values[order].astype(np.float32), (num_obs, int(np.prod(grid_sizes)))
+
+
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+""" Iterative Linear Algebra """
+""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+
+
+def set_linalg_backend(backend):
+    """Sets linear algebra backend for GP solves and log determinants.
+
+    Args:
+        backend: (str) Either "dense" (Cholesky factorization) or "iterative"
+            (conjugate gradient and stochastic Lanczos quadrature, only
+            requiring matrix-vector products).
+
+    The backend is a global setting, honoured by the GP log densities and
+    solves built in the TensorFlow graph: gaussian_process.prior (if no
+    scale_tril is given), gaussian_process.prior_ski,
+    gaussian_process.sample_posterior_mean and psd_solve (e.g. in
+    gp_regression_monotone.deriv_prior). Functions that need an explicit
+    Cholesky factor (gaussian_process.prior_scale_tril, prior_scale_tril_bank,
+    prior_whitened and unwhiten without scale_tril, hence also the whitened,
+    fixed length scale and length scale grid options of the tail-free MCMC)
+    raise ValueError under the "iterative" backend. The numpy posterior
+    samplers (e.g. gaussian_process.sample_posterior_full and
+    inference.make_cond_gp_parameters) always factorize densely.
+
+    Raises:
+        (ValueError) If backend is not recognized.
+    """
+    global _LINALG_BACKEND
+
+    if backend not in (LINALG_BACKEND_DENSE, LINALG_BACKEND_ITERATIVE):
+        raise ValueError("Linear algebra backend must be one of "
+                         "('{}', '{}'), observed '{}'.".format(
+            LINALG_BACKEND_DENSE, LINALG_BACKEND_ITERATIVE, backend))
+
+    _LINALG_BACKEND = backend
+
+
+def get_linalg_backend():
+    """Returns current linear algebra backend, see set_linalg_backend."""
+    return _LINALG_BACKEND
+
+
+def conjugate_gradient(matmul_fn, B, precond_diag=None,
+                       max_iter=DEFAULT_CG_MAX_ITER, tol=DEFAULT_CG_TOL):
+    """Solves A X = B by batched (Jacobi-preconditioned) conjugate gradient.
+
+    All columns of B are solved simultaneously, such that each iteration
+    costs one matrix product A V with V of shape (N, M). Columns stop
+    updating once their relative residual falls below tol.
+
+    The CG step sizes alpha and directions beta define the Lanczos
+    tridiagonal matrix of the preconditioned operator, see lanczos_quadrature.
+
+    Args:
+        matmul_fn: (function) Function computing A V for V of shape (N, M),
+            with A symmetric positive definite.
+        B: (tf.Tensor of float32) Right hand sides, shape (N, M).
+        precond_diag: (tf.Tensor of float32 or None) Diagonal preconditioner,
+            shape (N, ). If None then no preconditioning.
+        max_iter: (int) Maximum number of iterations.
+        tol: (float) Relative residual tolerance.
+
+    Returns:
+        X: (tf.Tensor of float32) Solution, shape (N, M).
+        cg_alphas: (tf.Tensor of float32) Step sizes, shape (num_iter, M).
+        cg_betas: (tf.Tensor of float32) Direction updates, shape (num_iter, M).
+        cg_active: (tf.Tensor of float32) 1 if column was updated at
+            iteration, 0 otherwise, shape (num_iter, M).
+    """
+    B = tf.convert_to_tensor(B, dtype=tf.float32)
+    if precond_diag is None:
+        precond_diag = tf.ones_like(B[:, 0])
+
+    precond_diag = tf.expand_dims(precond_diag, -1)
+
+    B_norm = tf.norm(B, axis=0)
+
+    def _safe_div(num, denom):
+        return num / tf.where(tf.equal(denom, 0.), tf.ones_like(denom), denom)
+
+    def _cond(step, X, R, P, RZ, active, *_):
+        return tf.logical_and(step < max_iter, tf.reduce_any(active > 0.))
+
+    def _body(step, X, R, P, RZ, active, alpha_arr, beta_arr, active_arr):
+        AP = matmul_fn(P)
+
+        alpha = active * _safe_div(RZ, tf.reduce_sum(P * AP, axis=0))
+        X = X + alpha * P
+        R = R - alpha * AP
+
+        Z = R / precond_diag
+        RZ_new = tf.reduce_sum(R * Z, axis=0)
+        beta = active * _safe_div(RZ_new, RZ)
+        P = tf.where(tf.tile(active[tf.newaxis] > 0., [tf.shape(P)[0], 1]),
+                     Z + beta * P, P)
+
+        alpha_arr = alpha_arr.write(step, alpha)
+        beta_arr = beta_arr.write(step, beta)
+        active_arr = active_arr.write(step, active)
+
+        active = active * tf.cast(tf.norm(R, axis=0) > tol * B_norm, tf.float32)
+
+        return (step + 1, X, R, P, tf.where(active > 0., RZ_new, RZ), active,
+                alpha_arr, beta_arr, active_arr)
+
+    Z_init = B / precond_diag
+    loop_vars = (tf.constant(0),
+                 tf.zeros_like(B), B, Z_init,
+                 tf.reduce_sum(B * Z_init, axis=0),
+                 tf.cast(B_norm > 0., tf.float32),
+                 tf.TensorArray(tf.float32, size=0, dynamic_size=True),
+                 tf.TensorArray(tf.float32, size=0, dynamic_size=True),
+                 tf.TensorArray(tf.float32, size=0, dynamic_size=True))
+
+    (_, X, _, _, _, _,
+     alpha_arr, beta_arr, active_arr) = tf.while_loop(_cond, _body, loop_vars,
+                                                      back_prop=False)
+
+    return X, alpha_arr.stack(), beta_arr.stack(), active_arr.stack()
+
+
+def lanczos_quadrature(cg_alphas, cg_betas, cg_active):
+    """Computes Lanczos quadrature e1^T log(T) e1 from CG coefficients.
+
+    For a CG run started from b, the Lanczos tridiagonal matrix T of the
+    (preconditioned) operator has
+
+        T[j, j] = 1 / alpha_j + beta_{j-1} / alpha_{j-1},
+        T[j, j+1] = sqrt(beta_j) / alpha_j,
+
+    such that b^T log(A) b / ||b||^2 is approximated by
+    sum_k tau_k^2 log(lambda_k), with (lambda_k, tau_k) the eigenvalues
+    and first eigenvector components of T. Iterations after convergence
+    are padded with a decoupled identity block, contributing zero.
+
+    Args:
+        cg_alphas: (tf.Tensor of float32) Step sizes, shape (num_iter, M).
+        cg_betas: (tf.Tensor of float32) Direction updates, shape (num_iter, M).
+        cg_active: (tf.Tensor of float32) Activity mask, shape (num_iter, M).
+
+    Returns:
+        (tf.Tensor of float32) Quadrature estimates, shape (M, ).
+    """
+    alphas = tf.transpose(cg_alphas)
+    betas = tf.transpose(cg_betas)
+    active = tf.transpose(cg_active)
+
+    alphas_safe = tf.where(active > 0., alphas, tf.ones_like(alphas))
+    alphas_prev = tf.pad(alphas_safe[:, :-1], [[0, 0], [1, 0]], constant_values=1.)
+    betas_prev = tf.pad(betas[:, :-1], [[0, 0], [1, 0]])
+
+    diag = tf.where(active > 0.,
+                    1. / alphas_safe + betas_prev / alphas_prev,
+                    tf.ones_like(alphas))
+    off_diag = (active[:, 1:] *
+                tf.sqrt(tf.maximum(betas[:, :-1], 0.)) / alphas_safe[:, :-1])
+
+    upper = tf.pad(tf.matrix_diag(off_diag), [[0, 0], [0, 1], [1, 0]])
+    tridiag = tf.matrix_diag(diag) + upper + tf.matrix_transpose(upper)
+
+    eig_vals, eig_vecs = tf.self_adjoint_eig(tf.cast(tridiag, tf.float64))
+    eig_vals = tf.maximum(eig_vals, np.finfo(np.float64).tiny)
+
+    quad = tf.reduce_sum(tf.square(eig_vecs[:, 0, :]) * tf.log(eig_vals), axis=-1)
+    return tf.cast(quad, tf.float32)
+
+
+def rademacher_probes(num_dim, num_probe=DEFAULT_SLQ_NUM_PROBE,
+                      seed=DEFAULT_SLQ_SEED):
+    """Generates fixed Rademacher probe vectors for stochastic trace estimation.
+
+    Args:
+        num_dim: (int) Dimension N.
+        num_probe: (int) Number of probe vectors T.
+        seed: (int) Random seed.
+
+    Returns:
+        (np.ndarray of float32) Probe vectors, shape (N, T).
+    """
+    rng = np.random.RandomState(seed)
+    return rng.choice([-1., 1.], size=(num_dim, num_probe)).astype(np.float32)
+
+
+def iterative_quad_logdet(matmul_fn, Y, precond_diag=None,
+                          num_probe=DEFAULT_SLQ_NUM_PROBE,
+                          max_iter=DEFAULT_CG_MAX_ITER, tol=DEFAULT_CG_TOL,
+                          seed=DEFAULT_SLQ_SEED):
+    """Computes y^T A^{-1} y and log|A| using CG and stochastic Lanczos quadrature.
+
+    Runs one batched CG over [Y, probes]. Since gradients through the CG
+    iterations are not needed, the returned tensors are surrogates whose
+    values are the CG/SLQ estimates, and whose gradients follow from
+
+        d(y^T A^{-1} y) = 2 alpha^T dy - alpha^T dA alpha,    alpha = A^{-1} y
+        d log|A| = tr(A^{-1} dA) ~ mean_t u_t^T dA (D^{-1} z_t),  u_t = A^{-1} z_t
+
+    with alpha and u_t held fixed, i.e. only one extra product with A.
+    Probes z_t = D^{1/2} eps_t use fixed Rademacher eps_t, so the estimate is
+    deterministic across evaluations.
+
+    Args:
+        matmul_fn: (function) Function computing A V for V of shape (N, M).
+        Y: (tf.Tensor of float32) Vectors for quadratic form, shape (N, M).
+        precond_diag: (tf.Tensor of float32 or None) Diagonal preconditioner,
+            shape (N, ). If None then no preconditioning.
+        num_probe: (int) Number of probe vectors for log determinant.
+        max_iter: (int) Maximum number of CG iterations.
+        tol: (float) Relative residual tolerance for CG.
+        seed: (int) Random seed for probe vectors.
+
+    Returns:
+        quad_form: (tf.Tensor of float32) y^T A^{-1} y for each column, shape (M, ).
+        log_det: (tf.Tensor of float32) log|A|, scalar.
+    """
+    Y = tf.convert_to_tensor(Y, dtype=tf.float32)
+    num_dim = Y.shape.as_list()[0]
+    num_col = tf.shape(Y)[1]
+
+    if precond_diag is None:
+        precond_diag = tf.ones([num_dim], dtype=tf.float32)
+    precond_diag = tf.stop_gradient(precond_diag)
+
+    eps = rademacher_probes(num_dim, num_probe, seed)
+    probes = tf.sqrt(tf.expand_dims(precond_diag, -1)) * eps
+
+    solution, cg_alphas, cg_betas, cg_active = conjugate_gradient(
+        matmul_fn, tf.stop_gradient(tf.concat([Y, probes], axis=1)),
+        precond_diag=precond_diag, max_iter=max_iter, tol=tol)
+    solution = tf.stop_gradient(solution)
+
+    alpha, probe_solution = solution[:, :num_col], solution[:, num_col:]
+
+    # values from CG and stochastic Lanczos quadrature
+    slq_quad = lanczos_quadrature(cg_alphas[:, num_col:],
+                                  cg_betas[:, num_col:],
+                                  cg_active[:, num_col:])
+    log_det_val = (tf.reduce_sum(tf.log(precond_diag)) +
+                   num_dim * tf.reduce_mean(slq_quad))
+
+    # surrogates carrying gradients through one product with A
+    A_sur = matmul_fn(tf.concat([alpha, eps / tf.sqrt(
+        tf.expand_dims(precond_diag, -1))], axis=1))
+
+    quad_form = (2. * tf.reduce_sum(alpha * Y, axis=0) -
+                 tf.reduce_sum(alpha * A_sur[:, :num_col], axis=0))
+
+    trace_sur = tf.reduce_mean(tf.reduce_sum(
+        probe_solution * A_sur[:, num_col:], axis=0))
+    log_det = tf.stop_gradient(log_det_val) + trace_sur - tf.stop_gradient(trace_sur)
+
+    return quad_form, log_det
+
+
+def psd_solve(A, B, max_iter=DEFAULT_CG_MAX_ITER, tol=DEFAULT_CG_TOL):
+    """Solves A X = B for symmetric positive definite A under current backend.
+
+    Uses Cholesky factorization for the "dense" backend, and conjugate
+    gradient for the "iterative" backend (with gradients through the CG
+    solution via the implicit function theorem).
+
+    Args:
+        A: (tf.Tensor of float32) Symmetric positive definite matrix, shape (N, N).
+        B: (tf.Tensor of float32) Right hand sides, shape (N, M).
+        max_iter: (int) Maximum number of CG iterations.
+        tol: (float) Relative residual tolerance for CG.
+
+    Returns:
+        (tf.Tensor of float32) Solution, shape (N, M).
+    """
+    if _LINALG_BACKEND == LINALG_BACKEND_DENSE:
+        return tf.cholesky_solve(tf.cholesky(A), B)
+
+    return cg_solve(lambda V: tf.matmul(A, V), B,
+                    precond_diag=tf.matrix_diag_part(A),
+                    max_iter=max_iter, tol=tol)
+
+
+def cg_solve(matmul_fn, B, precond_diag=None,
+             max_iter=DEFAULT_CG_MAX_ITER, tol=DEFAULT_CG_TOL):
+    """Solves A X = B by conjugate gradient, differentiable in A and B.
+
+    The CG iterations are not back-propagated through. Instead, the solution
+    is offset by a zero-valued function of the residual R = B - A X whose
+    gradient is a CG solve, such that dX = A^{-1}(dB - dA X).
+
+    Args:
+        matmul_fn: (function) Function computing A V for V of shape (N, M),
+            with A symmetric positive definite.
+        B: (tf.Tensor of float32) Right hand sides, shape (N, M).
+        precond_diag: (tf.Tensor of float32 or None) Diagonal preconditioner.
+        max_iter: (int) Maximum number of iterations.
+        tol: (float) Relative residual tolerance.
+
+    Returns:
+        (tf.Tensor of float32) Solution, shape (N, M).
+    """
+    if precond_diag is not None:
+        precond_diag = tf.stop_gradient(precond_diag)
+
+    def _solve(R):
+        X, _, _, _ = conjugate_gradient(matmul_fn, R,
+                                        precond_diag=precond_diag,
+                                        max_iter=max_iter, tol=tol)
+        return X
+
+    @tf.custom_gradient
+    def _zero_with_solve_grad(R):
+        return tf.zeros_like(R), _solve
+
+    X = tf.stop_gradient(_solve(tf.stop_gradient(B)))
+    return X + _zero_with_solve_grad(B - matmul_fn(X))
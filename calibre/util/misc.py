@@ -1,4 +1,6 @@
 """Misc helper functions."""
+import hashlib
+
 import numpy as np
 
 
@@ -21,3 +23,24 @@ def find_nearest(array, value):
         idx_list.append(
             np.sum(np.abs(array - value[val_idx, :]), axis=1).argmin())
     return np.asarray(idx_list)
+
+
+def make_hash_key(*arrays):
+    """Return a hashable key identifying the content of a list of arrays.
+
+    Args:
+        *arrays: (np.ndarray, float or None) arrays to hash. None entries
+            are kept as-is in the key.
+
+    Returns:
+        (tuple) A tuple of (shape, dtype, sha1 digest) for each array.
+    """
+    key = []
+    for array in arrays:
+        if array is None:
+            key.append(None)
+            continue
+        array = np.ascontiguousarray(array)
+        key.append((array.shape, array.dtype.str,
+                    hashlib.sha1(array.tobytes()).hexdigest()))
+    return tuple(key)